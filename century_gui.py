@@ -10,26 +10,53 @@
 # 2025-11-17 (v28)
 # ---
 
-#Para começar, execute esta célula abaixo para instalar os pacotes necessários (instalação única) e a próxima (código) para iniciar a aplicação GUI.
+#Para começar, instale os pacotes necessários (instalação única): pip install FreeSimpleGUI pandas rasterio
+#Depois execute o script (ou a célula do notebook) para iniciar a aplicação GUI.
 
 import sys
-!{sys.executable} -m pip install FreeSimpleGUI pandas rasterio
+try:
+    import FreeSimpleGUI as sg
+    import pandas as pd
+    import numpy as np
+except ImportError as e:
+    raise SystemExit(f"Pacote não encontrado ({e.name}). Instale os pacotes necessários com:\n"
+                     f"{sys.executable} -m pip install FreeSimpleGUI pandas rasterio")
 
 
 # ---
 
 
-import FreeSimpleGUI as sg
 import os
 import re
 from pathlib import Path
 import math
-import pandas as pd
-import sys
+import time
+import json
+import datetime
+import contextlib
+import threading
+import queue
+import itertools
+import bisect
+import codecs
+import operator
+import hashlib
+import shutil
+import multiprocessing
+import tracemalloc
+import concurrent.futures
+import http.server
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
 
 try:
     import rasterio
     import rasterio.sample
+    import rasterio.transform
+    import rasterio.windows
+    import rasterio.warp
     LIBS_INSTALADAS = True
 except ImportError:
     LIBS_INSTALADAS = False
@@ -106,7 +133,32 @@ INITIAL_CROP_OPTIONS = list(CODIGOS_E_DESCRICOES['CROP'].keys())
 INITIAL_TREE_OPTIONS = list(CODIGOS_E_DESCRICOES['TREE'].keys())
 DISPLAY_PARA_CODIGO = {}
 
-BLOCO_PADRAO_SAVANA_EVENTS = [
+def formatar_evento_sch(event_type, code, month, block_num):
+    # Linha(s) do evento no .SCH; usa o código curto do evento (ex: 'CROP: ...' -> 'CROP')
+    linha_evento = f"      {block_num:<5}{month:<5}{event_type.split(':')[0]}\n"
+    if code:
+        linha_evento += f"{code}\n"
+    return linha_evento
+
+class EventosCompilados:
+    # Lista constante de eventos de um bloco, compilada uma única vez: registros imutáveis
+    # (event_type, code, month, block_num) com strings internadas e o texto .SCH já renderizado.
+    # Itera como a lista de dicionários original.
+    __slots__ = ('registros', 'texto')
+
+    def __init__(self, eventos):
+        self.registros = tuple((sys.intern(ev['event_type']), ev['code'] and sys.intern(ev['code']),
+                                sys.intern(ev['month']), sys.intern(ev['block_num'])) for ev in eventos)
+        self.texto = ''.join([formatar_evento_sch(*registro) for registro in self.registros]).rstrip()
+
+    def __iter__(self):
+        for event_type, code, month, block_num in self.registros:
+            yield {'tipo': 'EVENT', 'event_type': event_type, 'code': code, 'month': month, 'block_num': block_num}
+
+    def __len__(self):
+        return len(self.registros)
+
+BLOCO_PADRAO_SAVANA_EVENTS = EventosCompilados([
     {'tipo': 'EVENT', 'event_type': 'CROP', 'code': 'HER', 'month': '1', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'FRST', 'code': None, 'month': '1', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'TREE', 'code': 'CER', 'month': '1', 'block_num': '1'},
@@ -144,10 +196,10 @@ BLOCO_PADRAO_SAVANA_EVENTS = [
     {'tipo': 'EVENT', 'event_type': 'FIRE', 'code': 'CER', 'month': '7', 'block_num': '5'},
     {'tipo': 'EVENT', 'event_type': 'FRST', 'code': None, 'month': '9', 'block_num': '5'},
     {'tipo': 'EVENT', 'event_type': 'TLST', 'code': None, 'month': '12', 'block_num': '5'}
-]
+])
 
 # NOVO BLOCO: Desmatamento + Pastagem Tradicional (2 repetições) - Bloco 2 Manual
-BLOCO_DESMATAMENTO_PASTAGEM_EVENTS = [
+BLOCO_DESMATAMENTO_PASTAGEM_EVENTS = EventosCompilados([
     # Ano 1 (Repetição 1): Manutenção/Savana
     {'tipo': 'EVENT', 'event_type': 'CROP', 'code': 'HER', 'month': '1', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'FRST', 'code': None, 'month': '1', 'block_num': '1'},
@@ -170,13 +222,13 @@ BLOCO_DESMATAMENTO_PASTAGEM_EVENTS = [
     {'tipo': 'EVENT', 'event_type': 'CROP', 'code': 'DEG', 'month': '9', 'block_num': '2'}, # Código DEG (Pastagem degradada)
     {'tipo': 'EVENT', 'event_type': 'PLTM', 'code': None, 'month': '9', 'block_num': '2'},
     {'tipo': 'EVENT', 'event_type': 'FRST', 'code': None, 'month': '9', 'block_num': '2'},
-]
+])
 
 # Bloco para Transição Automática SAVANA -> PASTAGEM (Idêntico ao Bloco 2)
 BLOCO_SAVANA_TO_PASTAGEM_EVENTS = BLOCO_DESMATAMENTO_PASTAGEM_EVENTS
 
 # Bloco de Pastagem (Mantendo Pastagem Tradicional - CROP BE8)
-BLOCO_PASTAGEM_EVENTS = [
+BLOCO_PASTAGEM_EVENTS = EventosCompilados([
     {'tipo': 'EVENT', 'event_type': 'CROP', 'code': 'BE8', 'month': '1', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'GRAZ', 'code': 'GM', 'month': '1', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'GRAZ', 'code': 'GM', 'month': '2', 'block_num': '1'},
@@ -193,10 +245,10 @@ BLOCO_PASTAGEM_EVENTS = [
     {'tipo': 'EVENT', 'event_type': 'GRAZ', 'code': 'GM', 'month': '10', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'GRAZ', 'code': 'GM', 'month': '11', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'GRAZ', 'code': 'GM', 'month': '12', 'block_num': '1'},
-]
+])
 
 # Bloco de Soja (Soja + Pastagem, Simplificado para 1 repetição anual)
-BLOCO_SOJA_EVENTS = [
+BLOCO_SOJA_EVENTS = EventosCompilados([
     # CROP BE8 (Janeiro a Setembro)
     {'tipo': 'EVENT', 'event_type': 'CROP', 'code': 'BE8', 'month': '1', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'GRAZ', 'code': 'GM', 'month': '1', 'block_num': '1'},
@@ -229,47 +281,422 @@ BLOCO_SOJA_EVENTS = [
     # Replantio de Pastagem/Cerrado (Abril)
     {'tipo': 'EVENT', 'event_type': 'CROP', 'code': 'BE8', 'month': '4', 'block_num': '1'},
     {'tipo': 'EVENT', 'event_type': 'FRST', 'code': None, 'month': '4', 'block_num': '1'},
-]
+])
 
 BLOCO_SAVANICA_EVENTS = BLOCO_PADRAO_SAVANA_EVENTS
 
+# Eventos usados em cada tipo de bloco gerado a partir do LULC. Conjuntos alternativos (para varreduras de
+# cenários) são registrados por nome com registrar_conjunto_eventos_lulc
+EVENTOS_LULC_PADRAO = {
+    'SAVANA': BLOCO_SAVANICA_EVENTS,
+    'TRANSICAO': BLOCO_SAVANA_TO_PASTAGEM_EVENTS,
+    'PASTAGEM': BLOCO_PASTAGEM_EVENTS,
+    'SOJA': BLOCO_SOJA_EVENTS,
+}
+CONJUNTOS_EVENTOS_LULC = {'padrao': EVENTOS_LULC_PADRAO}
+
+def registrar_conjunto_eventos_lulc(nome, eventos):
+    # eventos: {tipo de bloco: lista de eventos}; tipos omitidos usam o conjunto padrão
+    desconhecidos = [tipo for tipo in eventos if tipo not in EVENTOS_LULC_PADRAO]
+    if desconhecidos:
+        raise KeyError(f"Tipos de bloco desconhecidos: {', '.join(desconhecidos)}. Use {list(EVENTOS_LULC_PADRAO)}.")
+    conjunto = dict(EVENTOS_LULC_PADRAO)
+    for tipo, lista in eventos.items():
+        conjunto[tipo] = lista if isinstance(lista, EventosCompilados) else EventosCompilados(
+            [dict({'tipo': 'EVENT', 'code': None}, **{chave: str(valor) if valor is not None else None for chave, valor in ev.items()}) for ev in lista])
+    CONJUNTOS_EVENTOS_LULC[nome] = conjunto
+    return conjunto
+
+
+# --- Instrumentação (tempo por etapa/ponto e contadores de I/O) ---
+CONTADORES_METRICAS = ['rasters_abertos', 'pixels_lidos', 'cabecalhos_estacoes_lidos', 'estacoes_lidas', 'cache_hits', 'arquivos_gravados', 'bytes_gravados']
+METRICAS_ATIVAS = None
+_LOCK_METRICAS = threading.Lock()
+
+def iniciar_metricas(rotulo):
+    global METRICAS_ATIVAS
+    METRICAS_ATIVAS = {
+        'rotulo': rotulo,
+        'inicio': time.time(),
+        't0': time.perf_counter(),
+        'contadores': {nome: 0 for nome in CONTADORES_METRICAS},
+        'etapas': {},
+        'pontos': {},
+        'pontos_resumo': {'n': 0, 'soma': 0.0, 'max': 0.0},
+        'registros': [],
+        'niveis': {}
+    }
+    return METRICAS_ATIVAS
+
+def contar_metrica(nome, n=1):
+    m = METRICAS_ATIVAS
+    if m is not None:
+        with _LOCK_METRICAS:
+            m['contadores'][nome] = m['contadores'].get(nome, 0) + n
+
+def registrar_tempo_etapa(etapa, dt, ponto=None):
+    # Versão thread-safe para etapas executadas fora da thread principal (ex: escritor em segundo plano).
+    # Não entra no tempo por ponto, pois corre em paralelo à extração.
+    m = METRICAS_ATIVAS
+    if m is not None:
+        with _LOCK_METRICAS:
+            total, chamadas = m['etapas'].get(etapa, (0.0, 0))
+            m['etapas'][etapa] = (total + dt, chamadas + 1)
+            m['registros'].append({'tipo': 'etapa', 'etapa': etapa, 'ponto': ponto, 'segundos': round(dt, 6)})
+
+@contextlib.contextmanager
+def medir_etapa(etapa, ponto=None):
+    # Nível de aninhamento por thread: etapas de outra thread (pré-carregamento, escritor) não mexem no desta
+    m = METRICAS_ATIVAS
+    thread = threading.get_ident()
+    if m is not None:
+        with _LOCK_METRICAS:
+            m['niveis'][thread] = m['niveis'].get(thread, 0) + 1
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if m is not None:
+            dt = time.perf_counter() - t0
+            with _LOCK_METRICAS:
+                nivel = m['niveis'].pop(thread) - 1
+                if nivel:
+                    m['niveis'][thread] = nivel
+                total, chamadas = m['etapas'].get(etapa, (0.0, 0))
+                m['etapas'][etapa] = (total + dt, chamadas + 1)
+                # Etapas aninhadas (ex: gravação dentro do clima) não somam de novo no tempo do ponto
+                if ponto is not None and nivel == 0:
+                    m['pontos'][ponto] = m['pontos'].get(ponto, 0.0) + dt
+                m['registros'].append({'tipo': 'etapa', 'etapa': etapa, 'ponto': ponto, 'segundos': round(dt, 6)})
+
+def descarregar_metricas(caminho_jsonl=None):
+    # Grava os registros acumulados e esvazia os buffers; usado entre blocos no modo streaming
+    # para manter a memória constante. Só os agregados (etapas/contadores/tempo por ponto) ficam.
+    m = METRICAS_ATIVAS
+    if m is None:
+        return
+    with _LOCK_METRICAS:
+        registros, m['registros'] = m['registros'], []
+        pontos, m['pontos'] = m['pontos'], {}
+    if caminho_jsonl:
+        try:
+            with open(caminho_jsonl, 'a', encoding='utf-8') as f:
+                for reg in registros:
+                    f.write(json.dumps(dict(reg, execucao=m['rotulo']), ensure_ascii=False) + "\n")
+                for ponto, segundos in pontos.items():
+                    f.write(json.dumps({'tipo': 'ponto', 'execucao': m['rotulo'], 'ponto': ponto, 'segundos': round(segundos, 6)}, ensure_ascii=False) + "\n")
+            m['arquivo_jsonl'] = caminho_jsonl
+        except Exception as e:
+            print(f"Erro ao salvar métricas em {caminho_jsonl}: {e}")
+    resumo = m['pontos_resumo']
+    for segundos in pontos.values():
+        resumo['n'] += 1
+        resumo['soma'] += segundos
+        resumo['max'] = max(resumo['max'], segundos)
+
+def finalizar_metricas(caminho_jsonl=None):
+    global METRICAS_ATIVAS
+    descarregar_metricas(caminho_jsonl)
+    m = METRICAS_ATIVAS
+    METRICAS_ATIVAS = None
+    if m is None:
+        return None
+    m['segundos_total'] = time.perf_counter() - m['t0']
+
+    if caminho_jsonl:
+        try:
+            with open(caminho_jsonl, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    'tipo': 'resumo',
+                    'execucao': m['rotulo'],
+                    'inicio': datetime.datetime.fromtimestamp(m['inicio']).isoformat(timespec='seconds'),
+                    'segundos_total': round(m['segundos_total'], 6),
+                    'etapas': {k: {'segundos': round(v[0], 6), 'chamadas': v[1]} for k, v in m['etapas'].items()},
+                    'contadores': m['contadores']
+                }, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Erro ao salvar métricas em {caminho_jsonl}: {e}")
+    return m
 
-def extrair_dados_mapbiomas(folder_path, lat_str, lon_str, nome_sitio):
+def resumo_metricas(m):
+    if not m:
+        return ""
+    c = m['contadores']
+    linhas = [f"--- Métricas ({m['segundos_total']:.2f} s) ---"]
+    for etapa, (segundos, chamadas) in sorted(m['etapas'].items(), key=lambda kv: -kv[1][0]):
+        linhas.append(f" {etapa:<22}{segundos:>9.3f} s  ({chamadas}x)")
+    tempos = m['pontos_resumo']
+    if tempos['n']:
+        linhas.append(f" Tempo por ponto: médio {tempos['soma'] / tempos['n']:.3f} s | máx {tempos['max']:.3f} s")
+    linhas.append(f" Rasters abertos: {c['rasters_abertos']} | Pixels lidos: {c['pixels_lidos']}")
+    linhas.append(f" Estações: {c['cabecalhos_estacoes_lidos']} cabeçalhos, {c['estacoes_lidas']} arquivos completos lidos")
+    linhas.append(f" Cache hits: {c['cache_hits']} | Gravados: {c['arquivos_gravados']} arquivo(s), {c['bytes_gravados'] / 1024:.1f} KiB")
+    if m.get('arquivo_jsonl'):
+        linhas.append(f" Detalhes (JSON Lines): {m['arquivo_jsonl']}")
+    return "\n".join(linhas)
+
+# JSON Lines das ações interativas na pasta de saída: só com a opção marcada na GUI
+METRICAS_INTERATIVAS_JSONL = False
+
+def definir_metricas_interativas(ativo):
+    global METRICAS_INTERATIVAS_JSONL
+    METRICAS_INTERATIVAS_JSONL = bool(ativo)
+
+def finalizar_metricas_interativas():
+    caminho = os.path.join(obter_pasta_saida(), "century_metricas_interativo.jsonl") if METRICAS_INTERATIVAS_JSONL else None
+    m = finalizar_metricas(caminho)
+    if not m:
+        return ""
+    detalhes = f". Métricas em {os.path.basename(caminho)}" if caminho else ""
+    return f"\n\n(Tempo total: {m['segundos_total']:.2f} s{detalhes})"
+
+
+# --- Pasta de saída configurável e gravação atômica/em segundo plano ---
+PASTA_SAIDA_CONFIGURADA = None
+# Escritor em segundo plano da thread atual (ver escritor_em_segundo_plano): um lote rodando numa thread de
+# tarefa não captura as gravações feitas pela thread da GUI (ex: botão "Gerar Arquivo .SCH" durante o lote)
+_ESCRITOR_THREAD = threading.local()
+_CONTADOR_TEMPORARIOS = itertools.count()
+
+def definir_pasta_saida(pasta):
+    global PASTA_SAIDA_CONFIGURADA
+    PASTA_SAIDA_CONFIGURADA = pasta or None
+
+def obter_pasta_saida(pasta_saida=None):
+    # Prioridade: argumento > pasta definida na GUI > variável CENTURY_PASTA_SAIDA > ~/Downloads
+    pasta = pasta_saida or PASTA_SAIDA_CONFIGURADA or os.environ.get('CENTURY_PASTA_SAIDA')
+    if not pasta:
+        return str(Path.home() / "Downloads")
+    os.makedirs(pasta, exist_ok=True)
+    return str(pasta)
+
+def gravar_atomico(caminho, escrever):
+    # Grava num temporário da mesma pasta e renomeia: quem lê nunca vê um arquivo pela metade
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    tmp = os.path.join(pasta, f".{os.path.basename(caminho)}.{os.getpid()}.{next(_CONTADOR_TEMPORARIOS)}.tmp")
+    try:
+        escrever(tmp)
+        os.replace(tmp, caminho)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(caminho)
+
+class EscritorSaidas:
+    # Fila limitada de gravações atendida por threads em segundo plano. A extração segue
+    # enquanto os arquivos são gravados; se o disco ficar para trás, enviar() bloqueia
+    # quando a fila enche (contrapressão), mantendo a memória limitada.
+    def __init__(self, max_pendentes=64, n_threads=1):
+        self.fila = queue.Queue(maxsize=max_pendentes)
+        self.erros = []
+        self.falhas = {}
+        self.gravados = 0
+        self._threads = [threading.Thread(target=self._trabalhar, name=f"EscritorSaidas-{i}", daemon=True) for i in range(n_threads)]
+        for t in self._threads:
+            t.start()
+
+    def _trabalhar(self):
+        while True:
+            tarefa = self.fila.get()
+            if tarefa is None:
+                self.fila.task_done()
+                break
+            caminho, escrever = tarefa
+            t0 = time.perf_counter()
+            try:
+                tamanho = gravar_atomico(caminho, escrever)
+                self.gravados += 1
+                contar_metrica('arquivos_gravados')
+                contar_metrica('bytes_gravados', tamanho)
+            except Exception as e:
+                self.erros.append(f"{os.path.basename(caminho)}: {e}")
+                self.falhas[caminho] = str(e)
+            finally:
+                registrar_tempo_etapa('gravacao', time.perf_counter() - t0)
+                self.fila.task_done()
+
+    def enviar(self, caminho, escrever):
+        self.fila.put((caminho, escrever))
+
+    def fechar(self):
+        for _ in self._threads:
+            self.fila.put(None)
+        for t in self._threads:
+            t.join()
+        return self.erros
+
+@contextlib.contextmanager
+def escritor_em_segundo_plano(max_pendentes=64):
+    # Vale só para as gravações feitas pela thread que abriu o contexto
+    anterior = getattr(_ESCRITOR_THREAD, 'escritor', None)
+    escritor = EscritorSaidas(max_pendentes)
+    _ESCRITOR_THREAD.escritor = escritor
+    try:
+        yield escritor
+    finally:
+        _ESCRITOR_THREAD.escritor = anterior
+        escritor.fechar()
+
+def _gravar(caminho, escrever, ponto=None):
+    escritor = getattr(_ESCRITOR_THREAD, 'escritor', None)
+    if escritor is not None:
+        escritor.enviar(caminho, escrever)
+        return
+    with medir_etapa('gravacao', ponto):
+        tamanho = gravar_atomico(caminho, escrever)
+    contar_metrica('arquivos_gravados')
+    contar_metrica('bytes_gravados', tamanho)
+
+def salvar_csv(df, caminho, ponto=None, **kwargs):
+    _gravar(caminho, lambda tmp: df.to_csv(tmp, **kwargs), ponto)
+
+def salvar_texto(caminho, texto, ponto=None):
+    def escrever(tmp):
+        with open(tmp, 'w') as f:
+            f.write(texto)
+    _gravar(caminho, escrever, ponto)
+
+def listar_rasters_mapbiomas(folder_path):
+    rasters_encontrados = []
+    for f in os.listdir(folder_path):
+        if f.endswith(('.tif', '.tiff')):
+            match = re.match(r'.*(\d{4}).*\.tif.*', f, re.IGNORECASE)
+            if match:
+                ano = int(match.group(1))
+                if 1980 < ano < 2050:
+                    rasters_encontrados.append((ano, os.path.join(folder_path, f)))
+    return sorted(list(set(rasters_encontrados)))
+
+# Raio máximo (em pixels) da busca pelo pixel válido mais próximo quando o ponto cai em nodata (0 desativa)
+RAIO_BUSCA_NODATA = 3
+
+def pixel_valido_mais_proximo(src, row, col, raio=RAIO_BUSCA_NODATA):
+    # Uma leitura da janela (2*raio+1)² em volta de (row, col) com a máscara de nodata do raster; a distância de
+    # cada pixel ao centro é calculada de uma vez e o válido mais próximo (dentro do raio) é escolhido.
+    # Retorna (valor, distância em pixels) ou None.
+    if raio <= 0:
+        return None
+    r0, c0 = max(row - raio, 0), max(col - raio, 0)
+    r1, c1 = min(row + raio, src.height - 1), min(col + raio, src.width - 1)
+    if r1 < r0 or c1 < c0:
+        return None
+    bloco = src.read(1, window=rasterio.windows.Window(c0, r0, c1 - c0 + 1, r1 - r0 + 1), masked=True)
+    valido = ~np.ma.getmaskarray(bloco)
+    if bloco.dtype.kind == 'f':
+        valido &= ~np.isnan(bloco.data)
+    dy, dx = np.ogrid[r0 - row:r1 - row + 1, c0 - col:c1 - col + 1]
+    d2 = np.where(valido & (dy * dy + dx * dx <= raio * raio), dy * dy + dx * dx, np.inf)
+    k = int(np.argmin(d2))
+    if not np.isfinite(d2.flat[k]):
+        return None
+    return bloco.data.flat[k], math.sqrt(d2.flat[k])
+
+# Coordenadas dos pontos (CSV, GUI, serviço) são sempre lon/lat em WGS84
+CRS_PONTOS = 'EPSG:4326'
+# CRS do raster -> True se os pontos precisam ser reprojetados (UTM, Albers...); CRS geográficos usam lon/lat direto
+_CRS_PROJETADO = {}
+
+def crs_projetado(crs):
+    if crs is None:
+        return False
+    projetado = _CRS_PROJETADO.get(crs)
+    if projetado is None:
+        projetado = _CRS_PROJETADO[crs] = not crs.is_geographic
+    return projetado
+
+class CoordenadasLote:
+    # Coordenadas lon/lat de um lote de pontos, reprojetadas de uma vez (vetorizado) para cada CRS distinto
+    # dos rasters e guardadas: os anos do MapBiomas e as variáveis/profundidades de solo costumam
+    # compartilhar o CRS, então cada lote é transformado uma única vez. ponto(pos) dá a visão de um ponto
+    # que reaproveita a transformação do lote inteiro.
+    def __init__(self, lons, lats, _lote=None, _pos=None):
+        self.lons = np.asarray(lons, dtype=float).reshape(-1)
+        self.lats = np.asarray(lats, dtype=float).reshape(-1)
+        self._lote = _lote
+        self._pos = _pos
+        self._por_crs = {}
+
+    def ponto(self, pos):
+        return CoordenadasLote(self.lons[[pos]], self.lats[[pos]], self, pos)
+
+    def no_crs(self, crs):
+        # (xs, ys) no CRS do raster; coordenadas inválidas (NaN) continuam NaN
+        if not crs_projetado(crs):
+            return self.lons, self.lats
+        if self._lote is not None:
+            xs, ys = self._lote.no_crs(crs)
+            return xs[[self._pos]], ys[[self._pos]]
+        if crs not in self._por_crs:
+            xs = np.full(len(self.lons), np.nan)
+            ys = np.full(len(self.lats), np.nan)
+            validas = np.isfinite(self.lons) & np.isfinite(self.lats)
+            if validas.any():
+                xs[validas], ys[validas] = rasterio.warp.transform(CRS_PONTOS, crs, self.lons[validas], self.lats[validas])
+            contar_metrica('reprojecoes')
+            self._por_crs[crs] = (xs, ys)
+        return self._por_crs[crs]
+
+def dentro_limites(src, xs, ys):
+    b = src.bounds
+    return (b.left <= xs) & (xs <= b.right) & (b.bottom <= ys) & (ys <= b.top)
+
+def amostrar_ponto(src, x, y, raio_nodata=None):
+    # Valor do pixel em (x, y), já no CRS do raster; se for nodata (metadado/máscara do raster ou NaN), usa o pixel
+    # válido mais próximo. Retorna (valor, distância): 0.0 = o próprio pixel; None = sem dado no raio (valor = nodata bruto).
+    amostra = next(iter(src.sample([(x, y)], masked=True)))
+    contar_metrica('pixels_lidos')
+    valor = amostra[0]
+    if valor is not np.ma.masked and not (isinstance(valor, (float, np.floating)) and np.isnan(valor)):
+        return valor, 0.0
+    row, col = src.index(x, y)
+    substituto = pixel_valido_mais_proximo(src, row, col, RAIO_BUSCA_NODATA if raio_nodata is None else raio_nodata)
+    if substituto is None:
+        return amostra.data[0], None
+    return substituto
+
+def texto_substituicoes(substituidos):
+    # [(rótulo, distância)] -> "nodata: 1990 -> pixel a 1.0 px; 1991 sem dado no raio"
+    partes = [f"{rotulo} -> pixel a {d:.1f} px" if d is not None else f"{rotulo} sem dado no raio" for rotulo, d in substituidos]
+    return "nodata: " + "; ".join(partes) if partes else ""
+
+def extrair_dados_mapbiomas(folder_path, lat_str, lon_str, nome_sitio, acervo=None, raio_nodata=None, coordenadas=None):
+    # Anos em nodata usam o pixel válido mais próximo (até raio_nodata px); 'substituidos' lista [(ano, distância)].
+    # coordenadas: CoordenadasLote.ponto(...) do lote, para reaproveitar a reprojeção feita para todos os pontos.
     if not LIBS_INSTALADAS:
         return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'rasterio' e 'pandas' não encontradas."}
     
     try:
         lat = float(lat_str)
         lon = float(lon_str)
-        coords = [(lon, lat)]
     except ValueError:
         return {'status': 'erro', 'message': "Erro: Latitude e Longitude devem ser números válidos."}
 
     if not os.path.isdir(folder_path):
         return {'status': 'erro', 'message': f"Erro: Pasta não encontrada no caminho:\n{folder_path}"}
 
-    rasters_encontrados = []
-    for f in os.listdir(folder_path):
-        if f.endswith(('.tif', '.tiff')):
-            match = re.match(r'.*(\d{4}).*\.tif.*', f, re.IGNORECASE)
-            if match:
-                ano = int(match.group(1))
-                if 1980 < ano < 2050:
-                    rasters_encontrados.append((ano, os.path.join(folder_path, f)))
-    
+    rasters_encontrados = acervo.manifesto(folder_path, listar_rasters_mapbiomas) if acervo else listar_rasters_mapbiomas(folder_path)
+
     if not rasters_encontrados:
         return {'status': 'erro', 'message': "Erro: Nenhum raster .tif contendo um ano (ex: 1985) foi encontrado na pasta."}
 
-    rasters_encontrados = sorted(list(set(rasters_encontrados)))
     data_rows = []
+    substituidos = []
+    if coordenadas is None:
+        coordenadas = CoordenadasLote([lon], [lat])
     
     try:
         for ano, raster_path in rasters_encontrados:
-            with rasterio.open(raster_path) as src:
-                if not (src.bounds.left <= lon <= src.bounds.right and src.bounds.bottom <= lat <= src.bounds.top):
+            with abrir_raster(raster_path, acervo) as src:
+                xs, ys = coordenadas.no_crs(src.crs)
+                if not dentro_limites(src, xs, ys)[0]:
                     continue
                 
-                valor_pixel_codigo = list(src.sample(coords))[0][0]
+                valor_pixel_codigo, distancia = amostrar_ponto(src, xs[0], ys[0], raio_nodata)
+                if distancia != 0.0:
+                    substituidos.append((str(ano), distancia))
                 valor_pixel_nome = MAPBIOMAS_LEGEND.get(valor_pixel_codigo, f"Código Desconhecido ({valor_pixel_codigo})")
                 
                 data_rows.append({
@@ -283,89 +710,341 @@ def extrair_dados_mapbiomas(folder_path, lat_str, lon_str, nome_sitio):
             return {'status': 'aviso', 'message': "Aviso: Nenhum dado extraído MapBiomas para o ponto."}
 
         df = pd.DataFrame(data_rows)
-        return {'status': 'ok', 'data': df}
+        return {'status': 'ok', 'data': df, 'substituidos': substituidos}
 
     except Exception as e:
         return {'status': 'erro', 'message': f"Erro durante a extração do raster MapBiomas: {e}"}
 
-def find_raster_file(directory, prefix):
-    for f in os.listdir(directory):
+def find_raster_file(directory, prefix, nomes=None):
+    for f in (os.listdir(directory) if nomes is None else nomes):
         f_lower = f.lower()
         if f_lower.startswith(prefix) and f_lower.endswith(('.tif', '.tiff')):
             return os.path.join(directory, f)
     return None
 
-def extrair_dados_solo(base_folder_path, profundidade, lat_str, lon_str, nome_sitio):
-    if not LIBS_INSTALADAS:
-        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'rasterio' e 'pandas' não encontradas."}
-
+def abrir_raster(caminho, acervo=None):
+    # Com um AcervoAberto o handle é reaproveitado entre consultas; sem ele, abre e fecha a cada uso
+    if acervo is not None:
+        return acervo.abrir(caminho)
+    contar_metrica('rasters_abertos')
+    return rasterio.open(caminho)
+
+class AcervoAberto:
+    # Estado "quente" de processos de longa duração (serviço local, modo observação): manifestos das
+    # pastas (rasters MapBiomas, arquivos de solo, catálogo de estações) e datasets rasterio abertos.
+    # Os manifestos são revalidados com versao_pasta no máximo a cada 'validade' segundos; quando a pasta
+    # muda, o manifesto é refeito e os handles dos arquivos dela são fechados. Cada dataset tem sua
+    # trava: o mesmo handle não pode ser lido por duas threads ao mesmo tempo.
+    def __init__(self, validade=5.0):
+        self.validade = validade
+        self._lock = threading.Lock()
+        self._manifestos = {}
+        self._abertos = {}
+
+    def manifesto(self, pasta, listar):
+        chave = (os.path.abspath(pasta), listar)
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._manifestos.get(chave)
+        if entrada is not None and agora - entrada['verificado'] < self.validade:
+            return entrada['conteudo']
+        versao = versao_pasta(pasta)
+        if entrada is None or entrada['versao'] != versao:
+            if entrada is not None:
+                self.fechar(pasta)
+            entrada = {'versao': versao, 'conteudo': listar(pasta)}
+        entrada['verificado'] = agora
+        with self._lock:
+            self._manifestos[chave] = entrada
+        return entrada['conteudo']
+
+    @contextlib.contextmanager
+    def abrir(self, caminho):
+        with self._lock:
+            entrada = self._abertos.get(caminho)
+            if entrada is None:
+                contar_metrica('rasters_abertos')
+                entrada = self._abertos[caminho] = (rasterio.open(caminho), threading.Lock())
+        with entrada[1]:
+            yield entrada[0]
+
+    def n_abertos(self):
+        return len(self._abertos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def fechar(self, pasta=None):
+        # Fecha os handles (todos ou só os de uma pasta)
+        prefixo = os.path.join(os.path.abspath(pasta), '') if pasta else ''
+        with self._lock:
+            caminhos = [c for c in self._abertos if os.path.abspath(c).startswith(prefixo)]
+            entradas = [self._abertos.pop(c) for c in caminhos]
+        for src, trava in entradas:
+            with trava:
+                src.close()
+
+# Variáveis de solo -> prefixo do raster; areia/silte/argila vêm em g/kg e viram fração (/1000)
+VARIAVEIS_SOLO = {'areia': 'sand', 'silte': 'silt', 'argila': 'clay', 'densidade': 'bkd', 'pH': 'ph'}
+VARIAVEIS_SOLO_FRACAO = ('areia', 'silte', 'argila')
+# Camada do site.100 quando várias profundidades são extraídas juntas (agregação ponderada pela espessura)
+CAMADA_SOLO_CENTURY = '0-20cm'
+
+def profundidades_solo(solo_prof):
+    # '0-20cm', '0-20cm,0-30cm' ou ['0-20cm', '0-30cm'] -> lista de pastas de profundidade
+    if isinstance(solo_prof, (list, tuple)):
+        return [str(p).strip() for p in solo_prof if str(p).strip()]
+    return [p.strip() for p in str(solo_prof).split(',') if p.strip()]
+
+def rotulo_profundidades(solo_prof):
+    # Usado nos nomes de arquivo: '0-20cm' -> '020cm'; '0-20cm,0-30cm' -> '020cm_030cm'
+    return '_'.join(p.replace('-', '') for p in profundidades_solo(solo_prof))
+
+def intervalo_profundidade(prof):
+    # '0-20cm' -> (0.0, 20.0)
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\s*(?:cm)?\s*$', str(prof), re.IGNORECASE)
+    if not m or float(m.group(2)) <= float(m.group(1)):
+        raise ValueError(f"Profundidade inválida: '{prof}' (esperado ex: '0-20cm').")
+    return float(m.group(1)), float(m.group(2))
+
+def pesos_profundidade(profundidades, camada):
+    # Espessura (cm) com que cada profundidade entra na camada alvo. Cada trecho da camada conta só para a
+    # faixa mais fina que o cobre, então faixas sobrepostas (0-20cm e 0-30cm) não são contadas duas vezes.
+    inicio, fim = intervalo_profundidade(camada)
+    faixas = {p: intervalo_profundidade(p) for p in profundidades}
+    cortes = sorted({inicio, fim, *(x for a, b in faixas.values() for x in (a, b) if inicio < x < fim)})
+    pesos = dict.fromkeys(profundidades, 0.0)
+    for a, b in zip(cortes, cortes[1:]):
+        cobrindo = [p for p, (i, f) in faixas.items() if i <= a and b <= f]
+        if cobrindo:
+            pesos[min(cobrindo, key=lambda p: faixas[p][1] - faixas[p][0])] += b - a
+    return pesos
+
+def camada_padrao_solo(solo_prof):
+    # Com mais de uma profundidade, agrega para CAMADA_SOLO_CENTURY se alguma delas a cobrir
+    profundidades = profundidades_solo(solo_prof)
+    if len(profundidades) < 2:
+        return None
     try:
-        lat = float(lat_str)
-        lon = float(lon_str)
-        coords = [(lon, lat)]
+        return CAMADA_SOLO_CENTURY if any(pesos_profundidade(profundidades, CAMADA_SOLO_CENTURY).values()) else None
     except ValueError:
-        return {'status': 'erro', 'message': "Erro: Latitude e Longitude devem ser números válidos."}
+        return None
 
+def agregar_camada_solo(valores_por_prof, camada):
+    # valores_por_prof: {profundidade: {variável: valor ou array de valores}} -> média ponderada pela espessura
+    # dentro da camada, ignorando valores vazios (None/NaN). Com arrays, agrega todos os pontos de uma vez.
+    try:
+        pesos = pesos_profundidade(list(valores_por_prof), camada)
+    except ValueError as e:
+        return {'status': 'erro', 'message': f"Erro: {e}"}
+    if not any(pesos.values()):
+        return {'status': 'erro', 'message': f"Erro: Nenhuma das profundidades ({', '.join(valores_por_prof)}) cobre a camada {camada}."}
+    usadas = [prof for prof in valores_por_prof if pesos[prof] > 0]
+    w = np.array([pesos[prof] for prof in usadas]).reshape(-1, *([1] * np.ndim(valores_por_prof[usadas[0]]['areia'])))
+    valores = {}
+    for var_nome in VARIAVEIS_SOLO:
+        pilha = np.array([valores_por_prof[prof][var_nome] for prof in usadas], dtype=float)
+        valido = ~np.isnan(pilha)
+        total = (w * valido).sum(axis=0)
+        media = np.where(total > 0, (w * np.where(valido, pilha, 0.0)).sum(axis=0) / np.where(total > 0, total, 1.0), np.nan)
+        valores[var_nome] = (None if np.isnan(media) else float(media)) if np.ndim(media) == 0 else media
+    return {'status': 'ok', 'valores': valores}
+
+def _converter_valor_solo(val, divide=False):
+    if val is None:
+        return None
+    try:
+        numeric_val = float(val)
+        if divide:
+            return numeric_val / 1000.0
+        return numeric_val
+    except (ValueError, TypeError):
+        return None
+
+def _amostrar_solo(base_folder_path, profundidade, lat, lon, acervo=None, raio_nodata=None, coordenadas=None):
+    # Valores convertidos das 5 variáveis numa pasta de profundidade: {'status': 'ok', 'valores': {...}, 'substituidos': [...]}.
+    # Nodata sem pixel válido no raio é erro: o valor bruto (ex: -9999) não pode chegar ao site.100.
     target_folder = os.path.join(base_folder_path, profundidade)
     if not os.path.isdir(target_folder):
         return {'status': 'erro', 'message': f"Erro: Pasta de profundidade não encontrada no caminho:\n{target_folder}"}
 
-    variaveis_map = {
-        'areia': 'sand',
-        'silte': 'silt',
-        'argila': 'clay',
-        'densidade': 'bkd',
-        'pH': 'ph'
-    }
-    
     raster_paths = {}
-    for var_nome, var_prefix in variaveis_map.items():
-        path = find_raster_file(target_folder, var_prefix)
+    for var_nome, var_prefix in VARIAVEIS_SOLO.items():
+        path = find_raster_file(target_folder, var_prefix, acervo.manifesto(target_folder, os.listdir) if acervo else None)
         if path:
             raster_paths[var_nome] = path
         else:
             return {'status': 'erro', 'message': f"Erro: Não foi possível encontrar o raster para '{var_nome}' (prefixo '{var_prefix}')\nna pasta: {target_folder}"}
     
+    raio = RAIO_BUSCA_NODATA if raio_nodata is None else raio_nodata
+    if coordenadas is None:
+        coordenadas = CoordenadasLote([lon], [lat])
     try:
         extracted_values = {}
+        substituidos = []
         for var_nome, path in raster_paths.items():
-            with rasterio.open(path) as src:
-                if not (src.bounds.left <= lon <= src.bounds.right and src.bounds.bottom <= lat <= src.bounds.top):
+            with abrir_raster(path, acervo) as src:
+                xs, ys = coordenadas.no_crs(src.crs)
+                if not dentro_limites(src, xs, ys)[0]:
                     return {'status': 'erro', 'message': f"Erro: Coordenadas ({lat}, {lon}) estão fora dos limites do raster:\n{path}"}
                 
-                value = list(src.sample(coords))[0][0]
+                value, distancia = amostrar_ponto(src, xs[0], ys[0], raio)
+                if distancia is None:
+                    return {'status': 'erro', 'message': f"Erro: Sem dado (nodata) para '{var_nome}' no ponto e nenhum pixel válido num raio de {raio} px:\n{path}"}
+                if distancia:
+                    substituidos.append((var_nome, distancia))
                 extracted_values[var_nome] = value
-        
-        def get_value(var_nome, divide=False):
-            val = extracted_values.get(var_nome)
-            if val is None:
-                return None
-            try:
-                numeric_val = float(val)
-                if divide:
-                    return numeric_val / 1000.0
-                return numeric_val
-            except (ValueError, TypeError):
-                return None
-
-        data_for_csv = {
-            'ponto': nome_sitio,
-            'lat': lat,
-            'long': lon,
-            'profundidade': profundidade,
-            'areia': get_value('areia', divide=True),
-            'silte': get_value('silte', divide=True),
-            'argila': get_value('argila', divide=True),
-            'densidade': get_value('densidade'),
-            'pH': get_value('pH')
-        }
-        
-        df = pd.DataFrame([data_for_csv])
-        return {'status': 'ok', 'data': df}
-
     except Exception as e:
         return {'status': 'erro', 'message': f"Erro durante a extração do raster de solo:\n{e}"}
 
+    return {'status': 'ok', 'valores': {var_nome: _converter_valor_solo(extracted_values.get(var_nome), var_nome in VARIAVEIS_SOLO_FRACAO)
+                                        for var_nome in VARIAVEIS_SOLO}, 'substituidos': substituidos}
+
+# Caixa máxima (em pixels) lida de uma vez por amostrar_raster_pontos; acima disso usa src.sample
+LIMITE_JANELA_AMOSTRAGEM = 16_000_000
+
+def amostrar_raster_pontos(src, xs, ys, raio_nodata=None):
+    # Valor do raster em todos os pontos de uma vez (xs, ys já no CRS do raster, ver CoordenadasLote): uma leitura
+    # da janela que cobre os pontos e indexação vetorizada (ou src.sample, se a janela for grande demais). Pontos
+    # em nodata usam pixel_valido_mais_proximo.
+    # Retorna (valores float64, dentro dos limites, distâncias): distância 0 = o próprio pixel, > 0 = substituído,
+    # NaN = fora do raster ou sem dado no raio (valor NaN).
+    dentro = dentro_limites(src, xs, ys)
+    valores = np.full(len(xs), np.nan)
+    distancias = np.full(len(xs), np.nan)
+    if not dentro.any():
+        return valores, dentro, distancias
+    rows, cols = rasterio.transform.rowcol(src.transform, xs[dentro], ys[dentro])
+    rows = np.clip(np.asarray(rows).reshape(-1), 0, src.height - 1)
+    cols = np.clip(np.asarray(cols).reshape(-1), 0, src.width - 1)
+    r0, c0 = rows.min(), cols.min()
+    altura, largura = rows.max() - r0 + 1, cols.max() - c0 + 1
+    if altura * largura <= LIMITE_JANELA_AMOSTRAGEM:
+        janela = src.read(1, window=rasterio.windows.Window(int(c0), int(r0), int(largura), int(altura)), masked=True)
+        valores[dentro] = janela.astype(float).filled(np.nan)[rows - r0, cols - c0]
+    else:
+        valores[dentro] = [v.astype(float).filled(np.nan)[0] for v in src.sample(zip(xs[dentro], ys[dentro]), masked=True)]
+    contar_metrica('pixels_lidos', int(dentro.sum()))
+    distancias[dentro] = 0.0
+    raio = RAIO_BUSCA_NODATA if raio_nodata is None else raio_nodata
+    posicoes = np.flatnonzero(dentro)
+    for k in np.flatnonzero(np.isnan(valores[dentro])):
+        substituto = pixel_valido_mais_proximo(src, int(rows[k]), int(cols[k]), raio)
+        if substituto is None:
+            distancias[posicoes[k]] = np.nan
+        else:
+            valores[posicoes[k]], distancias[posicoes[k]] = float(substituto[0]), substituto[1]
+    return valores, dentro, distancias
+
+def extrair_solo_pontos(base_folder_path, profundidade, pontos_df, acervo=None, camada=None, pasta_saida=None, raio_nodata=None, coordenadas=None):
+    # Versão em lote de extrair_dados_solo (pontos_df com colunas ponto, lat, lon): cada raster (profundidade x
+    # variável) é aberto e lido uma vez para todos os pontos e as conversões (/1000, float) são feitas por coluna.
+    # Retorna {'status', 'data': uma linha por ponto, com as colunas de extrair_dados_solo, 'erros': {posição: mensagem}};
+    # pontos com erro ficam na tabela com valores vazios. Com pasta_saida, grava também o CSV de cada ponto.
+    # Nodata: 'substituidos' = {posição: [(variável, distância em px)]}; sem pixel válido no raio vira erro do ponto.
+    # coordenadas: CoordenadasLote dos mesmos pontos, se o chamador já tiver uma (reprojeção compartilhada).
+    if not LIBS_INSTALADAS:
+        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'rasterio' e 'pandas' não encontradas."}
+
+    lats = pd.to_numeric(pontos_df['lat'], errors='coerce').to_numpy(dtype=float)
+    lons = pd.to_numeric(pontos_df['lon'], errors='coerce').to_numpy(dtype=float)
+    if coordenadas is None:
+        coordenadas = CoordenadasLote(lons, lats)
+    erros = {int(pos): "Erro: Latitude e Longitude devem ser números válidos." for pos in np.flatnonzero(np.isnan(lats) | np.isnan(lons))}
+    profundidades = profundidades_solo(profundidade)
+    larga = len(profundidades) > 1 or camada is not None
+    tabela = pd.DataFrame({'ponto': pontos_df['ponto'].astype(str).to_numpy(), 'lat': lats, 'long': lons,
+                           'profundidade': (camada or ','.join(profundidades)) if larga else profundidade})
+
+    valores_por_prof = {}
+    substituidos = {}
+    raio = RAIO_BUSCA_NODATA if raio_nodata is None else raio_nodata
+    with (contextlib.nullcontext(acervo) if acervo else AcervoAberto(validade=float('inf'))) as acervo_solo:
+        for prof in profundidades:
+            target_folder = os.path.join(base_folder_path, prof)
+            if not os.path.isdir(target_folder):
+                return {'status': 'erro', 'message': f"Erro: Pasta de profundidade não encontrada no caminho:\n{target_folder}"}
+            nomes = acervo_solo.manifesto(target_folder, os.listdir)
+            for var_nome, var_prefix in VARIAVEIS_SOLO.items():
+                path = find_raster_file(target_folder, var_prefix, nomes)
+                if not path:
+                    return {'status': 'erro', 'message': f"Erro: Não foi possível encontrar o raster para '{var_nome}' (prefixo '{var_prefix}')\nna pasta: {target_folder}"}
+                try:
+                    with abrir_raster(path, acervo_solo) as src:
+                        valores, dentro, distancias = amostrar_raster_pontos(src, *coordenadas.no_crs(src.crs), raio)
+                except Exception as e:
+                    return {'status': 'erro', 'message': f"Erro durante a extração do raster de solo:\n{e}"}
+                for pos in np.flatnonzero(~dentro):
+                    erros.setdefault(int(pos), f"Erro: Coordenadas ({float(lats[pos])}, {float(lons[pos])}) estão fora dos limites do raster:\n{path}")
+                for pos in np.flatnonzero(dentro & np.isnan(distancias)):
+                    erros.setdefault(int(pos), f"Erro: Sem dado (nodata) para '{var_nome}' no ponto e nenhum pixel válido num raio de {raio} px:\n{path}")
+                rotulo_var = f"{var_nome}_{prof}" if larga else var_nome
+                for pos in np.flatnonzero(distancias > 0):
+                    substituidos.setdefault(int(pos), []).append((rotulo_var, float(distancias[pos])))
+                coluna = valores / 1000.0 if var_nome in VARIAVEIS_SOLO_FRACAO else valores
+                valores_por_prof.setdefault(prof, {})[var_nome] = coluna
+                tabela[f"{var_nome}_{prof}" if larga else var_nome] = coluna
+
+    if camada:
+        agregado = agregar_camada_solo(valores_por_prof, camada)
+        if agregado['status'] != 'ok':
+            return agregado
+        for var_nome, coluna in agregado['valores'].items():
+            tabela[var_nome] = coluna
+
+    if pasta_saida:
+        pasta_saida = obter_pasta_saida(pasta_saida)
+        rotulo = rotulo_profundidades(profundidade)
+        for pos, nome_sitio in enumerate(tabela['ponto']):
+            if pos not in erros:
+                salvar_csv(tabela.iloc[[pos]], os.path.join(pasta_saida, f"{nome_sitio}_solo_extracao_{rotulo}.csv"), ponto=nome_sitio, index=False, float_format='%.6f')
+    return {'status': 'ok', 'data': tabela, 'erros': erros, 'substituidos': {pos: subs for pos, subs in substituidos.items() if pos not in erros}}
+
+def extrair_dados_solo(base_folder_path, profundidade, lat_str, lon_str, nome_sitio, acervo=None, camada=None, raio_nodata=None):
+    # profundidade: uma pasta ('0-20cm') ou várias ('0-20cm,0-30cm' / lista). Com várias, a linha é larga
+    # (<variável>_<profundidade>) e os rasters de todas as profundidades compartilham os handles; com
+    # camada (ex: '0-20cm'), acrescenta areia..pH agregados por espessura, prontos para o site.100.
+    # Variáveis em nodata usam o pixel válido mais próximo (até raio_nodata px), listadas em 'substituidos'.
+    if not LIBS_INSTALADAS:
+        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'rasterio' e 'pandas' não encontradas."}
+
+    try:
+        lat = float(lat_str)
+        lon = float(lon_str)
+    except ValueError:
+        return {'status': 'erro', 'message': "Erro: Latitude e Longitude devem ser números válidos."}
+
+    profundidades = profundidades_solo(profundidade)
+    # Uma reprojeção do ponto por CRS, compartilhada entre variáveis e profundidades
+    coordenadas = CoordenadasLote([lon], [lat])
+    if len(profundidades) == 1 and camada is None:
+        amostra = _amostrar_solo(base_folder_path, profundidades[0], lat, lon, acervo, raio_nodata, coordenadas)
+        if amostra['status'] != 'ok':
+            return amostra
+        data_for_csv = {'ponto': nome_sitio, 'lat': lat, 'long': lon, 'profundidade': profundidade, **amostra['valores']}
+        return {'status': 'ok', 'data': pd.DataFrame([data_for_csv]), 'substituidos': amostra['substituidos']}
+
+    with (contextlib.nullcontext(acervo) if acervo else AcervoAberto(validade=float('inf'))) as acervo_solo:
+        data_for_csv = {'ponto': nome_sitio, 'lat': lat, 'long': lon, 'profundidade': camada or ','.join(profundidades)}
+        valores_por_prof = {}
+        substituidos = []
+        for prof in profundidades:
+            amostra = _amostrar_solo(base_folder_path, prof, lat, lon, acervo_solo, raio_nodata, coordenadas)
+            if amostra['status'] != 'ok':
+                return amostra
+            valores_por_prof[prof] = amostra['valores']
+            substituidos.extend((f"{var_nome}_{prof}", d) for var_nome, d in amostra['substituidos'])
+            data_for_csv.update({f"{var_nome}_{prof}": valor for var_nome, valor in amostra['valores'].items()})
+    if camada:
+        agregado = agregar_camada_solo(valores_por_prof, camada)
+        if agregado['status'] != 'ok':
+            return agregado
+        data_for_csv.update(agregado['valores'])
+    return {'status': 'ok', 'data': pd.DataFrame([data_for_csv]), 'substituidos': substituidos}
+
 def haversine(lon1, lat1, lon2, lat2):
     lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
     dlon = lon2 - lon1
@@ -375,20 +1054,83 @@ def haversine(lon1, lat1, lon2, lat2):
     r = 6371
     return c * r
 
-def encontrar_estacoes_proximas(folder_path, target_lat_str, target_lon_str, num_estacoes_desejadas, is_batch=False):
-    try:
-        target_lat = float(target_lat_str)
-        target_lon = float(target_lon_str)
-    except ValueError:
-        return {'status': 'erro', 'message': "Erro: Latitude e Longitude devem ser números válidos (ex: -16.5, -49.2)"}
-
-    if not os.path.isdir(folder_path):
-        return {'status': 'erro', 'message': f"Erro: Pasta de estações INMET não encontrada:\n{folder_path}"}
-
-    if not is_batch:
-        sg.popup_quick_message("Lendo estações INMET...", non_blocking=True, background_color='gray')
-    
-    estacoes_encontradas = []
+def _cabecalho_estacao(filepath):
+    # Entrada do catálogo de uma estação, só com as duas primeiras linhas: posição e colunas de data
+    df_check = pd.read_csv(filepath, nrows=2, encoding='latin1')
+    contar_metrica('cabecalhos_estacoes_lidos')
+
+    lat_col = next((col for col in df_check.columns if 'lat' in col.lower()), None)
+    lon_col = next((col for col in df_check.columns if 'lon' in col.lower()), None)
+    if not (lat_col and lon_col) or df_check.empty:
+        return {'status': 'aviso', 'message': f"Aviso: Estação {os.path.basename(filepath)} sem Lat/Lon."}
+
+    return {'status': 'ok', 'estacao': {
+        'filepath': filepath,
+        'lat': df_check.iloc[0][lat_col],
+        'lon': df_check.iloc[0][lon_col],
+        'data_ini_col': next((col for col in df_check.columns if col.lower() == 'data_inicial'), None),
+        'data_fin_col': next((col for col in df_check.columns if col.lower() == 'data_final'), None),
+        'data_col': next((col for col in df_check.columns if 'data' in col.lower() and col.lower() not in ['data_inicial', 'data_final']), None)
+    }}
+
+def _resumo_estacao(est):
+    # Cobertura de uma estação do catálogo (lê o arquivo inteiro): período declarado (data_inicial/data_final),
+    # intervalo de datas válidas e completude por ano (fração dos dias do ano com prec, tmin e tmax)
+    with medir_etapa('leitura_estacoes'):
+        df = pd.read_csv(est['filepath'], encoding='latin1')
+    contar_metrica('estacoes_lidas')
+
+    periodo_declarado = None
+    if est['data_ini_col'] and est['data_fin_col']:
+        data_ini_series = df[est['data_ini_col']].dropna()
+        data_fin_series = df[est['data_fin_col']].dropna()
+        if not data_ini_series.empty and not data_fin_series.empty:
+            periodo_declarado = (str(data_ini_series.iloc[0]), str(data_fin_series.iloc[0]))
+
+    inicio = fim = None
+    completude = {}
+    if est['data_col']:
+        with medir_etapa('parse_datas'):
+            datas = pd.to_datetime(df[est['data_col']], errors='coerce')
+        if datas.notna().any():
+            inicio, fim = datas.min().strftime('%Y-%m-%d'), datas.max().strftime('%Y-%m-%d')
+        colunas_valor = [col for col in df.columns if 'data' not in str(col).lower() and any(k in str(col).lower() for k in ('prec', 'min', 'max'))]
+        validos = datas.notna() & df[colunas_valor].apply(pd.to_numeric, errors='coerce').notna().all(axis=1)
+        dias = datas[validos].dt.normalize().drop_duplicates()
+        for ano, n_dias in dias.dt.year.value_counts().sort_index().items():
+            completude[int(ano)] = round(min(n_dias / pd.Timestamp(year=int(ano), month=12, day=31).dayofyear, 1.0), 4)
+
+    return {'status': 'ok', 'cobertura': {'periodo_declarado': periodo_declarado, 'inicio': inicio, 'fim': fim, 'completude': completude}}
+
+def resumo_estacao(est):
+    # _resumo_estacao em cache (COBERTURAS_ESTACOES) enquanto o arquivo não mudar: trocar uma estação não relê as demais
+    info = os.stat(est['filepath'])
+    chave = (os.path.abspath(est['filepath']), info.st_size, info.st_mtime_ns)
+    return COBERTURAS_ESTACOES.obter(chave, lambda: _resumo_estacao(est))
+
+class IndiceCobertura:
+    # Índice de intervalos (primeiro e último ano com dados) das estações de um catálogo, ordenado pelo
+    # início: bisect separa as que começam até o ano inicial pedido e só essas têm fim e completude conferidos.
+    def __init__(self, estacoes):
+        self._itens = sorted((min(est['completude']), max(est['completude']), pos) for pos, est in enumerate(estacoes) if est['completude'])
+        self._inicios = [item[0] for item in self._itens]
+        self._completude = [est['completude'] for est in estacoes]
+
+    def cobrindo(self, ano_inicio, ano_fim, completude_minima=0.0):
+        # Posições (na ordem do catálogo) das estações com dados em todos os anos de [ano_inicio, ano_fim],
+        # cada um com completude >= completude_minima
+        limite = bisect.bisect_right(self._inicios, ano_inicio)
+        return sorted(pos for _, fim, pos in self._itens[:limite]
+                      if fim >= ano_fim and completude_anos(self._completude[pos], ano_inicio, ano_fim) >= max(completude_minima, 1e-9))
+
+def completude_anos(completude, ano_inicio, ano_fim):
+    # Pior completude anual do período (0.0 se algum ano não tem dados)
+    return min((completude.get(ano, 0.0) for ano in range(int(ano_inicio), int(ano_fim) + 1)), default=0.0)
+
+def catalogo_estacoes(folder_path):
+    # Cabeçalho e cobertura (ver resumo_estacao) de cada CSV de estação, na ordem de os.listdir, e o índice de
+    # cobertura: as buscas, com ou sem período, não abrem os arquivos das estações
+    estacoes = []
     try:
         csv_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.csv')]
         if not csv_files:
@@ -397,32 +1139,71 @@ def encontrar_estacoes_proximas(folder_path, target_lat_str, target_lon_str, num
         for f in csv_files:
             filepath = os.path.join(folder_path, f)
             try:
-                df_check = pd.read_csv(filepath, nrows=2, encoding='latin1')
-                
-                lat_col = next((col for col in df_check.columns if 'lat' in col.lower()), None)
-                lon_col = next((col for col in df_check.columns if 'lon' in col.lower()), None)
-                
-                data_ini_col_name = next((col for col in df_check.columns if col.lower() == 'data_inicial'), None)
-                data_fin_col_name = next((col for col in df_check.columns if col.lower() == 'data_final'), None)
-                data_col_name = next((col for col in df_check.columns if 'data' in col.lower() and col.lower() not in ['data_inicial', 'data_final']), None)
-
-                if lat_col and lon_col:
-                    lat_estacao = df_check.iloc[0][lat_col]
-                    lon_estacao = df_check.iloc[0][lon_col]
-                    dist = haversine(target_lon, target_lat, lon_estacao, lat_estacao)
-                    estacoes_encontradas.append({
-                        'filepath': filepath,
-                        'distancia': dist,
-                        'data_ini_col': data_ini_col_name,
-                        'data_fin_col': data_fin_col_name,
-                        'data_col': data_col_name
-                    })
+                cabecalho = _cabecalho_estacao(filepath)
+                if cabecalho['status'] == 'ok':
+                    estacoes.append(dict(cabecalho['estacao'], **resumo_estacao(cabecalho['estacao'])['cobertura']))
             except Exception as e:
                 print(f"Erro ao ler cabeçalho de {f}: {e}")
 
     except Exception as e:
         return {'status': 'erro', 'message': f"Erro ao varrer a pasta do INMET: {e}"}
 
+    return {'status': 'ok', 'estacoes': estacoes, 'indice': IndiceCobertura(estacoes)}
+
+def catalogo_estacoes_memorizado(folder_path):
+    # Catálogo reaproveitado enquanto a pasta não mudar (versao_pasta): as consultas não abrem arquivos de estação
+    chave = (os.path.abspath(folder_path), versao_pasta(folder_path))
+    return CATALOGOS_ESTACOES.obter(chave, lambda: catalogo_estacoes(folder_path))
+
+def texto_periodo_estacao(est, anos=None):
+    # Período da estação para o popup de confirmação, a partir do catálogo
+    if est['data_ini_col'] and est['data_fin_col']:
+        if est['periodo_declarado']:
+            date_str = f"({est['periodo_declarado'][0]} a {est['periodo_declarado'][1]})"
+        else:
+            date_str = "(Colunas 'data_inicial' ou 'data_final' vazias/inválidas)"
+    elif est['data_col']:
+        date_str = f"(Histórico: {est['inicio']} a {est['fim']})" if est['inicio'] else "(Data Histórica não encontrada/inválida)"
+    else:
+        date_str = "(Coluna de Data não encontrada)"
+    if anos is not None:
+        date_str += f" - completude {anos[0]}-{anos[1]}: {completude_anos(est['completude'], *anos):.0%}"
+    return date_str
+
+def encontrar_estacoes_proximas(folder_path, target_lat_str, target_lon_str, num_estacoes_desejadas, is_batch=False, silencioso=False, acervo=None,
+                                anos=None, completude_minima=0.0):
+    # silencioso: resultado interativo (com popup_message) sem mensagens na tela, para uso fora da thread da GUI
+    # acervo: AcervoAberto com o catálogo de estações já lido
+    # anos=(ano_inicio, ano_fim): só estações com dados em todos esses anos, cada um com completude >= completude_minima
+    # (fração dos dias); respondido pelo índice do catálogo, sem abrir os arquivos das estações
+    try:
+        target_lat = float(target_lat_str)
+        target_lon = float(target_lon_str)
+    except ValueError:
+        return {'status': 'erro', 'message': "Erro: Latitude e Longitude devem ser números válidos (ex: -16.5, -49.2)"}
+
+    if not os.path.isdir(folder_path):
+        return {'status': 'erro', 'message': f"Erro: Pasta de estações INMET não encontrada:\n{folder_path}"}
+
+    if not is_batch and not silencioso:
+        sg.popup_quick_message("Lendo estações INMET...", non_blocking=True, background_color='gray')
+    
+    catalogo = acervo.manifesto(folder_path, catalogo_estacoes) if acervo else catalogo_estacoes_memorizado(folder_path)
+    if catalogo['status'] == 'erro':
+        return catalogo
+    candidatas = catalogo['estacoes']
+    if anos is not None:
+        anos = (int(anos[0]), int(anos[1]))
+        candidatas = [candidatas[pos] for pos in catalogo['indice'].cobrindo(anos[0], anos[1], completude_minima)]
+        if catalogo['estacoes'] and not candidatas:
+            return {'status': 'erro', 'message': f"Erro: Nenhuma estação da pasta cobre {anos[0]}-{anos[1]} com completude mínima de {completude_minima:.0%} por ano."}
+    estacoes_encontradas = []
+    for est in candidatas:
+        try:
+            estacoes_encontradas.append(dict(est, distancia=haversine(target_lon, target_lat, est['lon'], est['lat'])))
+        except Exception as e:
+            print(f"Erro ao ler cabeçalho de {os.path.basename(est['filepath'])}: {e}")
+
     if not estacoes_encontradas:
         return {'status': 'erro', 'message': "Erro: Nenhuma estação com Lat/Lon foi lida com sucesso na pasta."}
 
@@ -432,39 +1213,7 @@ def encontrar_estacoes_proximas(folder_path, target_lat_str, target_lon_str, num
     if not is_batch:
         popup_message = f"{len(top_estacoes)} estação(ões) mais próxima(s) encontrada(s):\n\n"
         for i, est in enumerate(top_estacoes):
-            date_str = ""
-            try:
-                df_dates = pd.read_csv(est['filepath'], encoding='latin1')
-                
-                if est['data_ini_col'] and est['data_fin_col']:
-                    data_ini_series = df_dates[est['data_ini_col']].dropna()
-                    data_fin_series = df_dates[est['data_fin_col']].dropna()
-                    
-                    if not data_ini_series.empty and not data_fin_series.empty:
-                        data_ini = str(data_ini_series.iloc[0])
-                        data_fin = str(data_fin_series.iloc[0])
-                        date_str = f"({data_ini} a {data_fin})"
-                    else:
-                        date_str = "(Colunas 'data_inicial' ou 'data_final' vazias/inválidas)"
-                
-                elif est['data_col']:
-                    data_col = est['data_col']
-                    df_dates['datetime'] = pd.to_datetime(df_dates[data_col], errors='coerce')
-                    df_valid_dates = df_dates.dropna(subset=['datetime'])
-
-                    if not df_valid_dates.empty:
-                        data_ini = df_valid_dates['datetime'].min().strftime('%Y-%m-%d')
-                        data_fin = df_valid_dates['datetime'].max().strftime('%Y-%m-%d')
-                        date_str = f"(Histórico: {data_ini} a {data_fin})"
-                    else:
-                        date_str = "(Data Histórica não encontrada/inválida)"
-                else:
-                    date_str = "(Coluna de Data não encontrada)"
-                        
-            except Exception as e:
-                print(f"Erro ao ler datas da estação {est['filepath']}: {e}")
-                date_str = f"(Erro interno ao ler datas)"
-            
+            date_str = texto_periodo_estacao(est, anos)
             popup_message += f"#{i+1}: {os.path.basename(est['filepath'])}\n"
             popup_message += f"     Distância: {est['distancia']:.2f} km {date_str}\n"
         
@@ -473,9 +1222,60 @@ def encontrar_estacoes_proximas(folder_path, target_lat_str, target_lon_str, num
 
     return {'status': 'ok', 'top_estacoes': top_estacoes}
 
-def processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=False):
+def _ler_estacao_inmet(filepath):
+    with medir_etapa('leitura_estacoes'):
+        try:
+            df = pd.read_csv(filepath)
+        except UnicodeDecodeError:
+            df = pd.read_csv(filepath, encoding='latin1')
+    contar_metrica('estacoes_lidas')
+
+    col_map = {}
+    for col in df.columns:
+        col_lower = str(col).lower()
+        if 'data' in col_lower: col_map['data'] = col
+        elif 'prec' in col_lower: col_map['prec'] = col
+        elif 'min' in col_lower: col_map['tmin'] = col
+        elif 'max' in col_lower: col_map['tmax'] = col
+    
+    required_cols = ['data', 'prec', 'tmin', 'tmax']
+    if not all(k in col_map for k in required_cols):
+        return {'status': 'aviso', 'message': f"Aviso: Estação {os.path.basename(filepath)} ignorada (colunas faltando)."}
+
+    df = df[list(col_map.values())]
+    df.columns = required_cols
+    with medir_etapa('parse_datas'):
+        df['data'] = pd.to_datetime(df['data'], errors='coerce')
+    df['prec'] = pd.to_numeric(df['prec'], errors='coerce')
+    df['tmin'] = pd.to_numeric(df['tmin'], errors='coerce')
+    df['tmax'] = pd.to_numeric(df['tmax'], errors='coerce')
+    return {'status': 'ok', 'data': df.dropna(subset=['data'])}
+
+def ler_estacao_inmet(filepath):
+    # Série diária (data, prec, tmin, tmax) tipada, em cache (LEITURAS_ESTACOES) enquanto o arquivo não mudar.
+    # A tabela é compartilhada entre chamadas e não deve ser alterada.
+    info = os.stat(filepath)
+    chave = (os.path.abspath(filepath), info.st_size, info.st_mtime_ns)
+    resultado = LEITURAS_ESTACOES.obter(chave, lambda: _ler_estacao_inmet(filepath))
+    if resultado['status'] != 'ok':
+        print(resultado['message'])
+    return resultado
+
+def processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=False, pasta_saida=None, silencioso=False):
     if not is_batch:
-        sg.popup_quick_message(f"Processando dados das {len(top_estacoes)} estações...", non_blocking=True, background_color='gray')
+        if not silencioso:
+            sg.popup_quick_message(f"Processando dados das {len(top_estacoes)} estações...", non_blocking=True, background_color='gray')
+        result = clima_memorizado('media', top_estacoes, nome_sitio)
+        if result['status'] != 'ok':
+            return result
+        downloads_path = obter_pasta_saida(pasta_saida)
+        nome_arquivo_csv = f"{nome_sitio}_inmet_clima_media.csv"
+        output_csv = os.path.join(downloads_path, nome_arquivo_csv)
+        salvar_csv(result['data'], output_csv, index=False)
+        
+        return {'status': 'ok', 'message': (f"Sucesso! Dados climáticos processados (Média Mensal).\n"
+                                             f"Média de {result['n_estacoes']} estação(ões) calculada.\n\n"
+                                             f"Arquivo salvo em:\n{output_csv}")}
 
     prec_series_list = []
     tmin_series_list = []
@@ -483,36 +1283,15 @@ def processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=False):
 
     for estacao in top_estacoes:
         try:
-            try:
-                df = pd.read_csv(estacao['filepath'])
-            except UnicodeDecodeError:
-                df = pd.read_csv(estacao['filepath'], encoding='latin1')
-
-            col_map = {}
-            for col in df.columns:
-                col_lower = str(col).lower()
-                if 'data' in col_lower: col_map['data'] = col
-                elif 'prec' in col_lower: col_map['prec'] = col
-                elif 'min' in col_lower: col_map['tmin'] = col
-                elif 'max' in col_lower: col_map['tmax'] = col
-            
-            required_cols = ['data', 'prec', 'tmin', 'tmax']
-            if not all(k in col_map for k in required_cols):
-                print(f"Aviso: Estação {os.path.basename(estacao['filepath'])} ignorada (colunas faltando).")
+            leitura = ler_estacao_inmet(estacao['filepath'])
+            if leitura['status'] != 'ok':
                 continue
-
-            df = df[list(col_map.values())]
-            df.columns = required_cols
-            df['data'] = pd.to_datetime(df['data'], errors='coerce')
-            df['prec'] = pd.to_numeric(df['prec'], errors='coerce')
-            df['tmin'] = pd.to_numeric(df['tmin'], errors='coerce')
-            df['tmax'] = pd.to_numeric(df['tmax'], errors='coerce')
-            df = df.dropna(subset=['data'])
-            df['month'] = df['data'].dt.month
+            df = leitura['data']
+            month = df['data'].dt.month
             
-            prec_series_list.append(df.groupby('month')['prec'].mean())
-            tmin_series_list.append(df.groupby('month')['tmin'].mean())
-            tmax_series_list.append(df.groupby('month')['tmax'].mean())
+            prec_series_list.append(df['prec'].groupby(month).mean())
+            tmin_series_list.append(df['tmin'].groupby(month).mean())
+            tmax_series_list.append(df['tmax'].groupby(month).mean())
         except Exception as e:
             print(f"Erro ao processar dados da estação {os.path.basename(estacao['filepath'])}:\n{e}")
             
@@ -539,52 +1318,32 @@ def processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=False):
     df_out['tmin'] = df_out['tmin'].round(4)
     df_out['tmax'] = df_out['tmax'].round(4)
     
+    return {'status': 'ok', 'data': df_out, 'n_estacoes': len(prec_series_list)}
+
+def gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=False, pasta_saida=None, silencioso=False):
     if not is_batch:
-        downloads_path = str(Path.home() / "Downloads")
-        nome_arquivo_csv = f"{nome_sitio}_inmet_clima_media.csv"
+        if not silencioso:
+            sg.popup_quick_message(f"Processando dados anuais das {len(top_estacoes)} estações...", non_blocking=True, background_color='gray')
+        result = clima_memorizado('anual', top_estacoes, nome_sitio)
+        if result['status'] != 'ok':
+            return result
+        downloads_path = obter_pasta_saida(pasta_saida)
+        nome_arquivo_csv = f"{nome_sitio}_inmet_clima_anual.csv"
         output_csv = os.path.join(downloads_path, nome_arquivo_csv)
-        df_out.to_csv(output_csv, index=False)
         
-        return {'status': 'ok', 'message': (f"Sucesso! Dados climáticos processados (Média Mensal).\n"
-                                             f"Média de {len(prec_series_list)} estação(ões) calculada.\n\n"
+        salvar_csv(result['data'], output_csv, index=False, float_format='%.4f')
+        
+        return {'status': 'ok', 'message': (f"Sucesso! CSV de clima anual (real) gerado.\n"
+                                             f"Dados de {result['n_estacoes']} estação(ões) combinados.\n\n"
                                              f"Arquivo salvo em:\n{output_csv}")}
-    
-    return {'status': 'ok', 'data': df_out}
-
-def gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=False):
-    if not is_batch:
-        sg.popup_quick_message(f"Processando dados anuais das {len(top_estacoes)} estações...", non_blocking=True, background_color='gray')
 
     all_dataframes = []
     for estacao in top_estacoes:
         try:
-            try:
-                df = pd.read_csv(estacao['filepath'])
-            except UnicodeDecodeError:
-                df = pd.read_csv(estacao['filepath'], encoding='latin1')
-                
-            col_map = {}
-            for col in df.columns:
-                col_lower = str(col).lower()
-                if 'data' in col_lower: col_map['data'] = col
-                elif 'prec' in col_lower: col_map['prec'] = col
-                elif 'min' in col_lower: col_map['tmin'] = col
-                elif 'max' in col_lower: col_map['tmax'] = col
-            
-            required_cols = ['data', 'prec', 'tmin', 'tmax']
-            if not all(k in col_map for k in required_cols):
-                print(f"Aviso: Estação {os.path.basename(estacao['filepath'])} ignorada (colunas faltando).")
+            leitura = ler_estacao_inmet(estacao['filepath'])
+            if leitura['status'] != 'ok':
                 continue
-            
-            df = df[list(col_map.values())]
-            df.columns = required_cols
-            df['data'] = pd.to_datetime(df['data'], errors='coerce')
-            df['prec'] = pd.to_numeric(df['prec'], errors='coerce')
-            df['tmin'] = pd.to_numeric(df['tmin'], errors='coerce')
-            df['tmax'] = pd.to_numeric(df['tmax'], errors='coerce')
-            
-            df = df.dropna(subset=['data', 'prec', 'tmin', 'tmax'])
-            all_dataframes.append(df)
+            all_dataframes.append(leitura['data'].dropna(subset=['prec', 'tmin', 'tmax']))
 
         except Exception as e:
             print(f"Erro ao processar dados da estação {os.path.basename(estacao['filepath'])}:\n{e}")
@@ -611,28 +1370,11 @@ def gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=False):
     df_final = df_final.rename(columns={'month': 'mes'})
     df_final = df_final.sort_values(by=['year', 'mes'])
 
-    if not is_batch:
-        downloads_path = str(Path.home() / "Downloads")
-        nome_arquivo_csv = f"{nome_sitio}_inmet_clima_anual.csv"
-        output_csv = os.path.join(downloads_path, nome_arquivo_csv)
-        
-        df_final.to_csv(output_csv, index=False, float_format='%.4f')
-        
-        return {'status': 'ok', 'message': (f"Sucesso! CSV de clima anual (real) gerado.\n"
-                                             f"Dados de {len(all_dataframes)} estação(ões) combinados.\n\n"
-                                             f"Arquivo salvo em:\n{output_csv}")}
-
-    return {'status': 'ok', 'data': df_final}
+    return {'status': 'ok', 'data': df_final, 'n_estacoes': len(all_dataframes)}
 
-def gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=False):
-    result = gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=True)
-
-    if result['status'] == 'erro':
-        return result
-
-    df_wth = result['data']
-
-    df_wth['ppt_cm'] = df_wth['ppt'] / 10.0
+def renderizar_wth(df_anual):
+    # df_anual: tabela (year, mes, ppt, tmin, tmax) de gerar_csv_clima_anual; não é alterada
+    df_wth = df_anual.assign(ppt_cm=df_anual['ppt'] / 10.0)
     
     min_year = df_wth['year'].min()
     max_year = df_wth['year'].max()
@@ -666,13 +1408,28 @@ def gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=False):
 
         wth_content.append(" ".join(line_parts))
 
-    downloads_path = str(Path.home() / "Downloads")
+    return "\n".join(wth_content), min_year, max_year
+
+def gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=False, pasta_saida=None, clima_anual=None):
+    # clima_anual: tabela anual já calculada (evita reler as estações)
+    if clima_anual is None:
+        if is_batch:
+            result = gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=True)
+        else:
+            result = clima_memorizado('anual', top_estacoes, nome_sitio)
+
+        if result['status'] == 'erro':
+            return result
+        clima_anual = result['data']
+
+    wth_texto, min_year, max_year = renderizar_wth(clima_anual)
+
+    downloads_path = obter_pasta_saida(pasta_saida)
     nome_arquivo_wth = f"{nome_sitio}.wth"
     output_wth = os.path.join(downloads_path, nome_arquivo_wth)
 
     try:
-        with open(output_wth, "w") as f:
-            f.write("\n".join(wth_content))
+        salvar_texto(output_wth, wth_texto)
     except Exception as e:
         return {'status': 'erro', 'message': f"Erro ao salvar arquivo .WTH:\n{e}"}
     
@@ -680,10 +1437,88 @@ def gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=False):
                                          f"Intervalo de anos: {min_year} a {max_year}\n\n"
                                          f"Arquivo salvo em:\n{output_wth}")}
 
-def gerar_site_100(solo_file_path, clima_file_path, template_file_path, nome_sitio, lat_str, lon_str):
+# Linhas do template site.100 preenchidas pelo construtor: índice -> (rótulo CENTURY, campo).
+# SITLAT/SITLNG têm o primeiro token trocado pelo valor; nas demais o valor é acrescentado ao primeiro token.
+SLOTS_SITE100 = {
+    **{mes + 2: (f'PRECIP({mes})', ('ppt', mes)) for mes in range(1, 13)},
+    **{mes + 38: (f'TMN2M({mes})', ('tmin', mes)) for mes in range(1, 13)},
+    **{mes + 50: (f'TMX2M({mes})', ('tmax', mes)) for mes in range(1, 13)},
+    65: ('SITLAT', 'lat'), 66: ('SITLNG', 'lon'),
+    67: ('SAND', 'areia'), 68: ('SILT', 'silte'), 69: ('CLAY', 'argila'),
+    71: ('BULKD', 'densidade'), 100: ('PH', 'pH'),
+}
+CAMPOS_SOLO_SITE100 = ['areia', 'silte', 'argila', 'densidade', 'pH']
+TEMPLATES_SITE100_COMPILADOS = {}
+
+def compilar_template_site100(template_file_path, estrito=False):
+    # Lê o template uma vez e guarda, para cada linha preenchida, as partes fixas do texto.
+    # Cada linha é conferida com o rótulo CENTURY esperado; divergências viram avisos
+    # (ou erro, com estrito=True). O resultado fica em cache enquanto o arquivo não mudar.
+    if not os.path.exists(template_file_path):
+        return {'status': 'erro', 'message': f"Erro: Arquivo template não encontrado no caminho:\n{template_file_path}"}
+    info = os.stat(template_file_path)
+    chave = (os.path.abspath(template_file_path), info.st_mtime_ns, info.st_size, estrito)
+    if chave in TEMPLATES_SITE100_COMPILADOS:
+        contar_metrica('cache_hits')
+        return TEMPLATES_SITE100_COMPILADOS[chave]
+
+    with open(template_file_path, 'r') as f:
+        linhas = f.readlines()
+    if len(linhas) <= max(SLOTS_SITE100):
+        return {'status': 'erro', 'message': f"Erro: O template site.100 tem {len(linhas)} linhas; são necessárias pelo menos {max(SLOTS_SITE100) + 1}."}
+
+    partes = {}
+    avisos = []
+    for indice, (rotulo, campo) in sorted(SLOTS_SITE100.items()):
+        tokens = linhas[indice].split()
+        if not tokens:
+            return {'status': 'erro', 'message': f"Erro: A linha {indice + 1} do template site.100 está vazia (esperado '{rotulo}')."}
+        if rotulo not in {t.strip("'\"").upper() for t in tokens}:
+            avisos.append(f"Linha {indice + 1}: esperado '{rotulo}', encontrado '{linhas[indice].strip()}'")
+        if campo in ('lat', 'lon'):
+            partes[indice] = ('substituir', linhas[indice].split(tokens[0]))
+        else:
+            partes[indice] = ('anexar', tokens[0] + '  ')
+
+    if avisos and estrito:
+        return {'status': 'erro', 'message': "Erro: O template não corresponde aos rótulos do site.100:\n" + "\n".join(avisos[:10])}
+    compilado = {'status': 'ok', 'linhas': linhas, 'partes': partes, 'avisos': avisos}
+    TEMPLATES_SITE100_COMPILADOS[chave] = compilado
+    return compilado
+
+def formatar_valores_site100(clima_map, soil_values, lat_str, lon_str):
+    # clima_map: {mes: {'ppt', 'tmin', 'tmax'}}; soil_values na ordem de CAMPOS_SOLO_SITE100
+    valores = {}
+    for mes in range(1, 13):
+        valores[('ppt', mes)] = f"{round(clima_map.get(mes, {'ppt': 0.0})['ppt'] / 10.0, 5):.5f}"
+        valores[('tmin', mes)] = f"{round(clima_map.get(mes, {'tmin': 0.0})['tmin'], 5):.5f}"
+        valores[('tmax', mes)] = f"{round(clima_map.get(mes, {'tmax': 0.0})['tmax'], 5):.5f}"
+    for campo, x in zip(CAMPOS_SOLO_SITE100, soil_values):
+        valores[campo] = f"{float(x):.5f}"
+    valores['lat'] = f"{float(lat_str):.6f}"
+    valores['lon'] = f"{float(lon_str):.6f}"
+    return valores
+
+def renderizar_site100(compilado, valores):
+    linhas = list(compilado['linhas'])
+    for indice, (modo, fixo) in compilado['partes'].items():
+        valor = valores[SLOTS_SITE100[indice][1]]
+        linhas[indice] = valor.join(fixo) if modo == 'substituir' else fixo + valor + '\n'
+    return "".join(linhas)
+
+def _ler_tabela(dados):
+    # Aceita DataFrame, caminho de CSV ou vários caminhos separados por ';'
+    if isinstance(dados, pd.DataFrame):
+        return dados
+    caminhos = [c for c in str(dados).split(';') if c.strip()]
+    if not caminhos:
+        raise FileNotFoundError("Nenhum arquivo CSV informado.")
+    return pd.concat([pd.read_csv(c.strip()) for c in caminhos], ignore_index=True)
+
+def gerar_site_100(solo_file_path, clima_file_path, template_file_path, nome_sitio, lat_str, lon_str, pasta_saida=None):
     try:
-        solo_df = pd.read_csv(solo_file_path)
-        clima_df = pd.read_csv(clima_file_path)
+        solo_df = _ler_tabela(solo_file_path)
+        clima_df = _ler_tabela(clima_file_path)
         
         solo_df_filtered = solo_df[solo_df['ponto'] == nome_sitio]
         if solo_df_filtered.empty:
@@ -693,59 +1528,26 @@ def gerar_site_100(solo_file_path, clima_file_path, template_file_path, nome_sit
         if clima_df_filtered.empty:
               return f"Erro: Ponto '{nome_sitio}' não encontrado no arquivo de clima."
 
-        soilData = solo_df_filtered.iloc[0][['areia', 'silte', 'argila', 'densidade', 'pH']].values
-        soilData = [f"{float(x):.5f}" for x in soilData]
+        soilData = solo_df_filtered.iloc[0][CAMPOS_SOLO_SITE100].values
 
         clima_df = clima_df_filtered.sort_values(by='mes')
         clima_map = clima_df.set_index('mes')[['ppt', 'tmin', 'tmax']].to_dict('index')
 
-        if not os.path.exists(template_file_path):
-            return f"Erro: Arquivo template não encontrado no caminho:\n{template_file_path}"
-
-        with open(template_file_path, 'r') as f:
-            site_100_lines = f.readlines()
-        
-        for mes in range(1, 13):
-            line_index = mes + 2
-            prec_val = clima_map.get(mes, {'ppt': 0.0})['ppt']
-            formatted_prec = f"{round(prec_val / 10.0, 5):.5f}"
-            site_100_lines[line_index] = site_100_lines[line_index].split()[0] + '  ' + formatted_prec + '\n'
-
-        for mes in range(1, 13):
-            line_index = mes + 38
-            tmin_val = clima_map.get(mes, {'tmin': 0.0})['tmin']
-            formatted_tmin = f"{round(tmin_val, 5):.5f}"
-            site_100_lines[line_index] = site_100_lines[line_index].split()[0] + '  ' + formatted_tmin + '\n'
-
-        for mes in range(1, 13):
-            line_index = mes + 50
-            tmax_val = clima_map.get(mes, {'tmax': 0.0})['tmax']
-            formatted_tmax = f"{round(tmax_val, 5):.5f}"
-            site_100_lines[line_index] = site_100_lines[line_index].split()[0] + '  ' + formatted_tmax + '\n'
-            
-        site_100_lines[67] = site_100_lines[67].split()[0] + '  ' + soilData[0] + '\n'
-        site_100_lines[68] = site_100_lines[68].split()[0] + '  ' + soilData[1] + '\n'
-        site_100_lines[69] = site_100_lines[69].split()[0] + '  ' + soilData[2] + '\n'
-        
-        site_100_lines[71] = site_100_lines[71].split()[0] + '  ' + soilData[3] + '\n'
-        
-        site_100_lines[100] = site_100_lines[100].split()[0] + '  ' + soilData[4] + '\n'
-        
-        formatted_lat = f"{float(lat_str):.6f}"
-        formatted_lon = f"{float(lon_str):.6f}"
-        
-        site_100_lines[65] = site_100_lines[65].replace(site_100_lines[65].split()[0], formatted_lat)
-        site_100_lines[66] = site_100_lines[66].replace(site_100_lines[66].split()[0], formatted_lon)
-
+        compilado = compilar_template_site100(template_file_path)
+        if compilado['status'] == 'erro':
+            return compilado['message']
+        texto = renderizar_site100(compilado, formatar_valores_site100(clima_map, soilData, lat_str, lon_str))
 
-        downloads_path = str(Path.home() / "Downloads")
+        downloads_path = obter_pasta_saida(pasta_saida)
         nome_arquivo_saida = f"{nome_sitio}_site.100"
         output_path = os.path.join(downloads_path, nome_arquivo_saida)
         
-        with open(output_path, 'w') as f:
-            f.writelines(site_100_lines)
+        salvar_texto(output_path, texto)
 
-        return f"Sucesso! Arquivo '{nome_arquivo_saida}' criado e preenchido.\n\nSalvo em:\n{output_path}"
+        message = f"Sucesso! Arquivo '{nome_arquivo_saida}' criado e preenchido.\n\nSalvo em:\n{output_path}"
+        if compilado['avisos']:
+            message += f"\n\nAviso: {len(compilado['avisos'])} linha(s) do template diferem dos rótulos esperados:\n" + "\n".join(compilado['avisos'][:3])
+        return message
 
     except ValueError:
         return "Erro: Latitude e Longitude devem ser números válidos."
@@ -754,106 +1556,841 @@ def gerar_site_100(solo_file_path, clima_file_path, template_file_path, nome_sit
     except Exception as e:
         return f"Erro durante a geração do site.100:\n{e}"
 
-def processar_lote_dados(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode):
+def gerar_site_100_lote(solo_dados, clima_dados, template_file_path, pontos=None, pasta_saida=None):
+    # Gera o site.100 de todos os pontos de uma só vez: o template é compilado uma vez e as
+    # tabelas de solo e clima são agrupadas por 'ponto' em uma única passada.
+    # pontos: [(nome, lat, lon)]; se None, usa os pontos e as coordenadas (lat/long) da tabela de solo.
+    compilado = compilar_template_site100(template_file_path)
+    if compilado['status'] == 'erro':
+        return compilado
+    try:
+        solo_df = tipar_tabela(_ler_tabela(solo_dados), 'solo')
+        clima_df = tipar_tabela(_ler_tabela(clima_dados), 'clima_media')
+
+        solo_por_ponto = {}
+        colunas_solo = ['lat', 'long'] if pontos is None else []
+        for ponto, *valores in zip(solo_df['ponto'], *(solo_df[c] for c in CAMPOS_SOLO_SITE100 + colunas_solo)):
+            solo_por_ponto.setdefault(str(ponto), valores)
+
+        clima_por_ponto = {}
+        clima_df = clima_df.sort_values(by='mes', kind='stable')
+        for ponto, mes, ppt, tmin, tmax in zip(clima_df['ponto'], clima_df['mes'], clima_df['ppt'], clima_df['tmin'], clima_df['tmax']):
+            clima_por_ponto.setdefault(str(ponto), {})[mes] = {'ppt': ppt, 'tmin': tmin, 'tmax': tmax}
+    except KeyError as e:
+        return {'status': 'erro', 'message': f"Erro: Coluna {e} faltando nos arquivos CSV de entrada. Verifique a formatação do solo e do clima médio."}
+    except Exception as e:
+        return {'status': 'erro', 'message': f"Erro ao ler as tabelas de solo/clima:\n{e}"}
+
+    if pontos is None:
+        pontos = [(nome, valores[-2], valores[-1]) for nome, valores in solo_por_ponto.items()]
+
+    downloads_path = obter_pasta_saida(pasta_saida)
+    gerados = 0
+    erros = []
+    for nome_sitio, lat, lon in pontos:
+        nome_sitio = str(nome_sitio)
+        if nome_sitio not in solo_por_ponto:
+            erros.append(f"{nome_sitio}: não encontrado na tabela de solo")
+            continue
+        if nome_sitio not in clima_por_ponto:
+            erros.append(f"{nome_sitio}: não encontrado na tabela de clima")
+            continue
+        try:
+            valores = formatar_valores_site100(clima_por_ponto[nome_sitio], solo_por_ponto[nome_sitio][:len(CAMPOS_SOLO_SITE100)], lat, lon)
+        except (ValueError, TypeError):
+            erros.append(f"{nome_sitio}: latitude/longitude inválidas")
+            continue
+        with medir_etapa('site100', nome_sitio):
+            salvar_texto(os.path.join(downloads_path, f"{nome_sitio}_site.100"), renderizar_site100(compilado, valores), ponto=nome_sitio)
+        gerados += 1
+
+    linhas = [f"Arquivos site.100 gerados: {gerados} de {len(pontos)}.", f"Salvos em:\n{downloads_path}"]
+    if erros:
+        linhas.append(f"\nErros ({len(erros)}):\n" + "\n".join(erros[:20]))
+    if compilado['avisos']:
+        linhas.append(f"\nAviso: {len(compilado['avisos'])} linha(s) do template diferem dos rótulos esperados:\n" + "\n".join(compilado['avisos'][:3]))
+    return {'status': 'ok' if gerados else 'erro', 'message': "\n".join(linhas), 'gerados': gerados, 'erros': erros, 'avisos': compilado['avisos']}
+
+def calcular_chaves_pixel(raster_path, lons, lats, coordenadas=None):
+    # Converte as coordenadas em (linha, coluna) do raster de uma só vez (reprojetadas para o CRS do raster).
+    # Pontos fora dos limites recebem chave None (serão extraídos individualmente).
+    if coordenadas is None:
+        coordenadas = CoordenadasLote(lons, lats)
+    with rasterio.open(raster_path) as src:
+        contar_metrica('rasters_abertos')
+        b = src.bounds
+        xs, ys = coordenadas.no_crs(src.crs)
+        dentro = dentro_limites(src, xs, ys)
+        rows, cols = rasterio.transform.rowcol(src.transform, np.where(dentro, xs, b.left), np.where(dentro, ys, b.top))
+    rows = np.asarray(rows).reshape(-1)
+    cols = np.asarray(cols).reshape(-1)
+    return [(int(r), int(c)) if ok else None for r, c, ok in zip(rows, cols, dentro)]
+
+def agrupar_pontos_por_pixel(chaves):
+    # chaves: lista alinhada aos pontos. Retorna {chave: [índices dos pontos]} na ordem de aparição.
+    grupos = {}
+    for idx, chave in enumerate(chaves):
+        if chave is None:
+            chave = ('ponto', idx)
+        grupos.setdefault(chave, []).append(idx)
+    return grupos
+
+def planejar_pixels_lote(pontos_df, mb_folder, acervo=None, coordenadas=None):
+    # Os rasters anuais do MapBiomas compartilham a mesma grade; basta um de referência. O solo não é
+    # planejado: extrair_solo_pontos lê todos os pontos de uma vez, uma leitura por raster.
+    total = len(pontos_df)
+    lons = pd.to_numeric(pontos_df['lon'], errors='coerce').values
+    lats = pd.to_numeric(pontos_df['lat'], errors='coerce').values
+    if coordenadas is None:
+        coordenadas = CoordenadasLote(lons, lats)
+
+    chaves_mb = [None] * total
+    try:
+        if not os.path.isdir(mb_folder):
+            rasters_mb = []
+        else:
+            rasters_mb = acervo.manifesto(mb_folder, listar_rasters_mapbiomas) if acervo else listar_rasters_mapbiomas(mb_folder)
+        if rasters_mb:
+            chaves_mb = calcular_chaves_pixel(rasters_mb[0][1], lons, lats, coordenadas)
+    except Exception as e:
+        print(f"Aviso: Deduplicação LULC desativada ({e}).")
+
+    return {'mb': agrupar_pontos_por_pixel(chaves_mb)}
+
+def codificacao_csv(caminho, tamanho_leitura=1 << 20):
+    # 'utf-8' se o arquivo inteiro decodifica como UTF-8, senão 'latin1'. Decodificação incremental (memória constante):
+    # no modo streaming o erro só apareceria ao iterar os blocos, depois de parte do lote já processada.
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(tamanho_leitura), b''):
+                decodificador.decode(bloco)
+        decodificador.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return 'latin1'
+    return 'utf-8'
+
+def ler_csv_pontos(csv_pontos_path, tamanho_bloco=None):
+    if tamanho_bloco:
+        return pd.read_csv(csv_pontos_path, chunksize=tamanho_bloco, encoding=codificacao_csv(csv_pontos_path))
+    try:
+        return pd.read_csv(csv_pontos_path)
+    except UnicodeDecodeError:
+        return pd.read_csv(csv_pontos_path, encoding='latin1')
+
+def normalizar_colunas_pontos(pontos_df):
+    required_cols_map = {'sitio': 'ponto', 'latitude': 'lat', 'longitude': 'lon'}
+    for required_col in required_cols_map:
+        if required_col not in pontos_df.columns:
+            return f"Erro: O CSV de pontos deve conter a coluna exata '{required_col}'."
+    pontos_df.rename(columns=required_cols_map, inplace=True)
+    return None
+
+def contar_linhas_csv(csv_pontos_path):
+    # Conta os pontos sem carregar o CSV (usado para o "Ponto i/N" no modo streaming)
+    with open(csv_pontos_path, 'rb') as f:
+        linhas = sum(1 for linha in f if linha.strip())
+    return max(linhas - 1, 0)
+
+class LoteCancelado(Exception):
+    pass
+
+def verificar_cancelamento(cancelar):
+    if cancelar is not None and cancelar.is_set():
+        raise LoteCancelado()
+
+def acompanhamento_lote(total_pontos, progresso=None, passos=3, intervalo=0.2):
+    # Converte os avanços por passo em progresso(pontos_concluidos, total_pontos, rotulo), em pontos
+    # equivalentes (cada ponto conta 1/passos por passo); no máximo uma chamada a cada 'intervalo' segundos
+    if progresso is None:
+        return None
+    estado = {'feitos': 0, 'ultimo': 0.0}
+    total = total_pontos * passos
+
+    def avancar(passo, n=1):
+        estado['feitos'] += n
+        agora = time.perf_counter()
+        if agora - estado['ultimo'] >= intervalo or estado['feitos'] >= total:
+            estado['ultimo'] = agora
+            progresso(estado['feitos'] / passos, total_pontos, f"Passo {passo}/{passos}")
+    return avancar
+
+def processar_pontos_lote(pontos_df, indices, total_pontos, registrar, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, pasta_saida, template_site100=None,
+                          avancar=None, cancelar=None, acervo=None):
+    # Executa os 3 passos (LULC, Solo, Clima) para um conjunto de pontos e envia cada linha
+    # de log para registrar(mensagem, passo, indice). 'indices' traz a posição global (base 0)
+    # de cada ponto no CSV, usada na numeração e na ordenação ao mesclar shards.
+    # Com template_site100, o site.100 de cada ponto é gerado das tabelas de solo e clima em memória.
+    # avancar(passo, n_pontos) informa o progresso (ver acompanhamento_lote); com cancelar (threading.Event)
+    # ativo, LoteCancelado é levantada antes do próximo ponto/pixel. acervo: AcervoAberto de um processo de longa duração.
+    # solo_prof pode listar várias profundidades ('0-20cm,0-30cm'): tabela larga, agregada para CAMADA_SOLO_CENTURY.
+    if acervo is None:
+        # Sem acervo do chamador, um do próprio lote: cada raster é aberto uma vez para todos os pontos e profundidades
+        with AcervoAberto(validade=float('inf')) as acervo_lote:
+            return processar_pontos_lote(pontos_df, indices, total_pontos, registrar, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes,
+                                         inmet_mode, pasta_saida, template_site100, avancar, cancelar, acervo_lote)
+    n = len(pontos_df)
+    # Coordenadas do lote reprojetadas uma vez por CRS de raster e reaproveitadas nos 3 usos abaixo
+    coordenadas = CoordenadasLote(pd.to_numeric(pontos_df['lon'], errors='coerce').to_numpy(dtype=float),
+                                  pd.to_numeric(pontos_df['lat'], errors='coerce').to_numpy(dtype=float))
+
+    # Pontos que caem no mesmo pixel do MapBiomas compartilham uma única extração LULC
+    with medir_etapa('planejamento_pixels'):
+        plano_pixels = planejar_pixels_lote(pontos_df, mb_folder, acervo, coordenadas)
+    n_pixels_mb = len(plano_pixels['mb'])
+    if n > 0:
+        registrar(f"Deduplicação por pixel: LULC {n} pontos -> {n_pixels_mb} pixels únicos (razão {n / max(n_pixels_mb, 1):.2f}x)", 0, None)
+
+    registrar("\n--- Processando LULC (Passo 1/3) ---", 1, None)
+    resultados_mb = [None] * n
+    for membros in plano_pixels['mb'].values():
+        verificar_cancelamento(cancelar)
+        rep = pontos_df.iloc[membros[0]]
+        with medir_etapa('lulc', str(rep['ponto'])):
+            mb_result = extrair_dados_mapbiomas(mb_folder, str(rep['lat']), str(rep['lon']), str(rep['ponto']), acervo=acervo,
+                                                coordenadas=coordenadas.ponto(membros[0]))
+        contar_metrica('cache_hits', len(membros) - 1)
+        for idx in membros:
+            resultados_mb[idx] = mb_result
+        if avancar:
+            avancar(1, len(membros))
+
+    for pos, (_, row) in enumerate(pontos_df.iterrows()):
+        index = indices[pos]
+        nome_sitio = str(row['ponto'])
+        mb_result = resultados_mb[pos]
+
+        if mb_result['status'] == 'ok':
+            output_mb = os.path.join(pasta_saida, f"{nome_sitio}_mapbiomas_extracao.csv")
+            salvar_csv(mb_result['data'].assign(ponto=nome_sitio), output_mb, ponto=nome_sitio, index=False)
+            nodata = texto_substituicoes(mb_result.get('substituidos', []))
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): LULC OK{f' ({nodata})' if nodata else ''}. Salvo CSV.", 1, index)
+        elif mb_result['status'] == 'aviso':
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): LULC AVISO - {mb_result['message']}", 1, index)
+        else:
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): LULC ERRO - {mb_result['message']}", 1, index)
+    del resultados_mb
+
+
+    registrar("\n--- Processando Solo (Passo 2/3) ---", 2, None)
+    # Todos os pontos de uma vez: uma leitura por raster (a deduplicação por pixel não é necessária aqui)
+    verificar_cancelamento(cancelar)
+    with medir_etapa('solo'):
+        solo_lote = extrair_solo_pontos(solo_folder, solo_prof, pontos_df, acervo=acervo, camada=camada_padrao_solo(solo_prof), coordenadas=coordenadas)
+    if avancar:
+        avancar(2, n)
+    solo_para_site = {}
+
+    for pos, (_, row) in enumerate(pontos_df.iterrows()):
+        index = indices[pos]
+        nome_sitio = str(row['ponto'])
+        erro_solo = solo_lote['message'] if solo_lote['status'] == 'erro' else solo_lote['erros'].get(pos)
+
+        if erro_solo is None:
+            output_solo = os.path.join(pasta_saida, f"{nome_sitio}_solo_extracao_{rotulo_profundidades(solo_prof)}.csv")
+            df_solo = solo_lote['data'].iloc[[pos]]
+            salvar_csv(df_solo, output_solo, ponto=nome_sitio, index=False, float_format='%.6f')
+            nodata = texto_substituicoes(solo_lote['substituidos'].get(pos, []))
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SOLO OK{f' ({nodata})' if nodata else ''}. Salvo CSV.", 2, index)
+            if template_site100 and 'areia' in df_solo.columns:
+                solo_para_site[pos] = df_solo
+            elif template_site100:
+                registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SITE.100 AVISO - nenhuma profundidade de '{solo_prof}' cobre "
+                          f"{CAMADA_SOLO_CENTURY}; sem {'/'.join(CAMPOS_SOLO_SITE100)} para o site.100 (não gerado).", 2, index)
+        else:
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SOLO ERRO - {erro_solo}", 2, index)
+    del solo_lote
+
+
+    registrar("\n--- Processando Clima (Passo 3/3) ---", 3, None)
+    for pos, (_, row) in enumerate(pontos_df.iterrows()):
+        if avancar and pos:
+            avancar(3)
+        verificar_cancelamento(cancelar)
+        index = indices[pos]
+        nome_sitio = str(row['ponto'])
+        lat_str = str(row['lat'])
+        lon_str = str(row['lon'])
+
+        with medir_etapa('busca_estacoes', nome_sitio):
+            inmet_search = encontrar_estacoes_proximas(inmet_folder, lat_str, lon_str, inmet_n_estacoes, is_batch=True, acervo=acervo)
+        
+        if inmet_search['status'] == 'erro':
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima BUSCA ERRO - {inmet_search['message']}", 3, index)
+            continue
+        
+        top_estacoes = inmet_search['top_estacoes']
+        
+        with medir_etapa('clima_media', nome_sitio):
+            media_result = processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=True)
+        if media_result['status'] == 'ok':
+            output_media = os.path.join(pasta_saida, f"{nome_sitio}_inmet_clima_media.csv")
+            salvar_csv(media_result['data'], output_media, ponto=nome_sitio, index=False)
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Média OK. Salvo CSV.", 3, index)
+            if template_site100 and pos in solo_para_site:
+                site_result = gerar_site_100_lote(solo_para_site.pop(pos), media_result['data'], template_site100, [(nome_sitio, lat_str, lon_str)], pasta_saida)
+                if site_result['status'] == 'ok':
+                    registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SITE.100 OK. Salvo .100.", 3, index)
+                else:
+                    erro_site = site_result['erros'][0] if site_result.get('erros') else site_result['message']
+                    registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SITE.100 ERRO - {erro_site}", 3, index)
+        else:
+            registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Média ERRO - {media_result['message']}", 3, index)
+
+        if inmet_mode in ['ambos', 'anual']:
+            with medir_etapa('clima_anual', nome_sitio):
+                anual_result = gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=True)
+            if anual_result['status'] == 'ok':
+                output_anual = os.path.join(pasta_saida, f"{nome_sitio}_inmet_clima_anual.csv")
+                salvar_csv(anual_result['data'], output_anual, ponto=nome_sitio, index=False)
+                registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Anual (CSV) OK. Salvo CSV.", 3, index)
+                
+                if inmet_mode == 'ambos':
+                    with medir_etapa('clima_wth', nome_sitio):
+                        wth_result = gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=True, pasta_saida=pasta_saida, clima_anual=anual_result['data'])
+                    if wth_result['status'] == 'ok':
+                        registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima WTH OK. Salvo .WTH.", 3, index)
+                    else:
+                        registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima WTH ERRO - {wth_result['message']}", 3, index)
+            else:
+                registrar(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Anual ERRO - {anual_result['message']}", 3, index)
+    if avancar and n:
+        avancar(3)
+
+def processar_lote_dados(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, tamanho_bloco=None, log_path=None, pasta_saida=None, shard_index=None, shard_count=None, template_site100=None,
+                         progresso=None, cancelar=None):
+    # progresso(pontos_concluidos, total_pontos, rotulo) e cancelar (threading.Event) permitem rodar o lote em
+    # segundo plano (GUI): o cancelamento interrompe o lote entre pontos e devolve o log parcial
     if not LIBS_INSTALADAS:
         return f"Erro Crítico: Bibliotecas ausentes (rasterio/pandas)."
 
-    downloads_path = str(Path.home() / "Downloads")
+    if shard_count:
+        return processar_lote_shard(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, shard_index, shard_count, pasta_saida, template_site100)
+
+    if tamanho_bloco:
+        return processar_lote_dados_streaming(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, tamanho_bloco, log_path, pasta_saida, template_site100,
+                                              progresso, cancelar)
+
+    pasta_saida = obter_pasta_saida(pasta_saida)
+    carimbo = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    metricas_jsonl = os.path.join(pasta_saida, f"lote_metricas_{carimbo}.jsonl")
+    iniciar_metricas(f"lote_{carimbo}")
 
     try:
-        try:
-            pontos_df = pd.read_csv(csv_pontos_path)
-        except UnicodeDecodeError:
-            pontos_df = pd.read_csv(csv_pontos_path, encoding='latin1')
+        with medir_etapa('leitura_pontos'):
+            pontos_df = ler_csv_pontos(csv_pontos_path)
 
-        required_cols_map = {'sitio': 'ponto', 'latitude': 'lat', 'longitude': 'lon'}
-        
-        for required_col, internal_name in required_cols_map.items():
-            if required_col not in pontos_df.columns:
-                return f"Erro: O CSV de pontos deve conter a coluna exata '{required_col}'."
-            pontos_df.rename(columns={required_col: internal_name}, inplace=True)
+        erro_colunas = normalizar_colunas_pontos(pontos_df)
+        if erro_colunas:
+            finalizar_metricas()
+            return erro_colunas
         
         total_pontos = len(pontos_df)
         log_messages = [f"--- Início do Processamento de Lote ({total_pontos} Pontos) ---"]
+        cancelado = False
 
+        # As gravações vão para um escritor em segundo plano; a próxima leitura de raster não espera o disco
+        with escritor_em_segundo_plano() as escritor:
+            try:
+                processar_pontos_lote(pontos_df, range(total_pontos), total_pontos, lambda msg, passo=None, indice=None: log_messages.append(msg), mb_folder, solo_folder, solo_prof,
+                                      inmet_folder, inmet_n_estacoes, inmet_mode, pasta_saida, template_site100, acompanhamento_lote(total_pontos, progresso), cancelar)
+            except LoteCancelado:
+                cancelado = True
+        if escritor.erros:
+            log_messages.append(f"\n--- Falhas de Gravação ({len(escritor.erros)}) ---")
+            log_messages.extend(f" {erro}" for erro in escritor.erros)
+        
+        log_messages.append("\n--- Processamento de Lote CANCELADO pelo usuário ---" if cancelado else "\n--- Processamento de Lote Concluído ---")
+        log_messages.append("\n" + resumo_metricas(finalizar_metricas(metricas_jsonl)))
+        log_final = "\n".join(log_messages)
+        if log_path:
+            with open(log_path, 'w', encoding='utf-8') as f:
+                f.write(log_final)
+        return log_final
 
-        log_messages.append("\n--- Processando LULC (Passo 1/3) ---")
-        for index, row in pontos_df.iterrows():
-            nome_sitio = str(row['ponto'])
-            lat_str = str(row['lat'])
-            lon_str = str(row['lon'])
-            
-            mb_result = extrair_dados_mapbiomas(mb_folder, lat_str, lon_str, nome_sitio)
-            
-            if mb_result['status'] == 'ok':
-                output_mb = os.path.join(downloads_path, f"{nome_sitio}_mapbiomas_extracao.csv")
-                mb_result['data'].to_csv(output_mb, index=False)
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): LULC OK. Salvo CSV.")
-            elif mb_result['status'] == 'aviso':
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): LULC AVISO - {mb_result['message']}")
-            else:
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): LULC ERRO - {mb_result['message']}")
+    except Exception as e:
+        finalizar_metricas(metricas_jsonl)
+        return f"Erro fatal durante o processamento em lote:\n{e}"
 
+def processar_lote_dados_streaming(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, tamanho_bloco=5000, log_path=None, pasta_saida=None, template_site100=None,
+                                   progresso=None, cancelar=None):
+    # Lê os pontos em blocos de 'tamanho_bloco' linhas; cada bloco passa pelos 3 passos, os
+    # resultados são gravados na hora e o log vai direto para arquivo. A memória fica limitada
+    # ao bloco corrente, independente do tamanho do CSV.
+    pasta_saida = obter_pasta_saida(pasta_saida)
+    carimbo = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    metricas_jsonl = os.path.join(pasta_saida, f"lote_metricas_{carimbo}.jsonl")
+    log_path = log_path or os.path.join(pasta_saida, f"lote_log_{carimbo}.txt")
+    iniciar_metricas(f"lote_{carimbo}")
+
+    contagem = {'OK': 0, 'AVISO': 0, 'ERRO': 0}
+    erro_colunas = None
+    try:
+        total_pontos = contar_linhas_csv(csv_pontos_path)
+        with open(log_path, 'w', encoding='utf-8') as log_file:
+            def registrar(msg, passo=None, indice=None):
+                status = re.search(r"\): .*?\b(OK|AVISO|ERRO)\b", msg) if msg.startswith(" Ponto") else None
+                if status:
+                    contagem[status.group(1)] += 1
+                log_file.write(msg + "\n")
+
+            registrar(f"--- Início do Processamento de Lote ({total_pontos} Pontos, streaming em blocos de {tamanho_bloco}) ---")
+            indice_inicial = 0
+            cancelado = False
+            avancar = acompanhamento_lote(total_pontos, progresso)
+            with escritor_em_segundo_plano() as escritor:
+                for numero_bloco, pontos_df in enumerate(ler_csv_pontos(csv_pontos_path, tamanho_bloco), start=1):
+                    erro_colunas = normalizar_colunas_pontos(pontos_df)
+                    if erro_colunas:
+                        registrar(erro_colunas)
+                        break
+
+                    registrar(f"\n=== Bloco {numero_bloco}: pontos {indice_inicial + 1}-{indice_inicial + len(pontos_df)} ===")
+                    try:
+                        processar_pontos_lote(pontos_df.reset_index(drop=True), range(indice_inicial, indice_inicial + len(pontos_df)), total_pontos, registrar, mb_folder, solo_folder, solo_prof,
+                                              inmet_folder, inmet_n_estacoes, inmet_mode, pasta_saida, template_site100, avancar, cancelar)
+                    except LoteCancelado:
+                        cancelado = True
+                        break
+                    finally:
+                        log_file.flush()
+                    indice_inicial += len(pontos_df)
+                    descarregar_metricas(metricas_jsonl)
+
+            if erro_colunas:
+                finalizar_metricas()
+                return erro_colunas
+            if escritor.erros:
+                registrar(f"\n--- Falhas de Gravação ({len(escritor.erros)}) ---")
+                for erro in escritor.erros:
+                    registrar(f" {erro}")
+                contagem['ERRO'] += len(escritor.erros)
+
+            registrar("\n--- Processamento de Lote CANCELADO pelo usuário ---" if cancelado else "\n--- Processamento de Lote Concluído ---")
+            resumo = resumo_metricas(finalizar_metricas(metricas_jsonl))
+            registrar("\n" + resumo)
+
+        situacao = f"CANCELADO após {indice_inicial} Pontos (blocos completos)" if cancelado else f"Concluído: {indice_inicial} Pontos"
+        return (f"--- Processamento de Lote (streaming) {situacao} ---\n"
+                f"Etapas OK: {contagem['OK']} | AVISO: {contagem['AVISO']} | ERRO: {contagem['ERRO']}\n"
+                f"Log completo em:\n{log_path}\n\n{resumo}")
 
-        log_messages.append("\n--- Processando Solo (Passo 2/3) ---")
-        for index, row in pontos_df.iterrows():
-            nome_sitio = str(row['ponto'])
-            lat_str = str(row['lat'])
-            lon_str = str(row['lon'])
-            
-            solo_result = extrair_dados_solo(solo_folder, solo_prof, lat_str, lon_str, nome_sitio)
+    except Exception as e:
+        finalizar_metricas(metricas_jsonl)
+        return f"Erro fatal durante o processamento em lote:\n{e}\n\nLog parcial em:\n{log_path}"
+
+ARQUIVO_MANIFESTO_SHARD = 'shard_manifesto.json'
+ARQUIVO_LOG_SHARD = 'shard_log.jsonl'
+ARQUIVO_METRICAS_SHARD = 'shard_metricas.jsonl'
+
+def pasta_shard_lote(pasta_raiz, shard_index, shard_count):
+    return os.path.join(pasta_raiz, f"shard_{int(shard_index):03d}_de_{int(shard_count):03d}")
+
+def particionar_pontos_espacialmente(pontos_df, shard_count, mb_folder=None, tile_px=512, tile_graus=0.25):
+    # Agrupa os pontos em blocos (tiles) da grade do MapBiomas e distribui blocos inteiros e
+    # contíguos entre os shards, equilibrando o número de pontos. Cada nó lê só as suas janelas
+    # dos rasters e pontos do mesmo pixel nunca ficam em shards diferentes.
+    # Sem raster de referência, os blocos são feitos em graus. A atribuição depende apenas do CSV.
+    lons = pd.to_numeric(pontos_df['lon'], errors='coerce').to_numpy(dtype=float)
+    lats = pd.to_numeric(pontos_df['lat'], errors='coerce').to_numpy(dtype=float)
+    chaves_px = [None] * len(pontos_df)
+    rasters_mb = listar_rasters_mapbiomas(mb_folder) if mb_folder and os.path.isdir(mb_folder) else []
+    if rasters_mb and len(pontos_df):
+        chaves_px = calcular_chaves_pixel(rasters_mb[0][1], lons, lats)
+
+    tiles = []
+    for chave, lon, lat in zip(chaves_px, lons, lats):
+        if chave is not None:
+            tiles.append(('px', chave[0] // tile_px, chave[1] // tile_px))
+        elif np.isnan(lon) or np.isnan(lat):
+            tiles.append(('sem_coordenada',))
+        else:
+            tiles.append(('graus', math.floor(lat / tile_graus), math.floor(lon / tile_graus)))
+
+    contagem_tiles = {}
+    for tile in tiles:
+        contagem_tiles[tile] = contagem_tiles.get(tile, 0) + 1
+    total = len(tiles)
+    shard_do_tile = {}
+    acumulado = 0
+    for tile in sorted(contagem_tiles):
+        shard_do_tile[tile] = min(acumulado * shard_count // max(total, 1), shard_count - 1)
+        acumulado += contagem_tiles[tile]
+    return np.array([shard_do_tile[tile] for tile in tiles], dtype=int)
+
+def processar_lote_shard(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, shard_index, shard_count, pasta_saida=None, template_site100=None):
+    # Processa apenas os pontos do shard, mantendo a numeração global do CSV. As saídas vão para
+    # pasta_saida/shard_XXX_de_NNN/ junto com o log estruturado (passo, índice) e um manifesto;
+    # mesclar_shards() junta tudo depois. O manifesto só é gravado ao final, marcando o shard concluído.
+    shard_index, shard_count = int(shard_index), int(shard_count)
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        return f"Erro: shard {shard_index} inválido para {shard_count} shard(s)."
+
+    pasta_shard = pasta_shard_lote(obter_pasta_saida(pasta_saida), shard_index, shard_count)
+    os.makedirs(pasta_shard, exist_ok=True)
+    manifesto_path = os.path.join(pasta_shard, ARQUIVO_MANIFESTO_SHARD)
+    if os.path.exists(manifesto_path):
+        os.remove(manifesto_path)
+    metricas_jsonl = os.path.join(pasta_shard, ARQUIVO_METRICAS_SHARD)
+    if os.path.exists(metricas_jsonl):
+        os.remove(metricas_jsonl)
+    iniciar_metricas(f"lote_shard_{shard_index:03d}_de_{shard_count:03d}")
 
-            if solo_result['status'] == 'ok':
-                output_solo = os.path.join(downloads_path, f"{nome_sitio}_solo_extracao_{solo_prof.replace('-', '')}.csv")
-                solo_result['data'].to_csv(output_solo, index=False, float_format='%.6f')
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SOLO OK. Salvo CSV.")
-            else:
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): SOLO ERRO - {solo_result['message']}")
+    try:
+        with medir_etapa('leitura_pontos'):
+            pontos_df = ler_csv_pontos(csv_pontos_path)
+        erro_colunas = normalizar_colunas_pontos(pontos_df)
+        if erro_colunas:
+            finalizar_metricas()
+            return erro_colunas
 
+        total_pontos = len(pontos_df)
+        with medir_etapa('particionamento'):
+            atribuicao = particionar_pontos_espacialmente(pontos_df, shard_count, mb_folder)
+        indices = [int(i) for i in np.flatnonzero(atribuicao == shard_index)]
+        pontos_shard = pontos_df.iloc[indices].reset_index(drop=True)
+
+        registros = []
+        def registrar(msg, passo=None, indice=None):
+            registros.append({'passo': passo, 'indice': indice, 'msg': msg})
+
+        with escritor_em_segundo_plano() as escritor:
+            processar_pontos_lote(pontos_shard, indices, total_pontos, registrar, mb_folder, solo_folder, solo_prof,
+                                  inmet_folder, inmet_n_estacoes, inmet_mode, pasta_shard, template_site100)
+        for erro in escritor.erros:
+            registrar(f" {erro}", 'gravacao', None)
+
+        def escrever_log(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        gravar_atomico(os.path.join(pasta_shard, ARQUIVO_LOG_SHARD), escrever_log)
+
+        resumo = resumo_metricas(finalizar_metricas(metricas_jsonl))
+        manifesto = {
+            'shard_index': shard_index, 'shard_count': shard_count, 'total_pontos': total_pontos,
+            'csv_pontos': os.path.abspath(csv_pontos_path),
+            'pontos': [[indice, str(nome)] for indice, nome in zip(indices, pontos_shard['ponto'])],
+            'falhas_gravacao': len(escritor.erros), 'resumo_metricas': resumo, 'concluido': True,
+        }
+        def escrever_manifesto(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifesto, f, ensure_ascii=False, indent=1)
+        gravar_atomico(manifesto_path, escrever_manifesto)
 
-        log_messages.append("\n--- Processando Clima (Passo 3/3) ---")
-        for index, row in pontos_df.iterrows():
-            nome_sitio = str(row['ponto'])
-            lat_str = str(row['lat'])
-            lon_str = str(row['lon'])
+        return (f"--- Shard {shard_index + 1}/{shard_count} Concluído: {len(indices)} de {total_pontos} Pontos ---\n"
+                f"Saídas em:\n{pasta_shard}\n\n{resumo}")
 
-            inmet_search = encontrar_estacoes_proximas(inmet_folder, lat_str, lon_str, inmet_n_estacoes, is_batch=True)
-            
-            if inmet_search['status'] == 'erro':
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima BUSCA ERRO - {inmet_search['message']}")
+    except Exception as e:
+        finalizar_metricas(metricas_jsonl)
+        return f"Erro fatal durante o processamento do shard {shard_index + 1}/{shard_count}:\n{e}"
+
+def _somar_deduplicacao(mensagens):
+    # Soma as linhas "Deduplicação por pixel" de cada shard numa única linha
+    soma = [0, 0]
+    for msg in mensagens:
+        m = re.search(r"LULC (\d+) pontos -> (\d+) ", msg)
+        if m:
+            soma = [a + int(b) for a, b in zip(soma, m.groups())]
+    if not soma[0]:
+        return None
+    return f"Deduplicação por pixel: LULC {soma[0]} pontos -> {soma[1]} pixels únicos (razão {soma[0] / max(soma[1], 1):.2f}x)"
+
+def mesclar_shards(pasta_raiz, pasta_destino=None, shard_count=None):
+    # Junta as saídas dos shards em pasta_destino (padrão: pasta_raiz) e reconstrói o log na
+    # mesma ordem de uma execução em um único nó: por passo e, dentro do passo, pelo índice global.
+    # Se dois pontos têm o mesmo nome, vale o arquivo do ponto de maior índice, como no nó único.
+    pasta_destino = pasta_destino or pasta_raiz
+    manifestos = []
+    for nome in sorted(os.listdir(pasta_raiz)) if os.path.isdir(pasta_raiz) else []:
+        m = re.fullmatch(r"shard_(\d{3})_de_(\d{3})", nome)
+        if not m:
+            continue
+        if shard_count is None:
+            shard_count = int(m.group(2))
+        if int(m.group(2)) != int(shard_count):
+            continue
+        manifesto_path = os.path.join(pasta_raiz, nome, ARQUIVO_MANIFESTO_SHARD)
+        if not os.path.exists(manifesto_path):
+            return {'status': 'erro', 'message': f"Shard incompleto (sem manifesto): {nome}"}
+        with open(manifesto_path, encoding='utf-8') as f:
+            manifesto = json.load(f)
+        manifesto['pasta'] = os.path.join(pasta_raiz, nome)
+        manifestos.append(manifesto)
+
+    if not manifestos:
+        return {'status': 'erro', 'message': f"Nenhum shard encontrado em:\n{pasta_raiz}"}
+    encontrados = sorted(m['shard_index'] for m in manifestos)
+    if encontrados != list(range(int(shard_count))):
+        faltando = sorted(set(range(int(shard_count))) - set(encontrados))
+        return {'status': 'erro', 'message': f"Shards ausentes ou incompletos: {[i + 1 for i in faltando]} de {shard_count}"}
+    if len({m['total_pontos'] for m in manifestos}) != 1 or len({m['csv_pontos'] for m in manifestos}) != 1:
+        return {'status': 'erro', 'message': "Os shards não vêm da mesma execução (CSV ou total de pontos diferentes)."}
+    if not all(m.get('concluido') for m in manifestos):
+        return {'status': 'erro', 'message': "Há shards não concluídos."}
+    manifestos.sort(key=lambda m: m['shard_index'])
+    total_pontos = manifestos[0]['total_pontos']
+    os.makedirs(pasta_destino, exist_ok=True)
+
+    # Arquivos: para cada nome, escolhe o shard cujo ponto dono tem o maior índice global
+    nomes_sitios = sorted({nome for m in manifestos for _, nome in m['pontos']}, key=len, reverse=True)
+    internos = {ARQUIVO_MANIFESTO_SHARD, ARQUIVO_LOG_SHARD, ARQUIVO_METRICAS_SHARD}
+    candidatos = {}
+    for m in manifestos:
+        maior_indice = {}
+        for indice, nome in m['pontos']:
+            maior_indice[nome] = max(indice, maior_indice.get(nome, -1))
+        for arquivo in sorted(os.listdir(m['pasta'])):
+            if arquivo in internos or arquivo.startswith('.') or not os.path.isfile(os.path.join(m['pasta'], arquivo)):
                 continue
-            
-            top_estacoes = inmet_search['top_estacoes']
-            
-            media_result = processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=True)
-            if media_result['status'] == 'ok':
-                output_media = os.path.join(downloads_path, f"{nome_sitio}_inmet_clima_media.csv")
-                media_result['data'].to_csv(output_media, index=False)
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Média OK. Salvo CSV.")
-            else:
-                log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Média ERRO - {media_result['message']}")
-
-            if inmet_mode in ['ambos', 'anual']:
-                anual_result = gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=True)
-                if anual_result['status'] == 'ok':
-                    output_anual = os.path.join(downloads_path, f"{nome_sitio}_inmet_clima_anual.csv")
-                    anual_result['data'].to_csv(output_anual, index=False)
-                    log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Anual (CSV) OK. Salvo CSV.")
-                    
-                    if inmet_mode == 'ambos':
-                        wth_result = gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=True)
-                        if wth_result['status'] == 'ok':
-                            log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima WTH OK. Salvo .WTH.")
-                        else:
-                            log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima WTH ERRO - {wth_result['message']}")
-                else:
-                    log_messages.append(f" Ponto {index+1}/{total_pontos} ({nome_sitio}): Clima Anual ERRO - {anual_result['message']}")
-        
-        log_messages.append("\n--- Processamento de Lote Concluído ---")
-        return "\n".join(log_messages)
-
+            dono = next((n for n in nomes_sitios if arquivo.startswith(n + '_') or arquivo == n + '.wth'), None)
+            chave = (maior_indice.get(dono, -1), m['shard_index'])
+            if arquivo not in candidatos or chave > candidatos[arquivo][0]:
+                candidatos[arquivo] = (chave, m['pasta'])
+    for arquivo, (_, pasta) in sorted(candidatos.items()):
+        shutil.move(os.path.join(pasta, arquivo), os.path.join(pasta_destino, arquivo))
+
+    # Log: cabeçalho, deduplicação somada, passos 1-3 ordenados pelo índice global
+    registros = []
+    for m in manifestos:
+        with open(os.path.join(m['pasta'], ARQUIVO_LOG_SHARD), encoding='utf-8') as f:
+            for seq, linha in enumerate(f):
+                registro = json.loads(linha)
+                registro['ordem'] = (m['shard_index'], seq)
+                registros.append(registro)
+
+    log_messages = [f"--- Início do Processamento de Lote ({total_pontos} Pontos) ---"]
+    deduplicacao = _somar_deduplicacao(r['msg'] for r in registros if r['passo'] == 0)
+    if deduplicacao:
+        log_messages.append(deduplicacao)
+    for passo in (1, 2, 3):
+        cabecalho = next((r['msg'] for r in registros if r['passo'] == passo and r['indice'] is None), None)
+        if cabecalho:
+            log_messages.append(cabecalho)
+        linhas = sorted((r for r in registros if r['passo'] == passo and r['indice'] is not None), key=lambda r: (r['indice'], r['ordem']))
+        log_messages.extend(r['msg'] for r in linhas)
+    falhas = [r['msg'] for r in registros if r['passo'] == 'gravacao']
+    if falhas:
+        log_messages.append(f"\n--- Falhas de Gravação ({len(falhas)}) ---")
+        log_messages.extend(falhas)
+    log_messages.append("\n--- Processamento de Lote Concluído ---")
+    for m in manifestos:
+        log_messages.append(f"\n[Shard {m['shard_index'] + 1}/{shard_count}: {len(m['pontos'])} pontos]\n{m['resumo_metricas']}")
+    log_final = "\n".join(log_messages)
+
+    with open(os.path.join(pasta_destino, "lote_log_mesclado.txt"), 'w', encoding='utf-8') as f:
+        f.write(log_final)
+    with open(os.path.join(pasta_destino, "lote_metricas_mesclado.jsonl"), 'w', encoding='utf-8') as saida:
+        for m in manifestos:
+            metricas_path = os.path.join(m['pasta'], ARQUIVO_METRICAS_SHARD)
+            if os.path.exists(metricas_path):
+                with open(metricas_path, encoding='utf-8') as f:
+                    shutil.copyfileobj(f, saida)
+
+    return {'status': 'ok', 'message': log_final, 'arquivos': len(candidatos)}
+
+def contexto_processos():
+    # Processos filhos que não herdam as threads deste processo (GUI, escritor, pré-carregamento, servidor): um
+    # 'fork' copia travas seguradas por essas threads e pode travar o filho. 'forkserver' (Linux) ou 'spawn'
+    # importam este módulo no filho; None quando não há arquivo a importar (código rodando numa célula de notebook).
+    if __name__ == '__main__' and not getattr(sys.modules['__main__'], '__file__', None):
+        return None
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in metodos else 'spawn')
+
+def _executar_shard_processo(argumentos, fila):
+    indice = argumentos[-3]
+    try:
+        mensagem = processar_lote_dados(*argumentos)
     except Exception as e:
-        return f"Erro fatal durante o processamento em lote:\n{e}"
+        mensagem = f"--- Shard {indice + 1}: ERRO - {e} ---"
+    fila.put((indice, mensagem))
+
+def coletar_resultados_shards(processos, fila, intervalo=1.0):
+    # Mensagens na ordem dos shards. A fila é lida com timeout e os processos conferidos pelo exitcode: um filho
+    # que morre sem responder (falta de memória, falha no GDAL) vira mensagem de erro em vez de travar o pai.
+    mensagens = {}
+    while len(mensagens) < len(processos):
+        try:
+            indice, mensagem = fila.get(timeout=intervalo)
+            mensagens[indice] = mensagem
+            continue
+        except queue.Empty:
+            pass
+        mortos = [i for i, p in enumerate(processos) if i not in mensagens and p.exitcode is not None]
+        if mortos:
+            # O resultado pode ter sido enviado logo antes da saída: esvazia a fila antes de dar o shard como perdido
+            try:
+                while True:
+                    indice, mensagem = fila.get(timeout=intervalo)
+                    mensagens[indice] = mensagem
+            except queue.Empty:
+                pass
+            for i in mortos:
+                mensagens.setdefault(i, f"--- Shard {i + 1}: ERRO - processo terminou sem resultado (código de saída {processos[i].exitcode}) ---")
+    return [mensagens[i] for i in range(len(processos))]
+
+def executar_lote_sharded_local(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, shard_count, pasta_saida=None, template_site100=None):
+    # Simula vários nós na mesma máquina: um processo por shard (ver contexto_processos), depois a mesclagem.
+    # Sem processos disponíveis (notebook), os shards rodam um após o outro neste processo.
+    pasta_saida = obter_pasta_saida(pasta_saida)
+    argumentos = [(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode,
+                   None, None, pasta_saida, i, shard_count, template_site100) for i in range(shard_count)]
+    contexto = contexto_processos()
+    if contexto is None:
+        mensagens = [processar_lote_dados(*a) for a in argumentos]
+    else:
+        fila = contexto.Queue()
+        processos = [contexto.Process(target=_executar_shard_processo, args=(a, fila)) for a in argumentos]
+        for p in processos:
+            p.start()
+        mensagens = coletar_resultados_shards(processos, fila)
+        for p in processos:
+            p.join()
+    resultado = mesclar_shards(pasta_saida, pasta_saida, shard_count)
+    resultado['shards'] = mensagens
+    if resultado['status'] == 'erro':
+        resultado['message'] += "".join(f"\n{m}" for m in mensagens if m.startswith('--- Shard') and ': ERRO - ' in m)
+    return resultado
+
+class LinhaDoTempo:
+    # Itens da linha do tempo (display, dados) com IDs estáveis. Os IDs crescem na ordem de inserção, então
+    # _ordem fica sempre ordenada e a posição de um ID sai de uma busca binária; o maior 'last_year' e o maior
+    # número de bloco são mantidos incrementalmente e as alterações pendentes são aplicadas na Listbox sem
+    # recriar a lista inteira.
+    def __init__(self, itens=()):
+        self._itens = {}
+        self._ids = itertools.count(1)
+        self._ordem = []
+        self._anos = {}
+        self._blocos = {}
+        self._maior_ano = None
+        self._maior_bloco = None
+        self._pendentes = []
+        self.estender(itens)
+
+    def __iter__(self):
+        return iter(self._itens.values())
+
+    def __len__(self):
+        return len(self._itens)
+
+    def __bool__(self):
+        return bool(self._itens)
+
+    @staticmethod
+    def _cabecalho(data):
+        tipo = data.get('tipo')
+        if tipo == 'BLOCO_COMPLETO':
+            return data.get('header') or {}
+        if tipo == 'HEADER':
+            return data
+        return None
+
+    @staticmethod
+    def _contar(contagem, valor, delta):
+        try:
+            valor = int(valor)
+        except (TypeError, ValueError):
+            return None
+        n = contagem.get(valor, 0) + delta
+        if n > 0:
+            contagem[valor] = n
+        else:
+            contagem.pop(valor, None)
+        return valor
+
+    def _indexar(self, data, delta):
+        h = self._cabecalho(data)
+        if h is None:
+            return
+        ano = self._contar(self._anos, h.get('last_year'), delta)
+        bloco = self._contar(self._blocos, h.get('num'), delta)
+        if delta > 0:
+            if ano is not None and (self._maior_ano is None or ano > self._maior_ano):
+                self._maior_ano = ano
+            if bloco is not None and (self._maior_bloco is None or bloco > self._maior_bloco):
+                self._maior_bloco = bloco
+        else:
+            # Só recalcula o máximo quando o último item com esse valor sai da linha do tempo
+            if ano is not None and ano == self._maior_ano and ano not in self._anos:
+                self._maior_ano = max(self._anos) if self._anos else None
+            if bloco is not None and bloco == self._maior_bloco and bloco not in self._blocos:
+                self._maior_bloco = max(self._blocos) if self._blocos else None
+
+    def adicionar(self, display, data):
+        item_id = next(self._ids)
+        self._itens[item_id] = (display, data)
+        self._ordem.append(item_id)
+        self._indexar(data, 1)
+        if self._pendentes and self._pendentes[-1][0] == 'inserir':
+            self._pendentes[-1][1].append(display)
+        else:
+            self._pendentes.append(('inserir', [display]))
+        return item_id
+
+    def estender(self, itens):
+        return [self.adicionar(display, data) for display, data in itens]
+
+    def obter(self, item_id):
+        return self._itens[item_id]
+
+    def ids(self):
+        return self._ordem
+
+    def item_no_indice(self, indice):
+        item_id = self.ids()[indice]
+        display, data = self._itens[item_id]
+        return item_id, display, data
+
+    def remover(self, item_id, indice=None):
+        display, data = self._itens.pop(item_id)
+        if indice is None:
+            indice = bisect.bisect_left(self._ordem, item_id)
+        del self._ordem[indice]
+        self._indexar(data, -1)
+        self._pendentes.append(('remover', indice))
+        return display, data
+
+    def remover_indice(self, indice):
+        item_id = self.ids()[indice]
+        return self.remover(item_id, indice)
+
+    def limpar(self):
+        self._itens.clear()
+        self._ordem = []
+        self._anos.clear()
+        self._blocos.clear()
+        self._maior_ano = None
+        self._maior_bloco = None
+        self._pendentes = [('limpar', None)]
+
+    def maior_last_year(self):
+        return self._maior_ano
+
+    def proximo_bloco(self):
+        return 1 if self._maior_bloco is None else self._maior_bloco + 1
+
+    def exibicoes(self):
+        return [display for display, _ in self._itens.values()]
+
+    def aplicar_na_listbox(self, elemento):
+        # Aplica apenas as inserções/remoções pendentes no widget; sem o widget tk, recria a lista
+        pendentes, self._pendentes = self._pendentes, []
+        lista_tk = getattr(elemento, 'TKListbox', None)
+        if lista_tk is None or any(op == 'limpar' for op, _ in pendentes):
+            elemento.update(values=self.exibicoes())
+            return
+        valores = list(elemento.Values)
+        for op, arg in pendentes:
+            if op == 'inserir':
+                lista_tk.insert('end', *arg)
+                valores.extend(arg)
+            elif op == 'remover':
+                lista_tk.delete(arg)
+                del valores[arg]
+        elemento.Values = valores
+
 
 def get_next_available_year(timeline_data, values):
     # Extracts the simulation starting year from global settings first
@@ -866,6 +2403,13 @@ def get_next_available_year(timeline_data, values):
     # Find the maximum last year set in any block so far
     last_block_year = current_sim_start_year - 1
     
+    if isinstance(timeline_data, LinhaDoTempo):
+        # Máximo mantido incrementalmente pelo modelo da linha do tempo
+        maior = timeline_data.maior_last_year()
+        if maior is not None and maior > last_block_year:
+            last_block_year = maior
+        return str(last_block_year + 1)
+
     for _, data in timeline_data:
         # Check if it's a block header (complete or manual)
         if data.get('tipo') in ['BLOCO_COMPLETO', 'HEADER']:
@@ -880,21 +2424,124 @@ def get_next_available_year(timeline_data, values):
     return str(last_block_year + 1)
 
 
-def processar_mapbiomas_em_blocos(mb_csv_path, start_block_num_str, year_limit_str, timeline_data_current, values):
-    try:
-        start_block_num = int(start_block_num_str)
-        year_limit = int(year_limit_str)
-    except ValueError:
-        return {'status': 'erro', 'message': "Erro: Número do Bloco Inicial e Ano Limite devem ser números inteiros válidos."}
+def get_lulc_category(class_name):
+    if 'Formação Savânica' in class_name or 'Formação Campestre' in class_name or 'Vegetação Herbácea e Arbustiva' in class_name:
+        return 'SAVANA'
+    elif 'Soja' in class_name or 'Lavoura Temporária' in class_name or 'Agricultura' in class_name:
+        return 'SOJA'
+    elif 'Pastagem' in class_name or 'Agropecuária' in class_name or 'Lavoura Perene' in class_name or 'Mosaico de Usos' in class_name:
+        return 'PASTAGEM'
+    return 'OUTRO'
+
+def categorizar_classes(classes):
+    # Categoria de cada linha, calculando get_lulc_category uma vez por classe distinta
+    classes = np.asarray(classes, dtype=object)
+    unicas, inversa = np.unique(classes.astype(str), return_inverse=True) if len(classes) else (np.array([]), np.array([], dtype=int))
+    originais = {}
+    for valor, chave in zip(classes, inversa):
+        originais.setdefault(chave, valor)
+    categorias_unicas = np.array([get_lulc_category(originais[k]) for k in range(len(unicas))], dtype=object)
+    return categorias_unicas[inversa] if len(classes) else np.array([], dtype=object)
+
+def codificar_runs_lulc(anos, categorias, grupos=None):
+    # Run-length: um trecho termina quando a categoria muda, há salto de ano ou (cubo) muda o ponto.
+    # Retorna os arrays de início e fim (exclusivo) de cada trecho.
+    n = len(anos)
+    quebra = np.ones(n, dtype=bool)
+    if n > 1:
+        anos = np.asarray(anos)
+        quebra[1:] = (categorias[1:] != categorias[:-1]) | (anos[1:] != anos[:-1] + 1)
+        if grupos is not None:
+            quebra[1:] |= grupos[1:] != grupos[:-1]
+    inicios = np.flatnonzero(quebra)
+    fins = np.append(inicios[1:], n).astype(int) if n else inicios.copy()
+    return inicios, fins
+
+def emitir_blocos_lulc(anos, classes, categorias, inicios, fins, start_block_num, weather_choice_desc, classe_por_ano, eventos=None):
+    # Percorre os trechos e gera os blocos: SAVANA em ciclos de 5 anos, PASTAGEM/SOJA em um bloco
+    # e, quando a PASTAGEM vem de SAVANA no ano anterior (classe_por_ano: 1ª linha de cada ano
+    # no CSV completo), um bloco de transição de 2 anos antes.
+    # eventos: conjunto de eventos por tipo de bloco (ver CONJUNTOS_EVENTOS_LULC); padrão EVENTOS_LULC_PADRAO.
+    eventos = eventos or EVENTOS_LULC_PADRAO
+    generated_blocks = []
+    current_block_num = int(start_block_num)
+    weather_code = WEATHER_DESC_TO_CODE.get(weather_choice_desc, 'C')
 
-    if not LIBS_INSTALADAS or 'pandas' not in sys.modules:
-        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'pandas' ausentes."}
+    def adicionar(linha_display, header, events):
+        generated_blocks.append((linha_display, {'tipo': 'BLOCO_COMPLETO', 'header': header, 'events': events}))
+        generated_blocks.append((f"--- FIM DO BLOCO (-999 -999 X) do Bloco {header['num']} ---", {'tipo': 'TERMINATOR'}))
 
-    try:
-        try:
-            df = pd.read_csv(mb_csv_path)
-        except UnicodeDecodeError:
-            df = pd.read_csv(mb_csv_path, encoding='latin1')
+    def cabecalho(last_year, repeats, out_year, lulc_desc):
+        return {'tipo': 'HEADER', 'num': str(current_block_num), 'last_year': str(last_year), 'repeats': str(repeats),
+                'out_year': str(out_year), 'out_month': '1', 'out_interval': '1', 'weather': weather_choice_desc,
+                'block_description': lulc_desc}
+
+    for i, j in zip(inicios.tolist(), fins.tolist()):
+        current_category = categorias[i]
+        if current_category == 'OUTRO':
+            continue
+        current_class = classes[i]
+        consecutive_years = j - i
+        block_start_year = anos[i]
+
+        if current_category == 'PASTAGEM' and consecutive_years >= 2:
+            prev_class_name = classe_por_ano.get(block_start_year - 1)
+            if prev_class_name is not None and get_lulc_category(prev_class_name) == 'SAVANA':
+                transition_block_last_year = block_start_year + 1
+                lulc_desc = f"{prev_class_name} -> {current_class} ({block_start_year} - {transition_block_last_year})"
+                adicionar(f"BLOCO {current_block_num}: Desmatamento/Plantio Pastagem (Transição SAVANA) (Anos {block_start_year} - {transition_block_last_year}, Repete 2x)",
+                          cabecalho(transition_block_last_year, 2, block_start_year, lulc_desc), eventos['TRANSICAO'])
+                current_block_num += 1
+                block_start_year = transition_block_last_year + 1
+                consecutive_years -= 2
+
+        if current_category == 'SAVANA':
+            for current_idx in range(i, j, 5):
+                years_in_block = min(5, j - current_idx)
+                out_year = anos[current_idx]
+                block_last_year_calc = anos[current_idx + years_in_block - 1]
+                display_type = "" if years_in_block == 5 else " (Ciclo Parcial)"
+                header = cabecalho(block_last_year_calc, years_in_block, out_year, f"{current_class} ({out_year} - {block_last_year_calc})")
+                adicionar(f"BLOCO {current_block_num}: Savana Padrão (LULC) (Anos {header['out_year']} - {header['last_year']}, Repete {years_in_block}x){display_type}",
+                          header, eventos['SAVANA'])
+                current_block_num += 1
+
+        elif consecutive_years > 0:
+            if current_category == 'PASTAGEM':
+                block_events = eventos['PASTAGEM'] # Maintenance block uses BE8
+                block_type_name = "Mantendo Pastagem Tradicional (LULC)"
+            else:
+                block_events = eventos['SOJA']
+                block_type_name = "Soja (LULC) - Ciclo Anual"
+            final_block_last_year = block_start_year + consecutive_years - 1
+            lulc_desc = f"{current_class} ({block_start_year} - {final_block_last_year})"
+            adicionar(f"BLOCO {current_block_num}: {block_type_name} (Anos {block_start_year} - {final_block_last_year}, Repete {consecutive_years}x, Clima: {weather_code})",
+                      cabecalho(final_block_last_year, consecutive_years, block_start_year, lulc_desc), block_events)
+            current_block_num += 1
+
+    return generated_blocks
+
+def _ler_csv_mapbiomas(mb_csv_path):
+    if isinstance(mb_csv_path, pd.DataFrame):
+        return mb_csv_path
+    try:
+        return pd.read_csv(mb_csv_path)
+    except UnicodeDecodeError:
+        return pd.read_csv(mb_csv_path, encoding='latin1')
+
+def preparar_serie_lulc(mb_csv_path, start_block_num_str, year_limit_str, timeline_data_current, values):
+    # Valida e filtra a série e calcula os trechos (run-length); base de processar_mapbiomas_em_blocos
+    try:
+        start_block_num = int(start_block_num_str)
+        year_limit = int(year_limit_str)
+    except ValueError:
+        return {'status': 'erro', 'message': "Erro: Número do Bloco Inicial e Ano Limite devem ser números inteiros válidos."}
+
+    if not LIBS_INSTALADAS or 'pandas' not in sys.modules:
+        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'pandas' ausentes."}
+
+    try:
+        df = _ler_csv_mapbiomas(mb_csv_path)
         
         required_cols = ['Ano', 'Classe_MapBiomas']
         if not all(col in df.columns for col in required_cols):
@@ -915,234 +2562,86 @@ def processar_mapbiomas_em_blocos(mb_csv_path, start_block_num_str, year_limit_s
 
     except Exception as e:
         return {'status': 'erro', 'message': f"Erro ao ler ou processar CSV MapBiomas: {e}"}
-        
-    generated_blocks = []
-    current_block_num = int(start_block_num)
-    i = 0
 
-    # --- NEW CODE START: Read weather choice from UI ---
     mb_weather_desc = values.get('-MB_WEATHER_COMBO-') or WEATHER_CHOICES_MAP['C']
-    # --- NEW CODE END ---
-
-    def get_lulc_category(class_name):
-        if 'Formação Savânica' in class_name or 'Formação Campestre' in class_name or 'Vegetação Herbácea e Arbustiva' in class_name:
-            return 'SAVANA'
-        elif 'Soja' in class_name or 'Lavoura Temporária' in class_name or 'Agricultura' in class_name:
-            return 'SOJA'
-        elif 'Pastagem' in class_name or 'Agropecuária' in class_name or 'Lavoura Perene' in class_name or 'Mosaico de Usos' in class_name:
-            return 'PASTAGEM'
-        return 'OUTRO'
 
+    anos = df_filtered['Ano'].tolist()
+    classes = df_filtered['Classe_MapBiomas'].tolist()
+    categorias = categorizar_classes(classes)
+    inicios, fins = codificar_runs_lulc(np.asarray(anos), categorias)
+    primeiras = df.drop_duplicates(subset='Ano', keep='first')
+    classe_por_ano = dict(zip(primeiras['Ano'].tolist(), primeiras['Classe_MapBiomas'].tolist()))
+    return {'status': 'ok', 'anos': anos, 'classes': classes, 'categorias': categorias, 'inicios': inicios, 'fins': fins,
+            'classe_por_ano': classe_por_ano, 'start_block_num': start_block_num, 'year_limit': year_limit, 'weather': mb_weather_desc}
 
-    while i < len(df_filtered):
-        current_year = df_filtered.iloc[i]['Ano']
-        current_class = df_filtered.iloc[i]['Classe_MapBiomas']
-        
-        if current_year > year_limit:
-            break
+def processar_mapbiomas_em_blocos(mb_csv_path, start_block_num_str, year_limit_str, timeline_data_current, values):
+    serie = preparar_serie_lulc(mb_csv_path, start_block_num_str, year_limit_str, timeline_data_current, values)
+    if serie['status'] != 'ok':
+        return serie
+    generated_blocks = emitir_blocos_lulc(serie['anos'], serie['classes'], serie['categorias'], serie['inicios'], serie['fins'],
+                                          serie['start_block_num'], serie['weather'], serie['classe_por_ano'])
+    return {'status': 'ok', 'blocks': generated_blocks}
 
-        current_category = get_lulc_category(current_class)
-        
-        if current_category == 'OUTRO':
-            i += 1
+def assinatura_schedule_lulc(serie, *extras):
+    # Hash do que define os blocos gerados: sequência de trechos (categoria, classe e ano iniciais,
+    # nº de anos, classe do ano anterior quando pode haver transição), bloco inicial, ano limite e clima.
+    # Séries com a mesma assinatura geram exatamente os mesmos blocos.
+    trechos = []
+    for i, j in zip(serie['inicios'].tolist(), serie['fins'].tolist()):
+        categoria = serie['categorias'][i]
+        if categoria == 'OUTRO':
             continue
+        anterior = serie['classe_por_ano'].get(serie['anos'][i] - 1) if categoria == 'PASTAGEM' and j - i >= 2 else None
+        trechos.append((categoria, serie['classes'][i], serie['anos'][i], j - i, anterior))
+    conteudo = repr((trechos, serie['start_block_num'], serie['year_limit'], serie['weather'], extras))
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+def processar_mapbiomas_em_blocos_lote(mb_dados, start_block_num_str, year_limit_str, timeline_data_current, values):
+    # Versão para um cubo de sítios (tabela com a coluna 'ponto', ex: várias extrações concatenadas):
+    # filtro, ordenação, categorias e run-length são feitos uma única vez para todos os sítios.
+    # Retorna {'status': 'ok', 'resultados': {ponto: resultado igual ao de processar_mapbiomas_em_blocos}}.
+    try:
+        start_block_num = int(start_block_num_str)
+        year_limit = int(year_limit_str)
+    except ValueError:
+        return {'status': 'erro', 'message': "Erro: Número do Bloco Inicial e Ano Limite devem ser números inteiros válidos."}
 
+    try:
+        df = _ler_csv_mapbiomas(mb_dados)
+        required_cols = ['Ano', 'Classe_MapBiomas', 'ponto']
+        if not all(col in df.columns for col in required_cols):
+            return {'status': 'erro', 'message': f"CSV MapBiomas inválido. Requer colunas: {required_cols}"}
 
-        # Start of grouping consecutive years of the same category
-        j = i
-        while j < len(df_filtered) and df_filtered.iloc[j]['Ano'] <= year_limit:
-            next_category = get_lulc_category(df_filtered.iloc[j]['Classe_MapBiomas'])
-            
-            # Condição para quebrar o agrupamento:
-            # 1. Mudança de Categoria.
-            # 2. Descontinuidade no ano.
-            if next_category != current_category or (j > i and df_filtered.iloc[j]['Ano'] != df_filtered.iloc[j-1]['Ano'] + 1):
-                break
-            j += 1
-        
-        consecutive_years = j - i
-        
-        block_start_year = current_year 
-        block_last_year = df_filtered.iloc[j-1]['Ano']
-        
-        # Determine block events and parameters based on category
-        block_events = None
-        block_type_name = None
-        weather_choice_desc = mb_weather_desc # USE THE READ VALUE
-        repeats = str(consecutive_years)
-
-        
-        # --- SPECIAL TRANSITION CHECK: SAVANA -> PASTAGEM (Requires 2 years) ---
-        is_transition_from_savana_to_pastagem = False
-        
-        if current_category == 'PASTAGEM' and consecutive_years >= 2:
-            previous_year = block_start_year - 1
-            
-            # Check the original full df (not just df_filtered)
-            prev_year_class_row = df[df['Ano'] == previous_year]
-
-            if not prev_year_class_row.empty:
-                prev_class_name = prev_year_class_row.iloc[0]['Classe_MapBiomas']
-                prev_category = get_lulc_category(prev_class_name)
-                
-                if prev_category == 'SAVANA':
-                    is_transition_from_savana_to_pastagem = True
-        
-        if is_transition_from_savana_to_pastagem:
-            
-            # 1. Generate the 2-year transition block (Block X)
-            years_consumed = 2 # This block is a 2-year sequence
-            transition_block_last_year = block_start_year + years_consumed - 1
-            prev_class_name = df[df['Ano'] == block_start_year - 1].iloc[0]['Classe_MapBiomas']
-            
-            lulc_desc = f"{prev_class_name} -> {current_class} ({block_start_year} - {transition_block_last_year})"
-            block_type_name = "Desmatamento/Plantio Pastagem (Transição SAVANA)"
-            
-            header = {
-                'tipo': 'HEADER', 
-                'num': str(current_block_num), 
-                'last_year': str(transition_block_last_year), 
-                'repeats': str(years_consumed),
-                'out_year': str(block_start_year),
-                'out_month': '1', 
-                'out_interval': '1', 
-                'weather': weather_choice_desc,
-                'block_description': lulc_desc 
-            }
-            
-            bloco_completo = {
-                'tipo': 'BLOCO_COMPLETO',
-                'header': header,
-                'events': BLOCO_SAVANA_TO_PASTAGEM_EVENTS
-            }
-            
-            generated_blocks.append((f"BLOCO {current_block_num}: {block_type_name} (Anos {block_start_year} - {transition_block_last_year}, Repete 2x)", bloco_completo))
-            
-            # Adiciona Terminador
-            terminator_data = {'tipo': 'TERMINATOR'}
-            linha_display_terminator = f"--- FIM DO BLOCO (-999 -999 X) do Bloco {current_block_num} ---"
-            generated_blocks.append((linha_display_terminator, terminator_data))
-            
-            current_block_num += 1
-            
-            # 2. Update starting year and remaining consecutive years for potential standard blocks
-            block_start_year = transition_block_last_year + 1
-            consecutive_years -= years_consumed
-            
-            # If the remaining years are > 0, they will be handled by the next section below
-        
-        # --- End of Special Transition Check ---
-
-
-        if current_category == 'SAVANA':
-            block_events = BLOCO_SAVANICA_EVENTS
-            block_type_name = "Savana Padrão (LULC)"
-            
-            years_to_process = consecutive_years
-            current_idx = i
-
-            while years_to_process > 0:
-                
-                if years_to_process >= 5:
-                    num_repeats = '5'
-                    years_in_block = 5
-                    block_last_year_calc = df_filtered.iloc[current_idx + years_in_block - 1]['Ano']
-                    display_type = ""
-                else:
-                    num_repeats = str(years_to_process)
-                    years_in_block = years_to_process
-                    block_last_year_calc = df_filtered.iloc[current_idx + years_in_block - 1]['Ano']
-                    display_type = " (Ciclo Parcial)"
+        next_available_year = int(get_next_available_year(timeline_data_current, values))
+        df = df.assign(ponto=df['ponto'].astype(str))
+        df_filtered = df[(df['Ano'] >= next_available_year) & (df['Ano'] <= year_limit)].sort_values(by=['ponto', 'Ano'], kind='stable')
+    except Exception as e:
+        return {'status': 'erro', 'message': f"Erro ao ler ou processar CSV MapBiomas: {e}"}
 
-                lulc_desc = f"{current_class} ({df_filtered.iloc[current_idx]['Ano']} - {block_last_year_calc})"
-                
-                header = {
-                    'tipo': 'HEADER', 
-                    'num': str(current_block_num), 
-                    'last_year': str(block_last_year_calc), 
-                    'repeats': num_repeats,
-                    'out_year': str(df_filtered.iloc[current_idx]['Ano']),
-                    'out_month': '1', 
-                    'out_interval': '1', 
-                    'weather': weather_choice_desc,
-                    'block_description': lulc_desc
-                }
-                
-                bloco_completo = {
-                    'tipo': 'BLOCO_COMPLETO',
-                    'header': header,
-                    'events': BLOCO_SAVANICA_EVENTS
-                }
-                
-                weather_code = WEATHER_DESC_TO_CODE.get(weather_choice_desc, 'C')
-                linha_display = f"BLOCO {current_block_num}: {block_type_name} (Anos {header['out_year']} - {header['last_year']}, Repete {num_repeats}x){display_type}"
-                
-                generated_blocks.append((linha_display, bloco_completo))
-                terminator_data = {'tipo': 'TERMINATOR'}
-                linha_display_terminator = f"--- FIM DO BLOCO (-999 -999 X) do Bloco {current_block_num} ---"
-                generated_blocks.append((linha_display_terminator, terminator_data))
-                
-                current_block_num += 1
-                current_idx += years_in_block
-                years_to_process -= years_in_block
-                
-            i = j
+    mb_weather_desc = values.get('-MB_WEATHER_COMBO-') or WEATHER_CHOICES_MAP['C']
+    pontos = df_filtered['ponto'].to_numpy()
+    anos = df_filtered['Ano'].tolist()
+    classes = df_filtered['Classe_MapBiomas'].tolist()
+    categorias = categorizar_classes(classes)
+    inicios, fins = codificar_runs_lulc(np.asarray(anos), categorias, pontos)
+
+    primeiras = df.drop_duplicates(subset=['ponto', 'Ano'], keep='first')
+    classe_por_ano = {}
+    for ponto, ano, classe in zip(primeiras['ponto'], primeiras['Ano'].tolist(), primeiras['Classe_MapBiomas']):
+        classe_por_ano.setdefault(ponto, {})[ano] = classe
+
+    resultados = {ponto: {'status': 'aviso', 'message': f"Nenhum dado MapBiomas encontrado no período de {next_available_year} até o ano limite {year_limit}. Verifique se o CSV cobre este período."}
+                  for ponto in pd.unique(df['ponto'])}
+    limites_sitios = np.append(np.flatnonzero(np.r_[True, pontos[1:] != pontos[:-1]]), len(pontos)) if len(pontos) else np.array([0])
+    for a, b in zip(limites_sitios[:-1].tolist(), limites_sitios[1:].tolist()):
+        ponto = pontos[a]
+        if anos[a] > next_available_year:
+            resultados[ponto] = {'status': 'aviso', 'message': f"O primeiro ano de MapBiomas encontrado ({anos[a]}) é posterior ao ano esperado ({next_available_year})."}
             continue
-
-        
-        # Dynamic block generation for standard Pastagem/Soja (or remainder after transition)
-        if current_category in ['PASTAGEM', 'SOJA'] and consecutive_years > 0:
-            
-            if current_category == 'PASTAGEM':
-                block_events = BLOCO_PASTAGEM_EVENTS # Maintenance block uses BE8
-                block_type_name = "Mantendo Pastagem Tradicional (LULC)"
-                
-            elif current_category == 'SOJA':
-                block_events = BLOCO_SOJA_EVENTS
-                block_type_name = "Soja (LULC) - Ciclo Anual"
-                
-            
-            if consecutive_years > 0:
-                
-                final_block_last_year = block_start_year + consecutive_years - 1
-                
-                lulc_desc = f"{current_class} ({block_start_year} - {final_block_last_year})"
-
-                header = {
-                    'tipo': 'HEADER', 
-                    'num': str(current_block_num), 
-                    'last_year': str(final_block_last_year), 
-                    'repeats': str(consecutive_years), 
-                    'out_year': str(block_start_year),
-                    'out_month': '1', 
-                    'out_interval': '1', 
-                    'weather': weather_choice_desc,
-                    'block_description': lulc_desc
-                }
-                
-                bloco_completo = {
-                    'tipo': 'BLOCO_COMPLETO',
-                    'header': header,
-                    'events': block_events
-                }
-                
-                weather_code = WEATHER_DESC_TO_CODE.get(weather_choice_desc, 'C')
-                linha_display = f"BLOCO {current_block_num}: {block_type_name} (Anos {block_start_year} - {final_block_last_year}, Repete {consecutive_years}x, Clima: {weather_code})"
-                
-                generated_blocks.append((linha_display, bloco_completo))
-                
-                terminator_data = {'tipo': 'TERMINATOR'}
-                linha_display_terminator = f"--- FIM DO BLOCO (-999 -999 X) do Bloco {current_block_num} ---"
-                generated_blocks.append((linha_display_terminator, terminator_data))
-                
-                current_block_num += 1
-            
-            i = j
-        
-        else:
-            i = j
-        
-    return {'status': 'ok', 'blocks': generated_blocks}
+        sel = (inicios >= a) & (inicios < b)
+        resultados[ponto] = {'status': 'ok', 'blocks': emitir_blocos_lulc(anos, classes, categorias, inicios[sel], fins[sel], start_block_num,
+                                                                          mb_weather_desc, classe_por_ano.get(ponto, {}))}
+    return {'status': 'ok', 'resultados': resultados}
 
 def gerar_texto_item(data):
     tipo = data.get('tipo', '')
@@ -1171,12 +2670,12 @@ def gerar_texto_item(data):
 {h['out_interval']:<14}Output interval
 {weather_code:<14}Weather choice
 """
-        for ev in data['events']:
-            # Pega o código curto do evento para o arquivo .sch
-            event_type_code = ev['event_type'].split(':')[0] if ':' in ev['event_type'] else ev['event_type']
-            texto += f"      {ev['block_num']:<5}{ev['month']:<5}{event_type_code}\n"
-            if ev['code']:
-                texto += f"{ev['code']}\n"
+        eventos = data['events']
+        if isinstance(eventos, EventosCompilados):
+            # Corpo do bloco já renderizado: apenas concatena ao cabeçalho
+            return texto + eventos.texto if eventos.texto else texto.rstrip()
+        for ev in eventos:
+            texto += formatar_evento_sch(ev['event_type'], ev['code'], ev['month'], ev['block_num'])
         return texto.rstrip()
 
     elif tipo == 'HEADER':
@@ -1198,11 +2697,7 @@ def gerar_texto_item(data):
     
     elif tipo == 'EVENT':
         ev = data
-        event_type_code = ev['event_type'].split(':')[0] if ':' in ev['event_type'] else ev['event_type']
-        linha_evento = f"      {ev['block_num']:<5}{ev['month']:<5}{event_type_code}\n"
-        if ev['code']:
-            linha_evento += f"{ev['code']}\n"
-        return linha_evento.rstrip()
+        return formatar_evento_sch(ev['event_type'], ev['code'], ev['month'], ev['block_num']).rstrip()
     
     elif tipo == 'TERMINATOR':
         return "-999 -999 X\n"
@@ -1210,12 +2705,9 @@ def gerar_texto_item(data):
     return "Não há preview para este item."
 
 
-def update_full_preview(window, values, timeline_data):
-    if not values:
-        return ""
-    
-    try:
-        conteudo_final = f"""{values['-ANO_INICIO-']:<14}Starting year
+def renderizar_cabecalho_sch(values):
+    # Cabeçalho global do .SCH: depende apenas dos campos globais (values)
+    return f"""{values['-ANO_INICIO-']:<14}Starting year
 {values['-ANO_FIM-']:<14}Last year
 {values['-SITE_FILE-']:<14}Site file name
 0             Labeling type
@@ -1232,773 +2724,2361 @@ def update_full_preview(window, values, timeline_data):
 {values['-INIT_TREE-']:<14}Initial tree
 
 """
-        
-        for _, data in timeline_data:
-            conteudo_final += gerar_texto_item(data) + "\n"
-        
-        window['-PREVIEW_COMPLETO-'].update(value=conteudo_final)
+
+def renderizar_sch(values, timeline_data, corpo=None):
+    # Conteúdo completo do .SCH: cabeçalho global (values) seguido dos itens da linha do tempo
+    if corpo is None:
+        corpo = ''.join([gerar_texto_item(data) + "\n" for _, data in timeline_data])
+    return renderizar_cabecalho_sch(values) + corpo
+
+# Cache do preview: texto de cada item indexado por id(item). A entrada guarda o próprio item, para o id não ser
+# reaproveitado por outro dicionário enquanto estiver no cache. Itens da linha do tempo são imutáveis depois de
+# adicionados (editar = remover e adicionar de novo), por isso o texto em cache nunca fica desatualizado.
+CACHE_TEXTO_ITENS = {}
+CACHE_PREVIEW_SCH = {'itens': [], 'corpo': '', 'texto': None}
+
+def texto_item_cacheado(data):
+    entrada = CACHE_TEXTO_ITENS.get(id(data))
+    if entrada is None or entrada[0] is not data:
+        entrada = (data, gerar_texto_item(data) + "\n")
+        CACHE_TEXTO_ITENS[id(data)] = entrada
+    return entrada[1]
+
+def corpo_preview_sch(timeline_data):
+    # Reaproveita o corpo inteiro se a sequência de itens não mudou (comparação por identidade);
+    # caso contrário remonta com join, renderizando apenas os itens que ainda não estão no cache
+    itens = [data for _, data in timeline_data]
+    anteriores = CACHE_PREVIEW_SCH['itens']
+    if len(itens) == len(anteriores) and all(map(operator.is_, itens, anteriores)):
+        return CACHE_PREVIEW_SCH['corpo']
+    corpo = ''.join([texto_item_cacheado(data) for data in itens])
+    if len(CACHE_TEXTO_ITENS) > 2 * len(itens) + 64:
+        vivos = set(map(id, itens))
+        for chave in [chave for chave in CACHE_TEXTO_ITENS if chave not in vivos]:
+            del CACHE_TEXTO_ITENS[chave]
+    CACHE_PREVIEW_SCH['itens'] = itens
+    CACHE_PREVIEW_SCH['corpo'] = corpo
+    return corpo
+
+def update_full_preview(window, values, timeline_data):
+    if not values:
+        return ""
+    
+    try:
+        conteudo_final = renderizar_sch(values, timeline_data, corpo=corpo_preview_sch(timeline_data))
+        # Evita reenviar ao widget um texto idêntico ao que já está exibido
+        if conteudo_final != CACHE_PREVIEW_SCH['texto']:
+            window['-PREVIEW_COMPLETO-'].update(value=conteudo_final)
+            CACHE_PREVIEW_SCH['texto'] = conteudo_final
         return conteudo_final
     except Exception as e:
         print(f"Erro ao atualizar preview: {e}")
         return ""
 
-# Define as opções padrão usando as chaves dos dicionários WEATHER_CHOICES_MAP para manter a consistência com o CENTURY.
-DEFAULT_WEATHER_M = WEATHER_CHOICES_MAP['M']
-DEFAULT_WEATHER_F = WEATHER_CHOICES_MAP['F']
-
-# Layout dos parâmetros globais ajustado para alinhamento vertical
-col_globais = [
-    [
-        sg.Column([
-            [sg.Text("Nome do Sítio:", size=(16,1), justification='right')], 
-            [sg.Text("Ano Início (Simulação):", size=(16,1), justification='right')], 
-            [sg.Text("Initial crop:", size=(16,1), justification='right')]
-        ], element_justification='right', pad=(0,0)), 
-        sg.Column([
-            [sg.Input("Lu_AFGO", key="-SITIO-", size=(14,1), enable_events=True)],
-            [sg.Input("1958", key="-ANO_INICIO-", size=(8,1), enable_events=True)],
-            [sg.Combo(INITIAL_CROP_OPTIONS, default_value='HER', key='-INIT_CROP-', size=(10,1), readonly=True, enable_events=True)]
-        ], pad=(0,0)), 
-        sg.Column([
-            [sg.Text("Arquivo .site.100:", size=(16,1), justification='right')],
-            [sg.Text("Ano Fim (Simulação):", size=(16,1), justification='right')],
-            [sg.Text("Initial tree:", size=(16,1), justification='right')]
-        ], element_justification='right', pad=(10,0)),
-        sg.Column([
-            [sg.Input("lu_site.100", key="-SITE_FILE-", size=(14,1), enable_events=True)],
-            [sg.Input("2025", key="-ANO_FIM-", size=(8,1), enable_events=True)],
-            [sg.Combo(INITIAL_TREE_OPTIONS, default_value='CER', key='-INIT_TREE-', size=(10,1), readonly=True, enable_events=True)]
-        ], pad=(0,0))
-    ]
-]
-
-
-col_bloco_padrao = [
-    [sg.Text("Ano Final do Bloco (Last Year):", size=(25,1)), sg.Input("1982", key='-P_LAST_YEAR-', size=(10,1), enable_events=True)],
-    [sg.Text("Ano Início da Saída (Output Year):", size=(25,1)), sg.Input("1958", key='-P_OUT_YEAR-', size=(10,1))],
-    [sg.Text("Weather Choice:", size=(25,1)), 
-     sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_M, key='-P_WEATHER_COMBO-', readonly=True, size=(30, 1))],
-    [sg.Button("Adicionar Bloco Padrão 1 (Cerrado)", key='-ADD_BLOCO_CERRADO-')]
-]
-
-col_bloco_desmatamento = [
-    [sg.Text("Block #: 2", size=(25,1)), sg.Text("Repeats #: 2", size=(10,1))],
-    [sg.Text("Ano Final do Bloco (Last Year):", size=(25,1)), sg.Input("1984", key='-D_LAST_YEAR-', size=(10,1), enable_events=True)],
-    [sg.Text("Ano Início da Saída (Output Year):", size=(25,1)), sg.Input("1983", key='-D_OUT_YEAR-', size=(10,1))],
-    [sg.Text("Weather Choice:", size=(25,1)), 
-     sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_F, key='-D_WEATHER_COMBO-', readonly=True, size=(30, 1))],
-    [sg.Button("Adicionar Bloco 2 (Desmat. + Past. Trad)", key='-ADD_BLOCO_DESMATAMENTO-')]
-]
-
-col_mapbiomas_automatico = [
-    [sg.Text("CSV MapBiomas Extraído:", size=(25,1)), 
-     sg.Input(key='-MB_CSV_FILE-', size=(15,1)), 
-     sg.FileBrowse("Procurar", target='-MB_CSV_FILE-', file_types=(("CSV Files", "*.csv"),))],
-    [sg.Text("Bloco # Inicial (ex: 3):", size=(25,1)), sg.Input("3", key='-MB_START_BLOCK_NUM-', size=(5,1))],
-    [sg.Text("Ano Limite de Análise (Máx 2015):", size=(25,1)), sg.Input("2015", key='-MB_YEAR_LIMIT-', size=(5,1))],
-    [sg.Text("Weather Choice (LULC Auto):", size=(25,1)), 
-     sg.Combo(WEATHER_CHOICES, default_value=WEATHER_CHOICES_MAP['C'], key='-MB_WEATHER_COMBO-', readonly=True, size=(30, 1))],
-    [sg.Button("Gerar Blocos LULC (até 2015)", key='-GENERATE_LULC_BLOCKS-', size=(30, 1), button_color=('white', '#8A2BE2'))]
-]
-
-col_bloco_manual_layout = [
-    [sg.Text("Block #:", size=(12,1)), sg.Input("3", size=(5,1), key='-B_NUM-')],
-    [sg.Text("Last Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_LAST_YEAR-')],
-    [sg.Text("Repeats #:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_REPEATS-')],
-    [sg.Text("Output Start Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_OUT_YEAR-')],
-    [sg.Text("Output Month:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_MONTH-')],
-    [sg.Text("Output Interval:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_INTERVAL-')],
-    [sg.Text("Weather:", size=(12,1)), 
-     sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_M, key='-B_WEATHER_COMBO-', readonly=True, size=(30, 1))],
-    [sg.Button("Adicionar Cabeçalho de Bloco Manual")]
-]
-
-col_evento_layout = [
-    [sg.Text("Tipo de Evento:", size=(15,1)), 
-     sg.Combo(ALL_EVENT_DESCRIPTIONS, key='-E_TIPO-', size=(20,1), readonly=True, enable_events=True)],
-    [sg.Text("Código Específico:", size=(15,1), key='-E_CODIGO_TXT-', visible=False), 
-     sg.Combo([], key='-E_CODIGO_COMBO-', size=(35,1), readonly=True, visible=False)],
-    [sg.Text("Ano (1, 2, ...):", size=(15,1)), sg.Input(size=(5,1), key='-E_BLOCK_NUM-')],
-    [sg.Text("Mês (1-12):", size=(15,1)), sg.Input(size=(5,1), key='-E_MES-')],
-    [sg.Button("Adicionar Evento Manual"), sg.Button("Fechar Bloco (-999)", key="Adicionar Terminador de Bloco (-999)", button_color=('white', 'firebrick'))],
-    [sg.Button("Gerar Arquivo .SCH", size=(15,2)), sg.Button("Sair", size=(10,2))]
-]
-
-# INSERÇÃO CORRIGIDA: Definição de coluna_timeline (estava faltando ou mal posicionada)
-coluna_timeline = [
-    [sg.Text("Preview do Arquivo .SCH", font=("Helvetica", 15))],
-    [sg.Multiline(size=(45, 30), key='-PREVIEW_COMPLETO-', disabled=True, font=("Courier New", 9), background_color='#F0F0F0', text_color='black')],
-    [sg.Text("Linha do Tempo (Itens Adicionados)", font=("Helvetica", 10))],
-    [sg.Listbox(values=[], size=(45, 10), key='-TIMELINE-', enable_events=True)],
-    [sg.Button("Selecionar Item", key="Carregar Item Selecionado"), sg.Button("Remover Selecionado"), sg.Button("Limpar Tudo")]
-]
-
-
-col_coordenadas = [
-    [sg.Text("Latitude (ex: -16.5):", size=(20,1)), sg.Input(size=(15,1), key='-MB_LAT-')],
-    [sg.Text("Longitude (ex: -49.2):", size=(20,1)), sg.Input(size=(15,1), key='-MB_LON-')],
-]
-
-col_mapbiomas = [
-    [sg.Text("Pasta Origem Lulc (.tif):", size=(20,1)), 
-     sg.Input(key='-MB_FOLDER-', size=(18,1)), 
-     sg.FolderBrowse("Procurar", target='-MB_FOLDER-')],
-    [sg.Button("Extrair Dados", key='-MB_EXTRACT-', size=(30, 1), button_color=('white', 'darkgreen'))]
-]
-
-col_solo = [
-    [sg.Text("Pasta Origem Solo (.tif):", size=(20,1)), 
-     sg.Input(key='-SOLO_FOLDER-', size=(18,1)), 
-     sg.FolderBrowse("Procurar", target='-SOLO_FOLDER-')],
-    [sg.Text("Profundidade:", size=(20,1)),
-     sg.Combo(['0-20cm', '0-30cm'], default_value='0-20cm', key='-SOLO_PROF-', readonly=True, size=(10,1))],
-    [sg.Button("Extrair Dados", key='-SOLO_EXTRACT-', size=(30, 1), button_color=('white', 'darkblue'))]
-]
-
-col_inmet = [
-    [sg.Text("Pasta Estações INMET (.csv):", size=(20,1)), 
-     sg.Input(key='-INMET_FOLDER-', size=(18,1)), 
-     sg.FolderBrowse("Procurar", target='-INMET_FOLDER-')],
-    [sg.Text("Nº de Estações p/ Média:", size=(20,1)), 
-     sg.Combo(['1', '2', '3'], default_value='3', key='-INMET_NUM_ESTACOES-', readonly=True, size=(5,1))],
-    [sg.Button("Processar Média Clima", key='-INMET_PROCESS-', size=(30, 1), button_color=('white', 'darkred'))],
-    [sg.Button("Criar Histórico.csv (Ano/Mês)", key='-INMET_WTH_CSV-', size=(30, 1), button_color=('white', '#800080'))],
-    [sg.Button("Criar Arquivo .WTH", key='-INMET_WTH_FILE-', size=(30, 1), button_color=('white', 'indigo'))]
-]
-
-col_site_100_creator = [
-    [sg.Text("1. Arquivo de Solo (média):", size=(20,1)), 
-     sg.Input(key='-SITE_SOLO_FILE-', size=(18,1)), 
-     sg.FileBrowse("Procurar", target='-SITE_SOLO_FILE-', file_types=(("CSV Files", "*.csv"),))],
-    [sg.Text("2. Arquivo de Clima (média):", size=(20,1)), 
-     sg.Input(key='-SITE_CLIMA_FILE-', size=(18,1)), 
-     sg.FileBrowse("Procurar", target='-SITE_CLIMA_FILE-', file_types=(("CSV Files", "*.csv"),))],
-    [sg.Text("3. Template site.100:", size=(20,1)), 
-     sg.Input(key='-SITE_TEMPLATE_FILE-', size=(18,1)), 
-     sg.FileBrowse("Procurar", target='-SITE_TEMPLATE_FILE-', file_types=(("Template Files", "*.100"),))],
-    [sg.Button("Criar Arquivo site.100", key='-SITE_100_CREATE-', size=(30, 1), button_color=('white', 'darkgreen'))]
-]
-
-layout_col_1 = [
-    [sg.Image(filename='lapig_logo.png', size=(338, 111), key='-LOGO_LAPIG-'), sg.Text("Carbono", font=("Helvetica", 18, 'bold'))],
-    [sg.Frame("Coordenadas (Lat/Lon) - Ponto Único", col_coordenadas, key='-F_COORD-')],
-    [sg.Frame("Extrator de Uso do Solo (MapBiomas) - Ponto Único", col_mapbiomas, key='-F_MAPBIOMAS-')],
-    [sg.Frame("Extrator de Dados de Solo (Embrapa) - Ponto Único", col_solo, key='-F_SOLO-')],
-    [sg.Frame("Extrator de Clima (INMET) - Ponto Único", col_inmet, key='-F_INMET-')],
-    [sg.Frame("Criar arquivo SITE.100", col_site_100_creator, key='-F_SITE_CREATOR-')],
-]
-
-col_lote = [
-    [sg.Text("csv Pontos (sitio,latitude,longitude)", size=(25,1)), 
-     sg.Input(key='-LOTE_CSV-', size=(10,1)), 
-     sg.FileBrowse("Procurar", target='-LOTE_CSV-', file_types=(("CSV Files", "*.csv"),))],
-    [sg.Text("Pasta LULC:", size=(12,1)), 
-     sg.Input(key='-LOTE_MB_FOLDER-', size=(16,1)), 
-     sg.FolderBrowse("Procurar", target='-LOTE_MB_FOLDER-')],
-    [sg.Text("Pasta SOLO:", size=(12,1)),
-     sg.Input(key='-LOTE_SOLO_FOLDER-', size=(16,1)), 
-     sg.FolderBrowse("Procurar", target='-LOTE_SOLO_FOLDER-')],
-    [sg.Text("Profundidade:", size=(12,1)),
-     sg.Combo(['0-20cm', '0-30cm'], default_value='0-20cm', key='-LOTE_SOLO_PROF-', readonly=True, size=(8,1))],
-    [sg.Text("Pasta CLIMA:", size=(12,1)), 
-     sg.Input(key='-LOTE_INMET_FOLDER-', size=(16,1)), 
-     sg.FolderBrowse("Procurar", target='-LOTE_INMET_FOLDER-')],
-    [sg.Text("Nº Estações:", size=(12,1)), 
-     sg.Combo(['1', '2', '3'], default_value='3', key='-LOTE_INMET_NUM_ESTACOES-', readonly=True, size=(8,1))],
-    [sg.Text("Saída Clima:", size=(12,1)), 
-     sg.Combo(['média', 'anual', 'ambos'], default_value='ambos', key='-LOTE_INMET_MODE-', readonly=True, size=(10,1))],
-    [sg.Text("⚠️ Apenas pontos na mesma fazenda.", font=('Helvetica', 10, 'bold'), text_color='orange')],
-    [sg.Button("EXECUTAR LOTE", key='-LOTE_EXECUTE-', size=(30, 2), button_color=('white', 'darkorange'))]
-]
-
-layout_col_2 = [
-    [sg.Frame("LOTE: Extração de Dados (LULC, Solo, Clima)", col_lote, key='-F_LOTE_PROCESS-')]
-]
-
-col_bloco_manual_layout = [
-    [sg.Text("Block #:", size=(12,1)), sg.Input("3", size=(5,1), key='-B_NUM-')],
-    [sg.Text("Last Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_LAST_YEAR-')],
-    [sg.Text("Repeats #:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_REPEATS-')],
-    [sg.Text("Output Start Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_OUT_YEAR-')],
-    [sg.Text("Output Month:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_MONTH-')],
-    [sg.Text("Output Interval:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_INTERVAL-')],
-    [sg.Text("Weather:", size=(12,1)), 
-     sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_M, key='-B_WEATHER_COMBO-', readonly=True, size=(30, 1))],
-    [sg.Button("Adicionar Cabeçalho de Bloco Manual")]
-]
-
-col_evento_layout = [
-    [sg.Text("Tipo de Evento:", size=(15,1)), 
-     sg.Combo(ALL_EVENT_DESCRIPTIONS, key='-E_TIPO-', size=(20,1), readonly=True, enable_events=True)],
-    [sg.Text("Código Específico:", size=(15,1), key='-E_CODIGO_TXT-', visible=False), 
-     sg.Combo([], key='-E_CODIGO_COMBO-', size=(35,1), readonly=True, visible=False)],
-    [sg.Text("Ano (1, 2, ...):", size=(15,1)), sg.Input(size=(5,1), key='-E_BLOCK_NUM-')],
-    [sg.Text("Mês (1-12):", size=(15,1)), sg.Input(size=(5,1), key='-E_MES-')],
-    [sg.Button("Adicionar Evento Manual"), sg.Button("Fechar Bloco (-999)", key="Adicionar Terminador de Bloco (-999)", button_color=('white', 'firebrick'))],
-    [sg.Button("Gerar Arquivo .SCH", size=(15,2)), sg.Button("Sair", size=(10,2))]
-]
-
-layout_col_3 = [
-    [sg.Frame("Parâmetros Globais", col_globais, key='-F_GLOBAIS-')],
-    [sg.Frame("Bloco 1: Padrão Savana", col_bloco_padrao, key='-F_PADRAO-')],
-    [sg.Frame("Bloco 2: Desmatamento + Pastagem Trad", col_bloco_desmatamento, key='-F_DESMATAMENTO-')],
-    [sg.Frame("Bloco X: Gerador Automático (MapBiomas)", col_mapbiomas_automatico, key='-F_LULC_AUTO-')],
-    [sg.Frame("Construtor de Bloco (Manual)", col_bloco_manual_layout, key='-F_MANUAL-')],
-    [sg.Frame("Construtor de Eventos (Manual)", col_evento_layout, key='-F_EVENTO-')]
-]
-
-layout_col_4 = [
-    [sg.Column(coluna_timeline)]
-]
-
-layout = [
-    [
-        sg.Column(layout_col_1, vertical_alignment='top'),
-        sg.VSeperator(),
-        sg.Column(layout_col_2, vertical_alignment='top'),
-        sg.VSeperator(),
-        sg.Column(layout_col_3, vertical_alignment='top'),
-        sg.VSeperator(),
-        sg.Column(layout_col_4, vertical_alignment='top')
-    ]
-]
-
-window = sg.Window("Construtor de Arquivos de Entrada CENTURY v28", layout, finalize=True)
-timeline_data = []
-global_keys = ['-SITIO-', '-SITE_FILE-', '-ANO_INICIO-', '-ANO_FIM-', '-INIT_CROP-', '-INIT_TREE-']
-need_preview_update = True
-
-if not LIBS_INSTALADAS:
-    sg.popup_error("Erro de Dependência: 'rasterio' e/ou 'pandas' não encontrados.\n\nAs funcionalidades de extração de dados estão desabilitadas.\n\nPor favor, feche o app e instale com:\npip install rasterio pandas")
-    window['-MB_EXTRACT-'].update(disabled=True)
-    window['-MB_FOLDER-'].update(disabled=True)
-    window['-SOLO_EXTRACT-'].update(disabled=True)
-    window['-SOLO_FOLDER-'].update(disabled=True)
-    window['-INMET_PROCESS-'].update(disabled=True)
-    window['-INMET_FOLDER-'].update(disabled=True)
-    window['-INMET_WTH_CSV-'].update(disabled=True)
-    window['-INMET_WTH_FILE-'].update(disabled=True)
-    window['-SITE_100_CREATE-'].update(disabled=True)
-    window['-LOTE_EXECUTE-'].update(disabled=True)
-    window['-LOTE_CSV-'].update(disabled=True)
-    window['-LOTE_MB_FOLDER-'].update(disabled=True)
-    window['-LOTE_SOLO_FOLDER-'].update(disabled=True)
-    window['-LOTE_INMET_FOLDER-'].update(disabled=True)
-    window['-GENERATE_LULC_BLOCKS-'].update(disabled=True)
-    window['-MB_CSV_FILE-'].update(disabled=True)
-
-else:
+def criar_bloco_padrao_savana(last_year, out_year, weather_desc):
+    header_padrao = {
+        'tipo': 'HEADER', 'num': '1', 'last_year': last_year, 'repeats': '5',
+        'out_year': out_year, 'out_month': '1', 'out_interval': '1', 'weather': weather_desc,
+        'block_description': f"Padrão Savana ({int(out_year)}-{int(last_year)})"
+    }
+    bloco_completo = {
+        'tipo': 'BLOCO_COMPLETO',
+        'header': header_padrao,
+        'events': BLOCO_PADRAO_SAVANA_EVENTS
+    }
+    linha_display = f"BLOCO 1: Padrão Savana (Até {last_year}, Clima: {WEATHER_DESC_TO_CODE.get(weather_desc, 'M')})"
+    return [(linha_display, bloco_completo), ("--- FIM DO BLOCO (-999 -999 X) ---", {'tipo': 'TERMINATOR'})]
+
+def criar_bloco_desmatamento(last_year, out_year, weather_desc):
+    header_bloco2 = {
+        'tipo': 'HEADER', 'num': '2', 'last_year': last_year, 'repeats': '2',
+        'out_year': out_year, 'out_month': '1', 'out_interval': '1', 'weather': weather_desc,
+        'block_description': f"Desmatamento + Pastagem Tradicional ({int(out_year)}-{int(last_year)})"
+    }
+    bloco_completo = {
+        'tipo': 'BLOCO_COMPLETO',
+        'header': header_bloco2,
+        'events': BLOCO_DESMATAMENTO_PASTAGEM_EVENTS
+    }
+    linha_display = f"BLOCO 2: Desmatamento/Pastagem (Até {last_year}, Clima: {WEATHER_DESC_TO_CODE.get(weather_desc, 'F')})"
+    return [(linha_display, bloco_completo), ("--- FIM DO BLOCO (-999 -999 X) ---", {'tipo': 'TERMINATOR'})]
+
+
+# Valores padrão da GUI usados na geração de .SCH sem interface (mesmas chaves de 'values')
+OPCOES_SCH_PADRAO = {
+    '-ANO_INICIO-': '1958', '-ANO_FIM-': '2025', '-SITE_FILE-': 'lu_site.100',
+    '-INIT_CROP-': 'HER', '-INIT_TREE-': 'CER',
+    '-P_LAST_YEAR-': '1982', '-P_OUT_YEAR-': '1958', '-P_WEATHER_COMBO-': WEATHER_CHOICES_MAP['M'],
+    '-D_LAST_YEAR-': '1984', '-D_OUT_YEAR-': '1983', '-D_WEATHER_COMBO-': WEATHER_CHOICES_MAP['F'],
+    '-MB_START_BLOCK_NUM-': '3', '-MB_YEAR_LIMIT-': '2015', '-MB_WEATHER_COMBO-': WEATHER_CHOICES_MAP['C'],
+}
+
+def planejar_timeline_sch(df_lulc, opcoes):
+    # Blocos fixos 1 (Padrão Savana) e 2 (Desmatamento + Pastagem) + série LULC preparada, com a
+    # assinatura do schedule resultante (ver assinatura_schedule_lulc)
+    base = (criar_bloco_padrao_savana(opcoes['-P_LAST_YEAR-'], opcoes['-P_OUT_YEAR-'], opcoes['-P_WEATHER_COMBO-'])
+            + criar_bloco_desmatamento(opcoes['-D_LAST_YEAR-'], opcoes['-D_OUT_YEAR-'], opcoes['-D_WEATHER_COMBO-']))
+    serie = preparar_serie_lulc(df_lulc, opcoes['-MB_START_BLOCK_NUM-'], opcoes['-MB_YEAR_LIMIT-'], base, opcoes)
+    if serie['status'] != 'ok':
+        return serie
+    fixos = tuple((chave, opcoes[chave]) for chave in sorted(OPCOES_SCH_PADRAO) if chave != '-SITE_FILE-')
+    return {'status': 'ok', 'chave': assinatura_schedule_lulc(serie, fixos), 'base': base, 'serie': serie}
+
+def montar_timeline_sch(df_lulc, opcoes):
+    plano = planejar_timeline_sch(df_lulc, opcoes)
+    if plano['status'] != 'ok':
+        return plano
+    serie = plano['serie']
+    blocos = emitir_blocos_lulc(serie['anos'], serie['classes'], serie['categorias'], serie['inicios'], serie['fins'],
+                                serie['start_block_num'], serie['weather'], serie['classe_por_ano'])
+    return {'status': 'ok', 'timeline': plano['base'] + blocos, 'chave': plano['chave']}
+
+def _extrair_lulc_grupo(tarefa):
+    # Executado nos processos de trabalho: uma extração por pixel
+    mb_folder, membros = tarefa
+    indice, nome_sitio, lat_str, lon_str = membros[0]
+    return membros, extrair_dados_mapbiomas(mb_folder, lat_str, lon_str, nome_sitio)
+
+def _vincular_ou_copiar(origem):
+    def escrever(tmp):
+        try:
+            os.link(origem, tmp)
+        except OSError:
+            shutil.copyfile(origem, tmp)
+    return escrever
+
+def _tarefas_lulc_por_pixel(pontos_df, mb_folder):
+    # Uma tarefa de extração por pixel do MapBiomas, com todos os pontos (indice, nome, lat, lon) que caem nele
+    membros = [(i, str(p), str(la), str(lo)) for i, (p, la, lo) in enumerate(zip(pontos_df['ponto'], pontos_df['lat'], pontos_df['lon']))]
+    rasters_mb = listar_rasters_mapbiomas(mb_folder)
+    if rasters_mb:
+        lons = pd.to_numeric(pontos_df['lon'], errors='coerce').to_numpy(dtype=float)
+        lats = pd.to_numeric(pontos_df['lat'], errors='coerce').to_numpy(dtype=float)
+        grupos = agrupar_pontos_por_pixel(calcular_chaves_pixel(rasters_mb[0][1], lons, lats))
+    else:
+        grupos = {i: [i] for i in range(len(membros))}
+    return [(mb_folder, [membros[i] for i in indices]) for indices in grupos.values()]
+
+def _executor_extracao(n_processos, n_tarefas):
+    # Processos sem 'fork' (ver contexto_processos): o .SCH em lote e a varredura são disparados de uma thread da GUI
+    n_processos = max(1, min(n_processos or os.cpu_count() or 1, n_tarefas or 1))
+    tamanho_lote = max(1, n_tarefas // (n_processos * 8))
+    contexto = contexto_processos()
+    if contexto is not None:
+        executor = concurrent.futures.ProcessPoolExecutor(n_processos, mp_context=contexto)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(n_processos)
+    return executor, n_processos, tamanho_lote
+
+def gerar_sch_lote(csv_pontos_path, mb_folder, opcoes=None, pasta_saida=None, n_processos=None, site_file_por_ponto=True):
+    # Gera o .SCH de cada ponto do CSV: extração LULC, blocos fixos 1 e 2, blocos LULC de
+    # processar_mapbiomas_em_blocos e o mesmo formato do preview. As extrações (uma por pixel do
+    # MapBiomas) rodam em processos (ver _executor_extracao; threads se indisponível). Cada schedule distinto
+    # (mesma assinatura) é montado e renderizado uma vez: com site_file_por_ponto ('<ponto>_site.100')
+    # só a linha do site file muda por ponto; sem ela, os arquivos repetidos são hardlinks.
+    # opcoes: chaves de OPCOES_SCH_PADRAO (ex: 'values' da GUI).
+    if not LIBS_INSTALADAS:
+        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas ausentes (rasterio/pandas)."}
+    opcoes = {chave: (opcoes or {}).get(chave) or padrao for chave, padrao in OPCOES_SCH_PADRAO.items()}
+    pasta_saida = obter_pasta_saida(pasta_saida)
+    iniciar_metricas("lote_sch")
+
     try:
-        import pandas as pd
+        pontos_df = ler_csv_pontos(csv_pontos_path)
+        erro_colunas = normalizar_colunas_pontos(pontos_df)
+        if erro_colunas:
+            finalizar_metricas()
+            return {'status': 'erro', 'message': erro_colunas}
+
+        total_pontos = len(pontos_df)
+        tarefas = _tarefas_lulc_por_pixel(pontos_df, mb_folder)
+        executor, n_processos, tamanho_lote = _executor_extracao(n_processos, len(tarefas))
+
+        marcador = f"{chr(0):<14}Site file name"
+        schedules = {}
+        resultados = []
+        with executor:
+            extracoes = executor.map(_extrair_lulc_grupo, tarefas, chunksize=tamanho_lote)
+            with escritor_em_segundo_plano() as escritor:
+                for grupo, mb_result in extracoes:
+                    plano = planejar_timeline_sch(mb_result['data'], opcoes) if mb_result['status'] == 'ok' else mb_result
+                    if plano['status'] != 'ok':
+                        rotulo = 'AVISO' if plano['status'] == 'aviso' else 'ERRO'
+                        resultados.extend((indice, nome, f"SCH {rotulo} - {plano['message']}", None) for indice, nome, _, _ in grupo)
+                        continue
+
+                    schedule = schedules.get(plano['chave'])
+                    if schedule is None:
+                        with medir_etapa('sch_render'):
+                            timeline = montar_timeline_sch(mb_result['data'], opcoes)['timeline']
+                            texto = renderizar_sch(dict(opcoes, **{'-SITE_FILE-': chr(0)}), timeline)
+                        schedule = schedules[plano['chave']] = {'partes': texto.split(marcador, 1), 'modelo': None}
+                    else:
+                        contar_metrica('cache_hits', len(grupo))
+
+                    for indice, nome_sitio, _, _ in grupo:
+                        caminho = os.path.join(pasta_saida, f"{nome_sitio}.SCH")
+                        site_file = f"{nome_sitio}_site.100" if site_file_por_ponto else opcoes['-SITE_FILE-']
+                        antes, depois = schedule['partes']
+                        if site_file_por_ponto or schedule['modelo'] is None:
+                            salvar_texto(caminho, f"{antes}{site_file:<14}Site file name{depois}", ponto=nome_sitio)
+                            schedule['modelo'] = schedule['modelo'] or caminho
+                        else:
+                            _gravar(caminho, _vincular_ou_copiar(schedule['modelo']), nome_sitio)
+                        resultados.append((indice, nome_sitio, "SCH OK. Salvo .SCH.", caminho))
+
+        # O status de cada ponto só fica definido depois que o escritor termina as gravações
+        resultados = sorted((indice, nome, f"SCH ERRO - Falha ao gravar .SCH: {escritor.falhas[caminho]}" if caminho in escritor.falhas else msg)
+                            for indice, nome, msg, caminho in resultados)
+        log_messages = [f"--- Geração de .SCH em Lote ({total_pontos} Pontos, {len(tarefas)} pixels, {n_processos} processo(s)) ---"]
+        log_messages.extend(f" Ponto {i+1}/{total_pontos} ({nome}): {msg}" for i, nome, msg in resultados)
+        n_ok = sum(1 for r in resultados if r[2].startswith('SCH OK'))
+        log_messages.append(f"\n--- Concluído: {n_ok} de {total_pontos} arquivos .SCH em {pasta_saida} ---")
+        log_messages.append(f"Schedules únicos: {len(schedules)} (razão {n_ok / max(len(schedules), 1):.2f} arquivos por schedule)")
+        if not site_file_por_ponto:
+            log_messages.append("Arquivos com o mesmo schedule são hardlinks do primeiro (mesmo inode): editar um altera todos.")
+        log_messages.append("\n" + resumo_metricas(finalizar_metricas()))
+        return {'status': 'ok' if n_ok else 'erro', 'message': "\n".join(log_messages), 'gerados': n_ok, 'schedules_unicos': len(schedules)}
+
+    except Exception as e:
+        finalizar_metricas()
+        return {'status': 'erro', 'message': f"Erro fatal durante a geração de .SCH em lote:\n{e}"}
+
+# Varredura de cenários: apelidos da grade -> chave de opções; as opções de CHAVES_SERIE_LULC definem a série LULC
+APELIDOS_VARREDURA = {'clima': '-MB_WEATHER_COMBO-', 'ano_limite': '-MB_YEAR_LIMIT-', 'bloco_inicial': '-MB_START_BLOCK_NUM-'}
+CHAVES_SERIE_LULC = ('-ANO_INICIO-', '-P_LAST_YEAR-', '-D_LAST_YEAR-', '-MB_START_BLOCK_NUM-')
+
+def expandir_grade_varredura(grade, opcoes=None):
+    # Produto cartesiano da grade, ex: {'clima': ['M', 'S', 'F', 'C'], 'ano_limite': [2010, 2015], 'blocos': ['padrao']}.
+    # Chaves aceitas: 'blocos' (nome em CONJUNTOS_EVENTOS_LULC), os apelidos de APELIDOS_VARREDURA ou chaves de
+    # OPCOES_SCH_PADRAO; climas podem ser dados pelo código (M/S/F/C). Retorna [(nome, opcoes, conjunto)].
+    base = {chave: (opcoes or {}).get(chave) or padrao for chave, padrao in OPCOES_SCH_PADRAO.items()}
+    eixos = [(nome, valores if isinstance(valores, (list, tuple)) else [valores]) for nome, valores in grade.items() if nome != 'conjuntos']
+    for nome, _ in eixos:
+        if nome != 'blocos' and nome not in APELIDOS_VARREDURA and nome not in OPCOES_SCH_PADRAO:
+            raise KeyError(f"Parâmetro de varredura desconhecido: '{nome}'.")
+    variantes = []
+    for combinacao in itertools.product(*[valores for _, valores in eixos]):
+        opcoes_variante = dict(base)
+        conjunto = 'padrao'
+        partes = []
+        for (nome, _), valor in zip(eixos, combinacao):
+            valor = str(valor)
+            if nome == 'blocos':
+                if valor not in CONJUNTOS_EVENTOS_LULC:
+                    raise KeyError(f"Conjunto de blocos desconhecido: '{valor}'.")
+                conjunto = valor
+            else:
+                chave = APELIDOS_VARREDURA.get(nome, nome)
+                opcoes_variante[chave] = WEATHER_CHOICES_MAP.get(valor, valor) if 'WEATHER' in chave else valor
+            partes.append(f"{nome.strip('-').lower()}-{re.sub(r'[^0-9A-Za-z.]+', '', valor.split(':')[0])}")
+        variantes.append(('_'.join(partes) or 'padrao', opcoes_variante, conjunto))
+    return variantes
+
+def truncar_serie_lulc(serie, year_limit):
+    # Série preparada até um ano limite maior -> mesma série até year_limit (trechos cortados no limite)
+    n = bisect.bisect_right(serie['anos'], year_limit)
+    if n == 0:
+        return None
+    sel = serie['inicios'] < n
+    return dict(serie, anos=serie['anos'][:n], classes=serie['classes'][:n], categorias=serie['categorias'][:n],
+                inicios=serie['inicios'][sel], fins=np.minimum(serie['fins'][sel], n), year_limit=year_limit)
+
+def gerar_sch_varredura(csv_pontos_path, mb_folder, grade, opcoes=None, pasta_saida=None, n_processos=None):
+    # Gera, para cada ponto do CSV, um .SCH por variante da grade (ver expandir_grade_varredura), em
+    # '<pasta_saida>/<variante>/<ponto>.SCH'. O que é comum às variantes é calculado uma vez: a extração
+    # LULC (por pixel), a série/run-length (por ponto, até o maior ano limite da grade), o texto do
+    # cabeçalho e dos blocos 1 e 2 (por variante) e os corpos de eventos já renderizados (EventosCompilados);
+    # schedules idênticos (mesma assinatura) são renderizados uma única vez.
+    if not LIBS_INSTALADAS:
+        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas ausentes (rasterio/pandas)."}
+    try:
+        for nome, eventos in (grade.get('conjuntos') or {}).items():
+            registrar_conjunto_eventos_lulc(nome, eventos)
+        variantes = expandir_grade_varredura(grade, opcoes)
+        ano_maximo = max(int(opcoes_variante['-MB_YEAR_LIMIT-']) for _, opcoes_variante, _ in variantes)
+    except (KeyError, ValueError, TypeError) as e:
+        return {'status': 'erro', 'message': f"Grade de varredura inválida: {e}"}
+    pasta_saida = obter_pasta_saida(pasta_saida)
+    iniciar_metricas("varredura_sch")
+
+    try:
+        pontos_df = ler_csv_pontos(csv_pontos_path)
+        erro_colunas = normalizar_colunas_pontos(pontos_df)
+        if erro_colunas:
+            finalizar_metricas()
+            return {'status': 'erro', 'message': erro_colunas}
+
+        total_pontos = len(pontos_df)
+        tarefas = _tarefas_lulc_por_pixel(pontos_df, mb_folder)
+        executor, n_processos, tamanho_lote = _executor_extracao(n_processos, len(tarefas))
+
+        # Por variante (independe do ponto): blocos 1 e 2, texto renderizado até eles e opções da assinatura
+        marcador = f"{chr(0):<14}Site file name"
+        preparadas = []
+        for nome_variante, opcoes_variante, conjunto in variantes:
+            base = (criar_bloco_padrao_savana(opcoes_variante['-P_LAST_YEAR-'], opcoes_variante['-P_OUT_YEAR-'], opcoes_variante['-P_WEATHER_COMBO-'])
+                    + criar_bloco_desmatamento(opcoes_variante['-D_LAST_YEAR-'], opcoes_variante['-D_OUT_YEAR-'], opcoes_variante['-D_WEATHER_COMBO-']))
+            fixos = tuple((chave, opcoes_variante[chave]) for chave in sorted(OPCOES_SCH_PADRAO) if chave != '-SITE_FILE-')
+            os.makedirs(os.path.join(pasta_saida, nome_variante), exist_ok=True)
+            preparadas.append({'nome': nome_variante, 'opcoes': opcoes_variante, 'conjunto': conjunto, 'base': base, 'fixos': fixos,
+                               'texto_base': renderizar_sch(dict(opcoes_variante, **{'-SITE_FILE-': chr(0)}), base),
+                               'chave_serie': tuple(opcoes_variante[chave] for chave in CHAVES_SERIE_LULC)})
+
+        schedules = {}
+        resultados = []
+        with executor:
+            extracoes = executor.map(_extrair_lulc_grupo, tarefas, chunksize=tamanho_lote)
+            with escritor_em_segundo_plano() as escritor:
+                for grupo, mb_result in extracoes:
+                    series = {}
+                    for variante in preparadas:
+                        opcoes_variante = variante['opcoes']
+                        if mb_result['status'] != 'ok':
+                            serie = mb_result
+                        else:
+                            if variante['chave_serie'] not in series:
+                                series[variante['chave_serie']] = preparar_serie_lulc(mb_result['data'], opcoes_variante['-MB_START_BLOCK_NUM-'], str(ano_maximo),
+                                                                                      variante['base'], opcoes_variante)
+                            completa = series[variante['chave_serie']]
+                            serie = truncar_serie_lulc(completa, int(opcoes_variante['-MB_YEAR_LIMIT-'])) if completa['status'] == 'ok' else None
+                            if serie is None:
+                                # Sem trecho até este limite (ou série inválida): mensagem exata da preparação
+                                serie = preparar_serie_lulc(mb_result['data'], opcoes_variante['-MB_START_BLOCK_NUM-'], opcoes_variante['-MB_YEAR_LIMIT-'],
+                                                            variante['base'], opcoes_variante)
+                            else:
+                                serie['weather'] = opcoes_variante.get('-MB_WEATHER_COMBO-') or WEATHER_CHOICES_MAP['C']
+                                contar_metrica('cache_hits')
+                        if serie['status'] != 'ok':
+                            rotulo = 'AVISO' if serie['status'] == 'aviso' else 'ERRO'
+                            resultados.extend((indice, nome, variante['nome'], f"SCH {rotulo} - {serie['message']}", None) for indice, nome, _, _ in grupo)
+                            continue
+
+                        chave = assinatura_schedule_lulc(serie, variante['fixos'], variante['conjunto'])
+                        partes = schedules.get(chave)
+                        if partes is None:
+                            with medir_etapa('sch_render'):
+                                blocos = emitir_blocos_lulc(serie['anos'], serie['classes'], serie['categorias'], serie['inicios'], serie['fins'],
+                                                            serie['start_block_num'], serie['weather'], serie['classe_por_ano'],
+                                                            CONJUNTOS_EVENTOS_LULC[variante['conjunto']])
+                                texto = variante['texto_base'] + ''.join([gerar_texto_item(data) + "\n" for _, data in blocos])
+                            partes = schedules[chave] = texto.split(marcador, 1)
+
+                        antes, depois = partes
+                        for indice, nome_sitio, _, _ in grupo:
+                            caminho = os.path.join(pasta_saida, variante['nome'], f"{nome_sitio}.SCH")
+                            salvar_texto(caminho, f"{antes}{nome_sitio + '_site.100':<14}Site file name{depois}", ponto=nome_sitio)
+                            resultados.append((indice, nome_sitio, variante['nome'], "SCH OK. Salvo .SCH.", caminho))
+
+            manifesto = {nome_variante: {'blocos': conjunto, 'opcoes': opcoes_variante} for nome_variante, opcoes_variante, conjunto in variantes}
+            salvar_texto(os.path.join(pasta_saida, 'varredura_variantes.json'), json.dumps(manifesto, indent=2, ensure_ascii=False))
+
+        resultados = sorted((indice, nome, nome_variante, f"SCH ERRO - Falha ao gravar .SCH: {escritor.falhas[caminho]}" if caminho in escritor.falhas else msg)
+                            for indice, nome, nome_variante, msg, caminho in resultados)
+        n_arquivos = total_pontos * len(variantes)
+        log_messages = [f"--- Varredura de Cenários .SCH ({total_pontos} Pontos x {len(variantes)} Variantes, {len(tarefas)} pixels, {n_processos} processo(s)) ---"]
+        log_messages.extend(f" Ponto {i+1}/{total_pontos} ({nome}) [{nome_variante}]: {msg}" for i, nome, nome_variante, msg in resultados)
+        n_ok = sum(1 for r in resultados if r[3].startswith('SCH OK'))
+        log_messages.append(f"\n--- Concluído: {n_ok} de {n_arquivos} arquivos .SCH em {pasta_saida} ---")
+        log_messages.append(f"Schedules únicos: {len(schedules)} (razão {n_ok / max(len(schedules), 1):.2f} arquivos por schedule)")
+        log_messages.append("\n" + resumo_metricas(finalizar_metricas()))
+        return {'status': 'ok' if n_ok else 'erro', 'message': "\n".join(log_messages), 'gerados': n_ok, 'variantes': len(variantes),
+                'schedules_unicos': len(schedules)}
+
+    except Exception as e:
+        finalizar_metricas()
+        return {'status': 'erro', 'message': f"Erro fatal durante a varredura de cenários .SCH:\n{e}"}
+
+# Tabelas passadas entre as etapas do pipeline: colunas obrigatórias e tipos
+ESQUEMAS_TABELAS = {
+    'lulc': {'Ano': 'int64', 'Codigo_MapBiomas': 'int64'},
+    'solo': {'areia': 'float64', 'silte': 'float64', 'argila': 'float64', 'densidade': 'float64', 'pH': 'float64'},
+    'clima_media': {'mes': 'int64', 'ppt': 'float64', 'tmin': 'float64', 'tmax': 'float64'},
+    'clima_anual': {'year': 'int64', 'mes': 'int64', 'ppt': 'float64', 'tmin': 'float64', 'tmax': 'float64'},
+}
+
+def tipar_tabela(df, nome):
+    esquema = ESQUEMAS_TABELAS[nome]
+    faltando = [c for c in esquema if c not in df.columns]
+    if faltando:
+        raise KeyError(", ".join(faltando))
+    return df.astype(esquema)
+
+def executar_pipeline_sitio(nome_sitio, lat_str, lon_str, mb_folder=None, solo_folder=None, solo_prof='0-20cm', inmet_folder=None, inmet_n_estacoes=3,
+                            template_site100=None, opcoes_sch=None, pasta_saida=None, gravar_intermediarios=False):
+    # Encadeia as etapas de um sítio com cada resultado em memória, como tabela tipada:
+    # LULC -> blocos SCH, solo + clima médio -> site.100, clima anual -> .WTH.
+    # Só os artefatos finais são gravados; gravar_intermediarios=True também salva os CSVs de cada etapa.
+    # opcoes_sch: {'bloco_inicial', 'ano_limite', 'timeline', 'values'} para processar_mapbiomas_em_blocos.
+    pasta_saida = obter_pasta_saida(pasta_saida)
+    tabelas = {}
+    resultado = {'status': 'ok', 'tabelas': tabelas, 'blocos_sch': None, 'arquivos': [], 'mensagens': []}
+
+    def falha(etapa, res):
+        resultado['mensagens'].append(f"{etapa}: {res['message']}")
+        resultado['status'] = 'aviso'
+
+    def intermediario(df, nome_arquivo, **kwargs):
+        if gravar_intermediarios:
+            caminho = os.path.join(pasta_saida, nome_arquivo)
+            salvar_csv(df, caminho, ponto=nome_sitio, index=False, **kwargs)
+            resultado['arquivos'].append(caminho)
+
+    try:
+        if mb_folder:
+            with medir_etapa('lulc', nome_sitio):
+                mb_result = extrair_dados_mapbiomas(mb_folder, lat_str, lon_str, nome_sitio)
+            if mb_result['status'] == 'ok':
+                tabelas['lulc'] = tipar_tabela(mb_result['data'], 'lulc')
+                intermediario(tabelas['lulc'], f"{nome_sitio}_mapbiomas_extracao.csv")
+                if opcoes_sch is not None:
+                    blocos = processar_mapbiomas_em_blocos(tabelas['lulc'], opcoes_sch.get('bloco_inicial', '3'), opcoes_sch.get('ano_limite', '2015'),
+                                                           opcoes_sch.get('timeline', []), opcoes_sch.get('values', {}))
+                    if blocos['status'] == 'ok':
+                        resultado['blocos_sch'] = blocos['blocks']
+                    else:
+                        falha('SCH', blocos)
+            else:
+                falha('LULC', mb_result)
+
+        if solo_folder:
+            with medir_etapa('solo', nome_sitio):
+                solo_result = extrair_dados_solo(solo_folder, solo_prof, lat_str, lon_str, nome_sitio, camada=camada_padrao_solo(solo_prof))
+            if solo_result['status'] == 'ok':
+                tabelas['solo'] = tipar_tabela(solo_result['data'], 'solo')
+                intermediario(tabelas['solo'], f"{nome_sitio}_solo_extracao_{rotulo_profundidades(solo_prof)}.csv", float_format='%.6f')
+            else:
+                falha('Solo', solo_result)
+
+        if inmet_folder:
+            with medir_etapa('clima_busca', nome_sitio):
+                inmet_search = encontrar_estacoes_proximas(inmet_folder, lat_str, lon_str, inmet_n_estacoes, is_batch=True)
+            if inmet_search['status'] == 'erro':
+                falha('Clima', inmet_search)
+            else:
+                top_estacoes = inmet_search['top_estacoes']
+                with medir_etapa('clima_media', nome_sitio):
+                    media_result = processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=True)
+                if media_result['status'] == 'ok':
+                    tabelas['clima_media'] = tipar_tabela(media_result['data'], 'clima_media')
+                    intermediario(tabelas['clima_media'], f"{nome_sitio}_inmet_clima_media.csv")
+                else:
+                    falha('Clima Média', media_result)
+
+                with medir_etapa('clima_anual', nome_sitio):
+                    anual_result = gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=True)
+                if anual_result['status'] == 'ok':
+                    tabelas['clima_anual'] = tipar_tabela(anual_result['data'], 'clima_anual')
+                    intermediario(tabelas['clima_anual'], f"{nome_sitio}_inmet_clima_anual.csv")
+                    with medir_etapa('clima_wth', nome_sitio):
+                        wth_result = gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=True, pasta_saida=pasta_saida, clima_anual=tabelas['clima_anual'])
+                    if wth_result['status'] == 'ok':
+                        resultado['arquivos'].append(os.path.join(pasta_saida, f"{nome_sitio}.wth"))
+                    else:
+                        falha('WTH', wth_result)
+                else:
+                    falha('Clima Anual', anual_result)
+
+        if template_site100 and 'solo' in tabelas and 'clima_media' in tabelas:
+            site_result = gerar_site_100_lote(tabelas['solo'], tabelas['clima_media'], template_site100, [(nome_sitio, lat_str, lon_str)], pasta_saida)
+            if site_result['status'] == 'ok':
+                resultado['arquivos'].append(os.path.join(pasta_saida, f"{nome_sitio}_site.100"))
+            else:
+                falha('SITE.100', site_result)
+
+    except Exception as e:
+        resultado['status'] = 'erro'
+        resultado['mensagens'].append(f"Erro no pipeline do sítio '{nome_sitio}': {e}")
+
+    resultado['message'] = "\n".join(resultado['mensagens']) or f"Pipeline do sítio '{nome_sitio}' concluído."
+    return resultado
+
+
+# --- Benchmark com dados sintéticos (MapBiomas, Solo, INMET) ---
+ESCALAS_BENCHMARK = {'10': 10, '1k': 1000, '100k': 100000}
+PROFUNDIDADES_SOLO = ['0-20cm', '0-30cm']
+VARIAVEIS_SOLO_PREFIXOS = ['sand', 'silt', 'clay', 'bkd', 'ph']
+
+def gerar_template_site100_sintetico(caminho):
+    linhas = [f"'PARAM{i}'  0.00000\n" for i in range(110)]
+    linhas[0] = "Sitio_Sintetico     Site name\n"
+    for mes in range(1, 13):
+        linhas[mes + 2] = f"PRECIP({mes})  0.00000\n"
+        linhas[mes + 38] = f"TMN2M({mes})  0.00000\n"
+        linhas[mes + 50] = f"TMX2M({mes})  0.00000\n"
+    linhas[65] = "0.000000  'SITLAT'\n"
+    linhas[66] = "0.000000  'SITLNG'\n"
+    linhas[67] = "SAND  0.00000\n"
+    linhas[68] = "SILT  0.00000\n"
+    linhas[69] = "CLAY  0.00000\n"
+    linhas[71] = "BULKD  0.00000\n"
+    linhas[100] = "PH  0.00000\n"
+    with open(caminho, 'w') as f:
+        f.writelines(linhas)
+    return caminho
+
+def gerar_fixtures_sinteticas(pasta_base, n_pontos, n_estacoes, anos=range(1985, 2016), tamanho_raster=1000, anos_estacoes=range(2000, 2010), semente=0):
+    # Extensão sintética no Cerrado goiano, pixel de ~30 m (0.00027°)
+    rng = np.random.default_rng(semente)
+    oeste, norte, res = -50.0, -15.0, 0.00027
+    extensao = tamanho_raster * res
+    transform = rasterio.transform.from_origin(oeste, norte, res, res)
+    perfil = {'driver': 'GTiff', 'height': tamanho_raster, 'width': tamanho_raster, 'count': 1,
+              'crs': 'EPSG:4326', 'transform': transform, 'tiled': True, 'compress': 'deflate'}
+
+    pastas = {
+        'mb': os.path.join(pasta_base, 'mapbiomas'),
+        'solo': os.path.join(pasta_base, 'solo'),
+        'inmet': os.path.join(pasta_base, 'inmet'),
+        'pontos': os.path.join(pasta_base, 'pontos.csv'),
+        'template': os.path.join(pasta_base, 'template_site.100')
+    }
+    os.makedirs(pastas['mb'], exist_ok=True)
+    os.makedirs(pastas['inmet'], exist_ok=True)
+
+    # Séries LULC com persistência: cada ano muda ~10% dos pixels
+    classes = np.array([4, 12, 15, 21, 39, 3, 33], dtype='uint8')
+    atual = rng.choice(classes, size=(tamanho_raster, tamanho_raster))
+    for ano in anos:
+        mudanca = rng.random(atual.shape) < 0.1
+        atual = np.where(mudanca, rng.choice(classes, size=atual.shape), atual).astype('uint8')
+        with rasterio.open(os.path.join(pastas['mb'], f"mapbiomas_brasil_{ano}.tif"), 'w', dtype='uint8', nodata=0, **perfil) as dst:
+            dst.write(atual, 1)
+
+    for prof in PROFUNDIDADES_SOLO:
+        pasta_prof = os.path.join(pastas['solo'], prof)
+        os.makedirs(pasta_prof, exist_ok=True)
+        for prefixo in VARIAVEIS_SOLO_PREFIXOS:
+            if prefixo == 'ph':
+                valores = rng.uniform(4.5, 7.0, size=(tamanho_raster, tamanho_raster)).astype('float32')
+            elif prefixo == 'bkd':
+                valores = rng.uniform(1.0, 1.6, size=(tamanho_raster, tamanho_raster)).astype('float32')
+            else:
+                valores = rng.integers(100, 700, size=(tamanho_raster, tamanho_raster)).astype('float32')
+            with rasterio.open(os.path.join(pasta_prof, f"{prefixo}_{prof.replace('-', '_')}.tif"), 'w', dtype='float32', nodata=-9999.0, **perfil) as dst:
+                dst.write(valores, 1)
+
+    datas = pd.date_range(f"{anos_estacoes[0]}-01-01", f"{anos_estacoes[-1]}-12-31", freq='D')
+    for k in range(n_estacoes):
+        n = len(datas)
+        pd.DataFrame({
+            'data': datas.strftime('%Y-%m-%d'),
+            'precipitacao': rng.gamma(0.6, 8.0, n).round(1),
+            'temp_min': (180 + rng.normal(0, 20, n)).round(1),
+            'temp_max': (300 + rng.normal(0, 20, n)).round(1),
+            'latitude': norte - rng.uniform(-1.0, extensao + 1.0),
+            'longitude': oeste + rng.uniform(-1.0, extensao + 1.0)
+        }).to_csv(os.path.join(pastas['inmet'], f"INMET_SINT_{k:04d}.csv"), index=False)
+
+    pd.DataFrame({
+        'sitio': [f"P{i:06d}" for i in range(n_pontos)],
+        'latitude': (norte - rng.uniform(0, extensao, n_pontos)).round(6),
+        'longitude': (oeste + rng.uniform(0, extensao, n_pontos)).round(6)
+    }).to_csv(pastas['pontos'], index=False)
+
+    gerar_template_site100_sintetico(pastas['template'])
+    return pastas
+
+def pico_rss_mb():
+    try:
+        import resource
     except ImportError:
-        sg.popup_error("Biblioteca 'pandas' não encontrada. A extração INMET e a geração de SITE.100 serão desabilitadas.")
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta em KiB, macOS em bytes
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+def _com_pico_alocado(executar):
+    # Pico de memória alocada (tracemalloc) só durante executar(), em MB. O ru_maxrss é o pico da vida
+    # inteira do processo e não separa uma função da outra; processos filhos (workers do lote) não entram aqui.
+    ja_ativo = tracemalloc.is_tracing()
+    if ja_ativo:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    try:
+        retorno = executar()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        if not ja_ativo:
+            tracemalloc.stop()
+    return retorno, round(pico / (1024 * 1024), 1)
+
+def _medir_vazao(nome, funcao, itens):
+    def executar():
+        falhas = 0
+        for item in itens:
+            resultado = funcao(item)
+            if isinstance(resultado, dict) and resultado.get('status') == 'erro':
+                falhas += 1
+            elif isinstance(resultado, str) and resultado.startswith('Erro'):
+                falhas += 1
+        return falhas
+
+    t0 = time.perf_counter()
+    falhas, pico = _com_pico_alocado(executar)
+    segundos = time.perf_counter() - t0
+    n = len(itens)
+    return {'funcao': nome, 'n': n, 'falhas': falhas, 'segundos': round(segundos, 4),
+            'pontos_por_segundo': round(n / segundos, 2) if segundos > 0 else None,
+            'pico_alocado_mb': pico}
+
+def executar_benchmark(escala='1k', n_estacoes=50, pasta_base=None, baseline_path=None, atualizar_baseline=False, tolerancia=0.2, fracao_amostra=0.1,
+                       amostra_max=None, lote_completo=True):
+    # As funções por ponto são medidas numa amostra proporcional à escala (fracao_amostra dos pontos, no mínimo 10;
+    # clima: 1/10 da amostra), limitada por amostra_max se informado; processar_lote_dados usa todos os pontos.
+    if not LIBS_INSTALADAS:
+        return {'status': 'erro', 'message': "Erro Crítico: Bibliotecas 'rasterio' e 'pandas' não encontradas."}
+    if escala not in ESCALAS_BENCHMARK:
+        return {'status': 'erro', 'message': f"Erro: Escala inválida '{escala}'. Use uma de {list(ESCALAS_BENCHMARK)}."}
+    if not 50 <= int(n_estacoes) <= 600:
+        return {'status': 'erro', 'message': "Erro: O número de estações deve estar entre 50 e 600."}
+
+    n_pontos = ESCALAS_BENCHMARK[escala]
+    n_estacoes = int(n_estacoes)
+    cenario = f"{escala}_{n_estacoes}est"
+    pasta_base = pasta_base or os.path.join(str(Path.home()), 'century_benchmark')
+    pasta_cenario = os.path.join(pasta_base, cenario)
+    baseline_path = baseline_path or os.path.join(pasta_base, 'benchmark_baseline.json')
+
+    t0 = time.perf_counter()
+    if not os.path.exists(os.path.join(pasta_cenario, 'pontos.csv')):
+        pastas = gerar_fixtures_sinteticas(pasta_cenario, n_pontos, n_estacoes)
+    else:
+        pastas = {
+            'mb': os.path.join(pasta_cenario, 'mapbiomas'), 'solo': os.path.join(pasta_cenario, 'solo'),
+            'inmet': os.path.join(pasta_cenario, 'inmet'), 'pontos': os.path.join(pasta_cenario, 'pontos.csv'),
+            'template': os.path.join(pasta_cenario, 'template_site.100')
+        }
+    print(f"Fixtures prontas em {pasta_cenario} ({time.perf_counter() - t0:.1f} s)")
+
+    pontos = pd.read_csv(pastas['pontos'])
+    n_amostra = max(min(n_pontos, 10), math.ceil(n_pontos * fracao_amostra))
+    if amostra_max:
+        n_amostra = min(n_amostra, amostra_max)
+    amostra = [(str(r.sitio), str(r.latitude), str(r.longitude)) for r in pontos.head(n_amostra).itertuples()]
+    amostra_clima = amostra[:max(1, min(len(amostra), 10), len(amostra) // 10)]
+    resultados = []
+
+    saida = obter_pasta_saida(os.path.join(pasta_cenario, 'saida'))
+    resultados.append(_medir_vazao('extrair_dados_mapbiomas', lambda p: extrair_dados_mapbiomas(pastas['mb'], p[1], p[2], p[0]), amostra))
+    resultados.append(_medir_vazao('extrair_dados_solo', lambda p: extrair_dados_solo(pastas['solo'], '0-20cm', p[1], p[2], p[0]), amostra))
+    resultados.append(_medir_vazao('encontrar_estacoes_proximas', lambda p: encontrar_estacoes_proximas(pastas['inmet'], p[1], p[2], 3, is_batch=True), amostra_clima))
+
+    estacoes_por_ponto = {p[0]: encontrar_estacoes_proximas(pastas['inmet'], p[1], p[2], 3, is_batch=True)['top_estacoes'] for p in amostra_clima}
+    resultados.append(_medir_vazao('processar_medias_estacoes', lambda p: processar_medias_estacoes(estacoes_por_ponto[p[0]], p[0], is_batch=True), amostra_clima))
+    resultados.append(_medir_vazao('gerar_csv_clima_anual', lambda p: gerar_csv_clima_anual(estacoes_por_ponto[p[0]], p[0], is_batch=True), amostra_clima))
+    resultados.append(_medir_vazao('gerar_arquivo_wth', lambda p: gerar_arquivo_wth(estacoes_por_ponto[p[0]], p[0], is_batch=True, pasta_saida=saida), amostra_clima))
+
+    solo_csv = os.path.join(pasta_cenario, 'solo_amostra.csv')
+    clima_csv = os.path.join(pasta_cenario, 'clima_amostra.csv')
+    pd.concat([extrair_dados_solo(pastas['solo'], '0-20cm', p[1], p[2], p[0])['data'] for p in amostra_clima]).to_csv(solo_csv, index=False)
+    pd.concat([processar_medias_estacoes(estacoes_por_ponto[p[0]], p[0], is_batch=True)['data'] for p in amostra_clima]).to_csv(clima_csv, index=False)
+    resultados.append(_medir_vazao('gerar_site_100', lambda p: gerar_site_100(solo_csv, clima_csv, pastas['template'], p[0], p[1], p[2], pasta_saida=saida), amostra_clima))
+    t_site = time.perf_counter()
+    site_lote, pico = _com_pico_alocado(lambda: gerar_site_100_lote(solo_csv, clima_csv, pastas['template'], amostra_clima, pasta_saida=saida))
+    segundos = time.perf_counter() - t_site
+    resultados.append({'funcao': 'gerar_site_100_lote', 'n': len(amostra_clima), 'falhas': len(site_lote.get('erros', [])),
+                       'segundos': round(segundos, 4), 'pontos_por_segundo': round(len(amostra_clima) / segundos, 2) if segundos > 0 else None,
+                       'pico_alocado_mb': pico})
+
+    if lote_completo:
+        t_lote = time.perf_counter()
+        log_lote, pico = _com_pico_alocado(lambda: processar_lote_dados(pastas['pontos'], pastas['mb'], pastas['solo'], '0-20cm', pastas['inmet'], 3, 'ambos',
+                                                                        pasta_saida=saida))
+        segundos = time.perf_counter() - t_lote
+        resultados.append({'funcao': 'processar_lote_dados', 'n': n_pontos, 'falhas': log_lote.count(' ERRO'),
+                           'segundos': round(segundos, 4), 'pontos_por_segundo': round(n_pontos / segundos, 2) if segundos > 0 else None,
+                           'pico_alocado_mb': pico})
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        try:
+            with open(baseline_path, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except Exception as e:
+            print(f"Aviso: baseline ilegível ({e}); será ignorado.")
+
+    base_cenario = baseline.get(cenario, {})
+    regressoes = []
+    linhas = [f"--- Benchmark {cenario} ({n_pontos} pontos, {n_estacoes} estações) ---",
+              f"Funções por ponto medidas numa amostra de {len(amostra)} pontos (clima e site.100: {len(amostra_clima)}); "
+              f"processar_lote_dados com todos os {n_pontos} (coluna n)",
+              "Pico alocado MB: tracemalloc durante cada função, só no processo principal (workers do lote não entram; tempos com tracemalloc ativo)",
+              f"{'Função':<30}{'n':>7}{'falhas':>8}{'pts/s':>12}{'baseline':>12}{'Δ':>9}{'Pico alocado MB':>17}"]
+    for r in resultados:
+        ref = base_cenario.get(r['funcao'], {}).get('pontos_por_segundo')
+        delta = ""
+        if ref and r['pontos_por_segundo']:
+            razao = r['pontos_por_segundo'] / ref
+            delta = f"{(razao - 1) * 100:+.0f}%"
+            if razao < 1 - tolerancia:
+                regressoes.append(r['funcao'])
+        linhas.append(f"{r['funcao']:<30}{r['n']:>7}{r['falhas']:>8}{r['pontos_por_segundo'] or 0:>12.1f}{ref or 0:>12.1f}{delta:>9}{r['pico_alocado_mb']:>17.1f}")
+    linhas.append(f"RSS pico do processo (toda a execução): {pico_rss_mb() or 0.0:.1f} MB")
+    if regressoes:
+        linhas.append(f"REGRESSÃO (> {tolerancia:.0%} mais lento que o baseline): {', '.join(regressoes)}")
+
+    if atualizar_baseline or not base_cenario:
+        baseline[cenario] = {r['funcao']: {'pontos_por_segundo': r['pontos_por_segundo'], 'pico_alocado_mb': r['pico_alocado_mb']} for r in resultados}
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, ensure_ascii=False)
+        linhas.append(f"Baseline gravado em {baseline_path}")
+
+    relatorio = "\n".join(linhas)
+    return {'status': 'erro' if regressoes else 'ok', 'message': relatorio, 'resultados': resultados, 'regressoes': regressoes}
+
+def main_benchmark(args):
+    # Uso: python century_gui.py --benchmark [10|1k|100k] [n_estacoes] [--atualizar-baseline]
+    posicionais = [a for a in args if not a.startswith('--')]
+    escala = posicionais[0] if posicionais else '1k'
+    n_estacoes = int(posicionais[1]) if len(posicionais) > 1 else 50
+    resultado = executar_benchmark(escala, n_estacoes, atualizar_baseline='--atualizar-baseline' in args)
+    print(resultado['message'])
+    return 0 if resultado['status'] == 'ok' else 1
+
+def _argumentos_lote(args, *extras):
+    import argparse
+    parser = argparse.ArgumentParser(prog='century_gui.py')
+    parser.add_argument('--pontos', required=True)
+    parser.add_argument('--mapbiomas', required=True)
+    parser.add_argument('--solo', required=True)
+    parser.add_argument('--profundidade', default='0-20cm')
+    parser.add_argument('--inmet', required=True)
+    parser.add_argument('--n-estacoes', type=int, default=3)
+    parser.add_argument('--modo-clima', default='ambos', choices=['média', 'anual', 'ambos'])
+    parser.add_argument('--saida', default=None)
+    parser.add_argument('--template', default=None)
+    for extra in extras:
+        parser.add_argument(extra, type=int, required=True)
+    return parser.parse_args(args)
+
+def main_lote_shard(args):
+    # Uso: python century_gui.py --lote-shard --shard-index 0 --shard-count 4 --pontos p.csv --mapbiomas ... --saida /compartilhado/lote
+    a = _argumentos_lote(args, '--shard-index', '--shard-count')
+    mensagem = processar_lote_dados(a.pontos, a.mapbiomas, a.solo, a.profundidade, a.inmet, a.n_estacoes, a.modo_clima,
+                                    pasta_saida=a.saida, shard_index=a.shard_index, shard_count=a.shard_count, template_site100=a.template)
+    print(mensagem)
+    return 0 if mensagem.startswith('--- Shard') else 1
+
+def main_sch_lote(args):
+    # Uso: python century_gui.py --sch-lote --pontos p.csv --mapbiomas PASTA [--saida PASTA] [--processos N]
+    import argparse
+    parser = argparse.ArgumentParser(prog='century_gui.py')
+    parser.add_argument('--pontos', required=True)
+    parser.add_argument('--mapbiomas', required=True)
+    parser.add_argument('--saida', default=None)
+    parser.add_argument('--processos', type=int, default=None)
+    a = parser.parse_args(args)
+    resultado = gerar_sch_lote(a.pontos, a.mapbiomas, pasta_saida=a.saida, n_processos=a.processos)
+    print(resultado['message'])
+    return 0 if resultado['status'] == 'ok' else 1
+
+def main_sch_varredura(args):
+    # Uso: python century_gui.py --sch-varredura --pontos p.csv --mapbiomas PASTA --grade grade.json [--saida PASTA] [--processos N]
+    # grade.json: {"clima": ["M", "F"], "ano_limite": [2010, 2015], "blocos": ["padrao", "alt"], "conjuntos": {"alt": {"PASTAGEM": [...]}}}
+    import argparse
+    parser = argparse.ArgumentParser(prog='century_gui.py')
+    parser.add_argument('--pontos', required=True)
+    parser.add_argument('--mapbiomas', required=True)
+    parser.add_argument('--grade', required=True)
+    parser.add_argument('--saida', default=None)
+    parser.add_argument('--processos', type=int, default=None)
+    a = parser.parse_args(args)
+    with open(a.grade, 'r', encoding='utf-8') as f:
+        grade = json.load(f)
+    resultado = gerar_sch_varredura(a.pontos, a.mapbiomas, grade, pasta_saida=a.saida, n_processos=a.processos)
+    print(resultado['message'])
+    return 0 if resultado['status'] == 'ok' else 1
+
+def main_mesclar_shards(args):
+    # Uso: python century_gui.py --mesclar-shards PASTA_RAIZ [PASTA_DESTINO] [N_SHARDS]
+    resultado = mesclar_shards(args[0], args[1] if len(args) > 1 else None, int(args[2]) if len(args) > 2 else None)
+    print(resultado['message'])
+    return 0 if resultado['status'] == 'ok' else 1
+
+
+# --- Tarefas longas da GUI em segundo plano ---
+def executar_tarefa_em_segundo_plano(window, nome, funcao, *args, controle=True, **kwargs):
+    # Roda funcao(*args, **kwargs) numa thread; com controle, recebe também progresso=... e cancelar=...
+    # (threading.Event). Progresso e resultado voltam ao loop de eventos pelos eventos '-TAREFA_PROGRESSO-'
+    # e '-TAREFA_FIM-' (write_event_value pode ser chamado de outra thread).
+    cancelar = threading.Event()
+
+    def progresso(feitos, total, rotulo=''):
+        window.write_event_value('-TAREFA_PROGRESSO-', (feitos, total, rotulo))
+
+    def executar():
+        try:
+            if controle:
+                resultado = funcao(*args, progresso=progresso, cancelar=cancelar, **kwargs)
+            else:
+                resultado = funcao(*args, **kwargs)
+        except Exception as e:
+            resultado = {'status': 'erro', 'message': f"Erro na tarefa '{nome}': {e}"}
+        window.write_event_value('-TAREFA_FIM-', resultado)
+
+    thread = threading.Thread(target=executar, name=f"Tarefa-{nome}", daemon=True)
+    thread.start()
+    return {'nome': nome, 'cancelar': cancelar, 'thread': thread, 'inicio': time.perf_counter(), 'controle': controle}
+
+def formatar_duracao(segundos):
+    if segundos is None:
+        return "--:--"
+    segundos = int(round(segundos))
+    horas, resto = divmod(segundos, 3600)
+    return f"{horas}:{resto // 60:02d}:{resto % 60:02d}" if horas else f"{resto // 60:02d}:{resto % 60:02d}"
+
+def texto_progresso_tarefa(tarefa, feitos, total, rotulo=''):
+    # Ex: "Lote - Passo 2/3: 340/1000 pontos | 12.5 pts/s | ETA 00:52"
+    decorrido = time.perf_counter() - tarefa['inicio']
+    taxa = feitos / decorrido if decorrido > 0 else 0.0
+    eta = (total - feitos) / taxa if taxa > 0 else None
+    prefixo = f"{tarefa['nome']} - {rotulo}" if rotulo else tarefa['nome']
+    return f"{prefixo}: {int(feitos)}/{total} pontos | {taxa:.1f} pts/s | ETA {formatar_duracao(eta)}"
+
+def clima_interativo(tipo, top_estacoes, nome_sitio):
+    # Etapa pesada dos botões de clima da GUI (após a confirmação das estações), com métricas
+    if tipo == 'media':
+        iniciar_metricas("interativo_inmet_media")
+        with medir_etapa('clima_media', nome_sitio):
+            result = processar_medias_estacoes(top_estacoes, nome_sitio, is_batch=False, silencioso=True)
+    elif tipo == 'wth':
+        iniciar_metricas("interativo_inmet_wth")
+        with medir_etapa('clima_wth', nome_sitio):
+            result = gerar_arquivo_wth(top_estacoes, nome_sitio, is_batch=False)
+    else:
+        iniciar_metricas("interativo_inmet_anual")
+        with medir_etapa('clima_anual', nome_sitio):
+            result = gerar_csv_clima_anual(top_estacoes, nome_sitio, is_batch=False, silencioso=True)
+    return dict(result, message=result['message'] + finalizar_metricas_interativas())
+
+
+# --- Cache de resultados interativos (sessão, com persistência opcional entre sessões) ---
+ARQUIVO_CACHE_SESSAO = os.path.join(str(Path.home()), '.century_gui_cache.json')
+
+def versao_pasta(pasta):
+    # Manifesto da pasta (nome, tamanho e mtime de cada arquivo): muda quando um raster/CSV é trocado
+    try:
+        entradas = sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in os.scandir(pasta) if e.is_file())
+    except OSError:
+        return None
+    return hashlib.sha1(repr(entradas).encode('utf-8')).hexdigest()[:16]
+
+def versao_arquivos(caminhos):
+    entradas = []
+    for caminho in caminhos:
+        try:
+            st = os.stat(caminho)
+            entradas.append((caminho, st.st_size, st.st_mtime_ns))
+        except OSError:
+            entradas.append((caminho, None, None))
+    return hashlib.sha1(repr(entradas).encode('utf-8')).hexdigest()[:16]
+
+def coordenada_chave(valor):
+    # '-15.30' e '-15.3' são a mesma consulta
+    try:
+        return round(float(valor), 7)
+    except (TypeError, ValueError):
+        return str(valor)
+
+def _cache_para_json(valor):
+    # Só tipos simples vão para o arquivo (nada de pickle): tabelas viram colunas + dtypes e tuplas/dicionários
+    # com chaves não textuais são marcados, para o arquivo continuar legível após atualizar pandas/numpy ou o app
+    if isinstance(valor, pd.DataFrame):
+        return {'__tabela__': {'colunas': [str(c) for c in valor.columns], 'tipos': [str(t) for t in valor.dtypes],
+                               'valores': [_cache_para_json(valor[c].tolist()) for c in valor.columns]}}
+    if isinstance(valor, tuple):
+        return {'__tupla__': [_cache_para_json(v) for v in valor]}
+    if isinstance(valor, list):
+        return [_cache_para_json(v) for v in valor]
+    if isinstance(valor, dict):
+        if all(isinstance(k, str) for k in valor):
+            return {k: _cache_para_json(v) for k, v in valor.items()}
+        return {'__dict__': [[_cache_para_json(k), _cache_para_json(v)] for k, v in valor.items()]}
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    raise TypeError(f"tipo {type(valor).__name__} não pode ser gravado no cache")
+
+def _cache_de_json(objeto):
+    if len(objeto) == 1:
+        if '__tupla__' in objeto:
+            return tuple(objeto['__tupla__'])
+        if '__dict__' in objeto:
+            return {k: v for k, v in objeto['__dict__']}
+        if '__tabela__' in objeto:
+            t = objeto['__tabela__']
+            return pd.DataFrame(dict(zip(t['colunas'], t['valores'])), columns=t['colunas']).astype(dict(zip(t['colunas'], t['tipos'])))
+    return objeto
+
+class CacheResultados:
+    # LRU de resultados {'status': ...} por chave (função, versão dos dados, lat, lon, opções).
+    # Resultados com erro não entram (a pasta pode ser corrigida e a consulta repetida).
+    def __init__(self, max_itens=256):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._itens)
+
+    def obter(self, chave, calcular):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                contar_metrica('cache_hits')
+                return self._itens[chave]
+        resultado = calcular()
+        if isinstance(resultado, dict) and resultado.get('status') in ('ok', 'aviso'):
+            with self._lock:
+                self._itens[chave] = resultado
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+        return resultado
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def salvar(self, caminho=ARQUIVO_CACHE_SESSAO):
+        with self._lock:
+            itens = list(self._itens.items())
+        serializados = []
+        for chave, resultado in itens:
+            try:
+                serializados.append([_cache_para_json(chave), _cache_para_json(resultado)])
+            except TypeError:
+                continue
+        def escrever(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'versao': 2, 'itens': serializados}, f, ensure_ascii=False)
+        gravar_atomico(caminho, escrever)
+
+    def carregar(self, caminho=ARQUIVO_CACHE_SESSAO):
+        # Entradas de versões antigas das pastas simplesmente nunca mais casam e saem pela LRU.
+        # Um arquivo ilegível ou de outro formato é descartado (e apagado) em vez de impedir a abertura do app.
+        try:
+            with open(caminho, encoding='utf-8') as f:
+                conteudo = json.load(f, object_hook=_cache_de_json)
+            if not isinstance(conteudo, dict) or conteudo.get('versao') != 2:
+                raise ValueError("formato desconhecido")
+            itens = OrderedDict((chave, resultado) for chave, resultado in conteudo['itens'])
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Aviso: cache de sessão descartado ({e}).")
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+            return 0
+        with self._lock:
+            for chave, resultado in itens.items():
+                self._itens.setdefault(chave, resultado)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return len(itens)
+
+CACHE_SESSAO = CacheResultados()
+# Séries diárias das estações já lidas (ver ler_estacao_inmet)
+LEITURAS_ESTACOES = CacheResultados(max_itens=64)
+# Resumos (período e completude por ano) de cada estação e catálogos por versão da pasta (ver catalogo_estacoes)
+COBERTURAS_ESTACOES = CacheResultados(max_itens=4096)
+CATALOGOS_ESTACOES = CacheResultados(max_itens=8)
+# Gravados juntos ao fechar a GUI (opção 'Manter cache'): as coberturas poupam reler as estações na próxima sessão
+ARQUIVO_COBERTURAS_ESTACOES = os.path.join(str(Path.home()), '.century_gui_estacoes.json')
+CACHES_PERSISTENTES = [(CACHE_SESSAO, ARQUIVO_CACHE_SESSAO), (COBERTURAS_ESTACOES, ARQUIVO_COBERTURAS_ESTACOES)]
+
+def com_ponto(result, nome_sitio):
+    # Resultados cacheados são compartilhados entre sítios: a coluna 'ponto' é trocada numa cópia
+    if result.get('status') == 'ok' and 'data' in result and 'ponto' in result['data'].columns:
+        return dict(result, data=result['data'].assign(ponto=nome_sitio))
+    return result
+
+def mapbiomas_memorizado(folder, lat_str, lon_str, nome_sitio):
+    chave = ('mapbiomas', os.path.abspath(folder), versao_pasta(folder), coordenada_chave(lat_str), coordenada_chave(lon_str))
+    return com_ponto(CACHE_SESSAO.obter(chave, lambda: extrair_dados_mapbiomas(folder, lat_str, lon_str, nome_sitio)), nome_sitio)
+
+def solo_memorizado(folder, prof, lat_str, lon_str, nome_sitio):
+    pastas_prof = [os.path.join(folder, p) for p in profundidades_solo(prof)]
+    chave = ('solo', tuple(os.path.abspath(p) for p in pastas_prof), tuple(versao_pasta(p) for p in pastas_prof), coordenada_chave(lat_str), coordenada_chave(lon_str))
+    return com_ponto(CACHE_SESSAO.obter(chave, lambda: extrair_dados_solo(folder, prof, lat_str, lon_str, nome_sitio, camada=camada_padrao_solo(prof))), nome_sitio)
+
+def estacoes_memorizadas(folder, lat_str, lon_str, n_estacoes, cobertura=None):
+    # Sempre a versão silenciosa (com popup_message): pode rodar na thread do pré-carregamento.
+    # cobertura: ((ano_inicio, ano_fim), completude_minima) ou None (ver cobertura_exigida)
+    chave = ('estacoes', os.path.abspath(folder), versao_pasta(folder), coordenada_chave(lat_str), coordenada_chave(lon_str), int(n_estacoes), cobertura)
+    anos, completude_minima = cobertura or (None, 0.0)
+    return CACHE_SESSAO.obter(chave, lambda: encontrar_estacoes_proximas(folder, lat_str, lon_str, int(n_estacoes), silencioso=True,
+                                                                        anos=anos, completude_minima=completude_minima))
+
+def cobertura_exigida(values):
+    # Cobertura de clima pedida na tela: ((-ANO_INICIO-, -ANO_FIM-), completude) ou None se a opção estiver desligada
+    if not values.get('-INMET_COBERTURA-'):
+        return None
+    try:
+        anos = (int(values['-ANO_INICIO-']), int(values['-ANO_FIM-']))
+    except (TypeError, ValueError):
+        raise ValueError("Ano de início e Ano de fim devem ser números inteiros para exigir cobertura das estações.")
+    if anos[0] > anos[1]:
+        raise ValueError("Ano de início deve ser menor ou igual ao Ano de fim para exigir cobertura das estações.")
+    return anos, int(values.get('-INMET_COMPLETUDE-') or 0) / 100.0
+
+def clima_memorizado(tipo, top_estacoes, nome_sitio):
+    # tipo 'media' | 'anual': tabela calculada uma vez por conjunto de estações; o .WTH reaproveita a anual
+    caminhos = tuple(os.path.abspath(e['filepath']) for e in top_estacoes)
+    calcular = processar_medias_estacoes if tipo == 'media' else gerar_csv_clima_anual
+    chave = ('clima_' + tipo, caminhos, versao_arquivos(caminhos))
+    return com_ponto(CACHE_SESSAO.obter(chave, lambda: calcular(top_estacoes, nome_sitio, is_batch=True)), nome_sitio)
+
+
+class PrefetchCoordenadas:
+    # Pré-carregamento especulativo da GUI: quando as coordenadas ficam válidas (e param de mudar por
+    # 'atraso' segundos), busca as estações, a série MapBiomas e o solo em uma thread. Os botões usam o
+    # resultado pronto (ou aguardam o que está em andamento); coordenadas novas cancelam o anterior.
+    def __init__(self, atraso=0.6):
+        self.atraso = atraso
+        self._lock = threading.Lock()
+        self._timer = None
+        self._cancelar = threading.Event()
+        self._resultados = {}
+
+    def cancelar(self):
+        with self._lock:
+            self._cancelar.set()
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._resultados = {}
+
+    def agendar(self, lat_str, lon_str, mb_folder=None, solo_folder=None, solo_prof='0-20cm', inmet_folder=None, n_estacoes=3, cobertura=None):
+        self.cancelar()
+        try:
+            lat, lon = float(lat_str), float(lon_str)
+        except (TypeError, ValueError):
+            return False
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return False
+        tarefas = []
+        if inmet_folder and os.path.isdir(inmet_folder):
+            tarefas.append((('inmet', inmet_folder, lat_str, lon_str, int(n_estacoes), cobertura),
+                            lambda: estacoes_memorizadas(inmet_folder, lat_str, lon_str, n_estacoes, cobertura)))
+        if mb_folder and os.path.isdir(mb_folder):
+            tarefas.append((('mb', mb_folder, lat_str, lon_str), lambda: mapbiomas_memorizado(mb_folder, lat_str, lon_str, '')))
+        if solo_folder and os.path.isdir(solo_folder):
+            tarefas.append((('solo', solo_folder, solo_prof, lat_str, lon_str), lambda: solo_memorizado(solo_folder, solo_prof, lat_str, lon_str, '')))
+        if not tarefas:
+            return False
+        cancelar = threading.Event()
+        timer = threading.Timer(self.atraso, self._executar, args=(tarefas, cancelar))
+        timer.daemon = True
+        with self._lock:
+            self._cancelar = cancelar
+            self._timer = timer
+        timer.start()
+        return True
+
+    def _executar(self, tarefas, cancelar):
+        for chave, calcular in tarefas:
+            entrada = {'pronto': threading.Event(), 'resultado': None}
+            with self._lock:
+                if cancelar.is_set():
+                    return
+                self._resultados[chave] = entrada
+            try:
+                entrada['resultado'] = calcular()
+            except Exception as e:
+                print(f"Pré-carregamento {chave[0]} falhou: {e}")
+            finally:
+                entrada['pronto'].set()
+
+    def _obter(self, chave, calcular):
+        with self._lock:
+            entrada = self._resultados.get(chave)
+        if entrada is not None:
+            entrada['pronto'].wait()
+            if entrada['resultado'] is not None:
+                contar_metrica('cache_hits')
+                return entrada['resultado']
+        return calcular()
+
+    def mapbiomas(self, folder, lat_str, lon_str, nome_sitio):
+        return com_ponto(self._obter(('mb', folder, lat_str, lon_str), lambda: mapbiomas_memorizado(folder, lat_str, lon_str, nome_sitio)), nome_sitio)
+
+    def solo(self, folder, prof, lat_str, lon_str, nome_sitio):
+        return com_ponto(self._obter(('solo', folder, prof, lat_str, lon_str), lambda: solo_memorizado(folder, prof, lat_str, lon_str, nome_sitio)), nome_sitio)
+
+    def estacoes(self, folder, lat_str, lon_str, n_estacoes, cobertura=None):
+        return self._obter(('inmet', folder, lat_str, lon_str, int(n_estacoes), cobertura),
+                           lambda: estacoes_memorizadas(folder, lat_str, lon_str, n_estacoes, cobertura))
+
+
+# --- Serviço local (JSON/HTTP) com rasters, manifestos e estações mantidos em memória ---
+URL_SERVICO_PADRAO = 'http://127.0.0.1:8765'
+
+def _valor_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (pd.Timestamp, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, pd.DataFrame):
+        return json.loads(obj.to_json(orient='records', force_ascii=False))
+    return str(obj)
+
+class ServicoCentury:
+    # Consultas por ponto sobre as pastas fixadas na partida; a requisição não escolhe pastas nem arquivos.
+    # Rotas: saude, lulc, solo, estacoes, clima (tipo media|anual|wth), site100, sch. Parâmetros comuns:
+    # lat, lon, nome; as tabelas voltam como lista de registros e os arquivos (wth, site100, sch) como 'texto'.
+    # estacoes/clima aceitam ano_inicio, ano_fim e completude para exigir cobertura do período.
+    def __init__(self, mb_folder=None, solo_folder=None, inmet_folder=None, template_site100=None, solo_prof='0-20cm', n_estacoes=3, validade=5.0):
+        self.pastas = {'mapbiomas': mb_folder, 'solo': solo_folder, 'inmet': inmet_folder, 'template': template_site100}
+        self.solo_prof = solo_prof
+        self.n_estacoes = n_estacoes
+        self.acervo = AcervoAberto(validade)
+        self.inicio = time.time()
+        self.consultas = 0
+        self.rotas = {'saude': self.saude, 'lulc': self.lulc, 'solo': self.solo, 'estacoes': self.estacoes,
+                      'clima': self.clima, 'site100': self.site100, 'sch': self.sch}
+
+    def aquecer(self):
+        # Lê manifestos e catálogo de estações e abre os rasters das pastas configuradas
+        if self.pastas['mapbiomas'] and os.path.isdir(self.pastas['mapbiomas']):
+            for _, caminho in self.acervo.manifesto(self.pastas['mapbiomas'], listar_rasters_mapbiomas):
+                with self.acervo.abrir(caminho):
+                    pass
+        if self.pastas['solo'] and os.path.isdir(self.pastas['solo']):
+            for prof in sorted(os.listdir(self.pastas['solo'])):
+                pasta_prof = os.path.join(self.pastas['solo'], prof)
+                if os.path.isdir(pasta_prof):
+                    for f in self.acervo.manifesto(pasta_prof, os.listdir):
+                        if f.lower().endswith(('.tif', '.tiff')):
+                            with self.acervo.abrir(os.path.join(pasta_prof, f)):
+                                pass
+        if self.pastas['inmet'] and os.path.isdir(self.pastas['inmet']):
+            self.acervo.manifesto(self.pastas['inmet'], catalogo_estacoes)
+        return self.saude({})
+
+    def fechar(self):
+        self.acervo.fechar()
+
+    def tratar(self, rota, params):
+        funcao = self.rotas.get(rota.strip('/'))
+        if funcao is None:
+            return {'status': 'erro', 'message': f"Rota desconhecida: '{rota}'. Disponíveis: {', '.join(sorted(self.rotas))}.", 'codigo_http': 404}
+        self.consultas += 1
+        try:
+            return funcao(params)
+        except Exception as e:
+            return {'status': 'erro', 'message': f"Erro na rota '{rota}': {e}"}
+
+    def _pasta(self, nome):
+        pasta = self.pastas[nome]
+        if not pasta:
+            raise ValueError(f"Pasta '{nome}' não configurada na partida do serviço.")
+        return pasta
+
+    def saude(self, params):
+        return {'status': 'ok', 'pastas': self.pastas, 'rasters_abertos': self.acervo.n_abertos(),
+                'estacoes_em_cache': len(LEITURAS_ESTACOES), 'consultas': self.consultas, 'ativo_ha_s': round(time.time() - self.inicio, 1)}
+
+    def lulc(self, params):
+        return extrair_dados_mapbiomas(self._pasta('mapbiomas'), params['lat'], params['lon'], params.get('nome', ''), acervo=self.acervo)
+
+    def solo(self, params):
+        # profundidade aceita várias ('0-5cm,5-15cm'); camada define a agregação (padrão: camada_padrao_solo)
+        profundidade = params.get('profundidade', self.solo_prof)
+        return extrair_dados_solo(self._pasta('solo'), profundidade, params['lat'], params['lon'], params.get('nome', ''),
+                                  acervo=self.acervo, camada=params.get('camada') or camada_padrao_solo(profundidade))
+
+    def estacoes(self, params):
+        # ano_inicio e ano_fim (opcionais) exigem cobertura desses anos, com completude mínima (fração, padrão 0)
+        anos = (int(params['ano_inicio']), int(params['ano_fim'])) if params.get('ano_inicio') and params.get('ano_fim') else None
+        return encontrar_estacoes_proximas(self._pasta('inmet'), params['lat'], params['lon'], int(params.get('n', self.n_estacoes)),
+                                           is_batch=True, acervo=self.acervo, anos=anos, completude_minima=float(params.get('completude', 0.0)))
+
+    def clima(self, params):
+        busca = self.estacoes(params)
+        if busca['status'] == 'erro':
+            return busca
+        tipo = params.get('tipo', 'media')
+        nome = params.get('nome', '')
+        # Tabelas por conjunto de estações (pontos vizinhos costumam compartilhar as mesmas)
+        if tipo == 'media':
+            return clima_memorizado('media', busca['top_estacoes'], nome)
+        anual = clima_memorizado('anual', busca['top_estacoes'], nome)
+        if tipo != 'wth' or anual['status'] != 'ok':
+            return anual
+        texto, min_year, max_year = renderizar_wth(anual['data'])
+        return {'status': 'ok', 'texto': texto, 'anos': [min_year, max_year]}
+
+    def site100(self, params):
+        template = self._pasta('template')
+        compilado = compilar_template_site100(template)
+        if compilado['status'] == 'erro':
+            return compilado
+        solo = self.solo(params)
+        if solo['status'] != 'ok':
+            return solo
+        clima = self.clima(dict(params, tipo='media'))
+        if clima['status'] != 'ok':
+            return clima
+        clima_map = clima['data'].sort_values(by='mes').set_index('mes')[['ppt', 'tmin', 'tmax']].to_dict('index')
+        valores = formatar_valores_site100(clima_map, solo['data'].iloc[0][CAMPOS_SOLO_SITE100].values, params['lat'], params['lon'])
+        return {'status': 'ok', 'texto': renderizar_site100(compilado, valores), 'avisos': compilado['avisos']}
+
+    def sch(self, params):
+        # Opções como na varredura: apelidos (clima, ano_limite, bloco_inicial) ou chaves de OPCOES_SCH_PADRAO
+        grade = {k: v for k, v in params.items() if k in APELIDOS_VARREDURA or k in OPCOES_SCH_PADRAO}
+        opcoes = expandir_grade_varredura(grade)[0][1]
+        lulc = self.lulc(params)
+        if lulc['status'] != 'ok':
+            return lulc
+        montagem = montar_timeline_sch(lulc['data'], opcoes)
+        if montagem['status'] != 'ok':
+            return montagem
+        nome = params.get('nome', '')
+        site_file = params.get('-SITE_FILE-') or (f"{nome}_site.100" if nome else opcoes['-SITE_FILE-'])
+        return {'status': 'ok', 'texto': renderizar_sch(dict(opcoes, **{'-SITE_FILE-': site_file}), montagem['timeline'])}
+
+def criar_servidor_servico(servico, host='127.0.0.1', porta=8765):
+    # GET /rota?lat=..&lon=.. ou POST /rota com corpo JSON; resposta sempre JSON ({'status': ...})
+    class Tratador(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Cabeçalho e corpo saem em escritas separadas: sem TCP_NODELAY o ACK atrasado soma ~40 ms por consulta
+        disable_nagle_algorithm = True
+
+        def _enviar(self, resultado):
+            codigo = resultado.pop('codigo_http', None) or (200 if resultado.get('status') != 'erro' else 400)
+            corpo = json.dumps(resultado, default=_valor_json, ensure_ascii=False).encode('utf-8')
+            self.send_response(codigo)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_GET(self):
+            partes = urllib.parse.urlsplit(self.path)
+            self._enviar(servico.tratar(partes.path, dict(urllib.parse.parse_qsl(partes.query))))
+
+        def do_POST(self):
+            tamanho = int(self.headers.get('Content-Length') or 0)
+            try:
+                params = json.loads(self.rfile.read(tamanho) or b'{}')
+                if not isinstance(params, dict):
+                    raise ValueError("esperado um objeto")
+            except ValueError as e:
+                self._enviar({'status': 'erro', 'message': f"Corpo JSON inválido: {e}"})
+                return
+            self._enviar(servico.tratar(urllib.parse.urlsplit(self.path).path, params))
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = http.server.ThreadingHTTPServer((host, porta), Tratador)
+    servidor.daemon_threads = True
+    return servidor
+
+def consultar_servico(rota, url=URL_SERVICO_PADRAO, timeout=30, **params):
+    # Cliente mínimo para scripts: consultar_servico('lulc', lat=-15.3, lon=-49.7) -> {'status': ..., 'data': [...]}
+    requisicao = urllib.request.Request(f"{url.rstrip('/')}/{rota.strip('/')}", data=json.dumps(params).encode('utf-8'),
+                                        headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(requisicao, timeout=timeout) as resposta:
+            return json.loads(resposta.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read().decode('utf-8'))
+    except (urllib.error.URLError, OSError) as e:
+        return {'status': 'erro', 'message': f"Serviço indisponível em {url}: {e}"}
+
+def main_servico(args):
+    # Uso: python century_gui.py --servico [--mapbiomas PASTA] [--solo PASTA] [--inmet PASTA] [--template site.100] [--porta 8765]
+    import argparse
+    parser = argparse.ArgumentParser(prog='century_gui.py')
+    parser.add_argument('--mapbiomas', default=None)
+    parser.add_argument('--solo', default=None)
+    parser.add_argument('--profundidade', default='0-20cm')
+    parser.add_argument('--inmet', default=None)
+    parser.add_argument('--n-estacoes', type=int, default=3)
+    parser.add_argument('--template', default=None)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8765)
+    a = parser.parse_args(args)
+    servico = ServicoCentury(a.mapbiomas, a.solo, a.inmet, a.template, a.profundidade, a.n_estacoes)
+    estado = servico.aquecer()
+    servidor = criar_servidor_servico(servico, a.host, a.porta)
+    print(f"Serviço CENTURY em http://{a.host}:{a.porta} ({estado['rasters_abertos']} rasters abertos). Ctrl+C para encerrar.")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servico.fechar()
+    return 0
+
+
+# --- Modo observação: processa os pontos novos dos CSVs que chegam numa pasta ---
+ARQUIVO_ESTADO_OBSERVACAO = '.century_observacao.json'
+
+def chave_ponto_lote(ponto, lat, lon):
+    return f"{ponto}|{coordenada_chave(lat)}|{coordenada_chave(lon)}"
+
+class ObservadorPasta:
+    # Varre 'pasta_entrada' a cada 'intervalo' segundos. Cada CSV (colunas sitio, latitude, longitude) parado há
+    # pelo menos 'estabilidade' segundos tem seus pontos ainda não vistos processados pelos 3 passos do lote;
+    # as saídas vão para '<arquivo>_saida/' e o log de cada rodada é acrescentado a '<arquivo>.log', ao lado do
+    # CSV. Os pontos já processados ficam em ARQUIVO_ESTADO_OBSERVACAO, então reiniciar não reprocessa nada.
+    # Rasters, manifestos e estações ficam em memória (AcervoAberto / LEITURAS_ESTACOES) entre as rodadas.
+    def __init__(self, pasta_entrada, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes=3, inmet_mode='ambos',
+                 template_site100=None, intervalo=5.0, estabilidade=2.0):
+        self.pasta_entrada = pasta_entrada
+        self.config = (mb_folder, solo_folder, solo_prof, inmet_folder, int(inmet_n_estacoes), inmet_mode)
+        self.template_site100 = template_site100
+        self.intervalo = intervalo
+        self.estabilidade = estabilidade
+        self.acervo = AcervoAberto()
+        self.caminho_estado = os.path.join(pasta_entrada, ARQUIVO_ESTADO_OBSERVACAO)
+        self.estado = self._carregar_estado()
+
+    def _carregar_estado(self):
+        try:
+            with open(self.caminho_estado, 'r', encoding='utf-8') as f:
+                estado = json.load(f)
+            return estado if isinstance(estado, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _salvar_estado(self):
+        def escrever(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.estado, f, ensure_ascii=False)
+        gravar_atomico(self.caminho_estado, escrever)
+
+    def arquivos_prontos(self):
+        # CSVs da pasta que não mudaram nos últimos 'estabilidade' segundos (ainda podem estar sendo copiados)
+        agora = time.time()
+        prontos = []
+        for entrada in sorted(os.scandir(self.pasta_entrada), key=lambda e: e.name):
+            if not entrada.is_file() or entrada.name.startswith(('.', '~')) or not entrada.name.lower().endswith('.csv'):
+                continue
+            info = entrada.stat()
+            assinatura = [info.st_size, info.st_mtime_ns]
+            if agora - info.st_mtime < self.estabilidade:
+                continue
+            if self.estado.get(entrada.name, {}).get('assinatura') == assinatura:
+                continue
+            prontos.append((entrada.name, assinatura))
+        return prontos
+
+    def processar_arquivo(self, nome_arquivo, assinatura):
+        caminho = os.path.join(self.pasta_entrada, nome_arquivo)
+        base = os.path.splitext(nome_arquivo)[0]
+        registro = self.estado.setdefault(nome_arquivo, {'pontos': []})
+        vistos = set(registro['pontos'])
+        carimbo = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log_messages = []
+        novos_pontos = []
+        try:
+            pontos_df = ler_csv_pontos(caminho)
+            erro_colunas = normalizar_colunas_pontos(pontos_df)
+            if erro_colunas:
+                log_messages.append(erro_colunas)
+            else:
+                chaves = [chave_ponto_lote(p, la, lo) for p, la, lo in zip(pontos_df['ponto'], pontos_df['lat'], pontos_df['lon'])]
+                posicoes = [i for i, chave in enumerate(chaves) if chave not in vistos]
+                novos_pontos = list(dict.fromkeys(chaves[i] for i in posicoes))
+                if posicoes:
+                    pasta_saida = obter_pasta_saida(os.path.join(self.pasta_entrada, f"{base}_saida"))
+                    mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode = self.config
+                    log_messages.append(f"--- {len(posicoes)} ponto(s) novo(s) de {len(pontos_df)} ---")
+                    iniciar_metricas(f"observacao_{base}")
+                    with escritor_em_segundo_plano() as escritor:
+                        processar_pontos_lote(pontos_df.iloc[posicoes].reset_index(drop=True), posicoes, len(pontos_df),
+                                              lambda msg, passo=None, indice=None: log_messages.append(msg),
+                                              mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode, pasta_saida,
+                                              self.template_site100, acervo=self.acervo)
+                    if escritor.erros:
+                        log_messages.append(f"\n--- Falhas de Gravação ({len(escritor.erros)}) ---")
+                        log_messages.extend(f" {erro}" for erro in escritor.erros)
+                    log_messages.append(f"\n--- Saídas em {pasta_saida} ---")
+                    log_messages.append("\n" + resumo_metricas(finalizar_metricas()))
+        except Exception as e:
+            if METRICAS_ATIVAS is not None:
+                finalizar_metricas()
+            log_messages.append(f"Erro fatal durante o processamento de '{nome_arquivo}':\n{e}")
+            novos_pontos = []
+
+        registro['pontos'].extend(novos_pontos)
+        registro['assinatura'] = assinatura
+        if log_messages:
+            with open(os.path.join(self.pasta_entrada, f"{base}.log"), 'a', encoding='utf-8') as f:
+                f.write(f"=== {carimbo} | {nome_arquivo} ===\n" + "\n".join(log_messages) + "\n\n")
+        self._salvar_estado()
+        return len(novos_pontos)
+
+    def ciclo(self):
+        # Uma varredura da pasta: {arquivo: pontos novos processados}
+        return {nome: self.processar_arquivo(nome, assinatura) for nome, assinatura in self.arquivos_prontos()}
+
+    def executar(self, parar=None, max_ciclos=None, ao_processar=None):
+        # Laço até 'parar' (threading.Event) ser ativado ou 'max_ciclos' varreduras
+        parar = parar or threading.Event()
+        ciclos = 0
+        try:
+            while not parar.is_set() and (max_ciclos is None or ciclos < max_ciclos):
+                processados = self.ciclo()
+                ciclos += 1
+                if ao_processar and processados:
+                    ao_processar(processados)
+                if max_ciclos is None or ciclos < max_ciclos:
+                    parar.wait(self.intervalo)
+        finally:
+            self.acervo.fechar()
+        return ciclos
+
+def main_observar(args):
+    # Uso: python century_gui.py --observar PASTA --mapbiomas ... --solo ... --inmet ... [--intervalo 5] [--template site.100]
+    import argparse
+    parser = argparse.ArgumentParser(prog='century_gui.py')
+    parser.add_argument('pasta')
+    parser.add_argument('--mapbiomas', required=True)
+    parser.add_argument('--solo', required=True)
+    parser.add_argument('--profundidade', default='0-20cm')
+    parser.add_argument('--inmet', required=True)
+    parser.add_argument('--n-estacoes', type=int, default=3)
+    parser.add_argument('--modo-clima', default='ambos', choices=['média', 'anual', 'ambos'])
+    parser.add_argument('--template', default=None)
+    parser.add_argument('--intervalo', type=float, default=5.0)
+    parser.add_argument('--estabilidade', type=float, default=2.0)
+    parser.add_argument('--ciclos', type=int, default=None)
+    a = parser.parse_args(args)
+    if not os.path.isdir(a.pasta):
+        print(f"Erro: Pasta de entrada não encontrada:\n{a.pasta}")
+        return 1
+    observador = ObservadorPasta(a.pasta, a.mapbiomas, a.solo, a.profundidade, a.inmet, a.n_estacoes, a.modo_clima, a.template, a.intervalo, a.estabilidade)
+    print(f"Observando {a.pasta} a cada {a.intervalo:g} s. Ctrl+C para encerrar.")
+    relatar = lambda processados: print("\n".join(f" {nome}: {n} ponto(s) novo(s)" for nome, n in processados.items()))
+    try:
+        observador.executar(max_ciclos=a.ciclos, ao_processar=relatar)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+# Modos sem interface gráfica (ex: python century_gui.py --benchmark 1k 50)
+MODOS_LINHA_COMANDO = {
+    '--benchmark': main_benchmark,
+    '--lote-shard': main_lote_shard,
+    '--mesclar-shards': main_mesclar_shards,
+    '--sch-lote': main_sch_lote,
+    '--sch-varredura': main_sch_varredura,
+    '--servico': main_servico,
+    '--observar': main_observar,
+}
+
+def main():
+    # Interface gráfica (o módulo pode ser importado sem abrir a janela: testes, modos de linha de comando, processos filhos)
+    # Define as opções padrão usando as chaves dos dicionários WEATHER_CHOICES_MAP para manter a consistência com o CENTURY.
+    DEFAULT_WEATHER_M = WEATHER_CHOICES_MAP['M']
+    DEFAULT_WEATHER_F = WEATHER_CHOICES_MAP['F']
+
+    # Layout dos parâmetros globais ajustado para alinhamento vertical
+    col_globais = [
+        [
+            sg.Column([
+                [sg.Text("Nome do Sítio:", size=(16,1), justification='right')], 
+                [sg.Text("Ano Início (Simulação):", size=(16,1), justification='right')], 
+                [sg.Text("Initial crop:", size=(16,1), justification='right')]
+            ], element_justification='right', pad=(0,0)), 
+            sg.Column([
+                [sg.Input("Lu_AFGO", key="-SITIO-", size=(14,1), enable_events=True)],
+                [sg.Input("1958", key="-ANO_INICIO-", size=(8,1), enable_events=True)],
+                [sg.Combo(INITIAL_CROP_OPTIONS, default_value='HER', key='-INIT_CROP-', size=(10,1), readonly=True, enable_events=True)]
+            ], pad=(0,0)), 
+            sg.Column([
+                [sg.Text("Arquivo .site.100:", size=(16,1), justification='right')],
+                [sg.Text("Ano Fim (Simulação):", size=(16,1), justification='right')],
+                [sg.Text("Initial tree:", size=(16,1), justification='right')]
+            ], element_justification='right', pad=(10,0)),
+            sg.Column([
+                [sg.Input("lu_site.100", key="-SITE_FILE-", size=(14,1), enable_events=True)],
+                [sg.Input("2025", key="-ANO_FIM-", size=(8,1), enable_events=True)],
+                [sg.Combo(INITIAL_TREE_OPTIONS, default_value='CER', key='-INIT_TREE-', size=(10,1), readonly=True, enable_events=True)]
+            ], pad=(0,0))
+        ]
+    ]
+
+
+    col_bloco_padrao = [
+        [sg.Text("Ano Final do Bloco (Last Year):", size=(25,1)), sg.Input("1982", key='-P_LAST_YEAR-', size=(10,1), enable_events=True)],
+        [sg.Text("Ano Início da Saída (Output Year):", size=(25,1)), sg.Input("1958", key='-P_OUT_YEAR-', size=(10,1))],
+        [sg.Text("Weather Choice:", size=(25,1)), 
+         sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_M, key='-P_WEATHER_COMBO-', readonly=True, size=(30, 1))],
+        [sg.Button("Adicionar Bloco Padrão 1 (Cerrado)", key='-ADD_BLOCO_CERRADO-')]
+    ]
+
+    col_bloco_desmatamento = [
+        [sg.Text("Block #: 2", size=(25,1)), sg.Text("Repeats #: 2", size=(10,1))],
+        [sg.Text("Ano Final do Bloco (Last Year):", size=(25,1)), sg.Input("1984", key='-D_LAST_YEAR-', size=(10,1), enable_events=True)],
+        [sg.Text("Ano Início da Saída (Output Year):", size=(25,1)), sg.Input("1983", key='-D_OUT_YEAR-', size=(10,1))],
+        [sg.Text("Weather Choice:", size=(25,1)), 
+         sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_F, key='-D_WEATHER_COMBO-', readonly=True, size=(30, 1))],
+        [sg.Button("Adicionar Bloco 2 (Desmat. + Past. Trad)", key='-ADD_BLOCO_DESMATAMENTO-')]
+    ]
+
+    col_mapbiomas_automatico = [
+        [sg.Text("CSV MapBiomas Extraído:", size=(25,1)), 
+         sg.Input(key='-MB_CSV_FILE-', size=(15,1)), 
+         sg.FileBrowse("Procurar", target='-MB_CSV_FILE-', file_types=(("CSV Files", "*.csv"),))],
+        [sg.Text("Bloco # Inicial (ex: 3):", size=(25,1)), sg.Input("3", key='-MB_START_BLOCK_NUM-', size=(5,1))],
+        [sg.Text("Ano Limite de Análise (Máx 2015):", size=(25,1)), sg.Input("2015", key='-MB_YEAR_LIMIT-', size=(5,1))],
+        [sg.Text("Weather Choice (LULC Auto):", size=(25,1)), 
+         sg.Combo(WEATHER_CHOICES, default_value=WEATHER_CHOICES_MAP['C'], key='-MB_WEATHER_COMBO-', readonly=True, size=(30, 1))],
+        [sg.Button("Gerar Blocos LULC (até 2015)", key='-GENERATE_LULC_BLOCKS-', size=(30, 1), button_color=('white', '#8A2BE2'))]
+    ]
+
+    col_bloco_manual_layout = [
+        [sg.Text("Block #:", size=(12,1)), sg.Input("3", size=(5,1), key='-B_NUM-')],
+        [sg.Text("Last Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_LAST_YEAR-')],
+        [sg.Text("Repeats #:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_REPEATS-')],
+        [sg.Text("Output Start Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_OUT_YEAR-')],
+        [sg.Text("Output Month:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_MONTH-')],
+        [sg.Text("Output Interval:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_INTERVAL-')],
+        [sg.Text("Weather:", size=(12,1)), 
+         sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_M, key='-B_WEATHER_COMBO-', readonly=True, size=(30, 1))],
+        [sg.Button("Adicionar Cabeçalho de Bloco Manual")]
+    ]
+
+    col_evento_layout = [
+        [sg.Text("Tipo de Evento:", size=(15,1)), 
+         sg.Combo(ALL_EVENT_DESCRIPTIONS, key='-E_TIPO-', size=(20,1), readonly=True, enable_events=True)],
+        [sg.Text("Código Específico:", size=(15,1), key='-E_CODIGO_TXT-', visible=False), 
+         sg.Combo([], key='-E_CODIGO_COMBO-', size=(35,1), readonly=True, visible=False)],
+        [sg.Text("Ano (1, 2, ...):", size=(15,1)), sg.Input(size=(5,1), key='-E_BLOCK_NUM-')],
+        [sg.Text("Mês (1-12):", size=(15,1)), sg.Input(size=(5,1), key='-E_MES-')],
+        [sg.Button("Adicionar Evento Manual"), sg.Button("Fechar Bloco (-999)", key="Adicionar Terminador de Bloco (-999)", button_color=('white', 'firebrick'))],
+        [sg.Button("Gerar Arquivo .SCH", size=(15,2)), sg.Button("Sair", size=(10,2))]
+    ]
+
+    # INSERÇÃO CORRIGIDA: Definição de coluna_timeline (estava faltando ou mal posicionada)
+    coluna_timeline = [
+        [sg.Text("Preview do Arquivo .SCH", font=("Helvetica", 15))],
+        [sg.Multiline(size=(45, 30), key='-PREVIEW_COMPLETO-', disabled=True, font=("Courier New", 9), background_color='#F0F0F0', text_color='black')],
+        [sg.Text("Linha do Tempo (Itens Adicionados)", font=("Helvetica", 10))],
+        [sg.Listbox(values=[], size=(45, 10), key='-TIMELINE-', enable_events=True)],
+        [sg.Button("Selecionar Item", key="Carregar Item Selecionado"), sg.Button("Remover Selecionado"), sg.Button("Limpar Tudo")]
+    ]
+
+
+    col_coordenadas = [
+        [sg.Text("Latitude (ex: -16.5):", size=(20,1)), sg.Input(size=(15,1), key='-MB_LAT-', enable_events=True)],
+        [sg.Text("Longitude (ex: -49.2):", size=(20,1)), sg.Input(size=(15,1), key='-MB_LON-', enable_events=True)],
+    ]
+
+    col_mapbiomas = [
+        [sg.Text("Pasta Origem Lulc (.tif):", size=(20,1)), 
+         sg.Input(key='-MB_FOLDER-', size=(18,1)), 
+         sg.FolderBrowse("Procurar", target='-MB_FOLDER-')],
+        [sg.Button("Extrair Dados", key='-MB_EXTRACT-', size=(30, 1), button_color=('white', 'darkgreen'))]
+    ]
+
+    col_solo = [
+        [sg.Text("Pasta Origem Solo (.tif):", size=(20,1)), 
+         sg.Input(key='-SOLO_FOLDER-', size=(18,1)), 
+         sg.FolderBrowse("Procurar", target='-SOLO_FOLDER-')],
+        [sg.Text("Profundidade:", size=(20,1)),
+         sg.Combo(['0-20cm', '0-30cm', '0-20cm,0-30cm'], default_value='0-20cm', key='-SOLO_PROF-', readonly=True, size=(13,1))],
+        [sg.Button("Extrair Dados", key='-SOLO_EXTRACT-', size=(30, 1), button_color=('white', 'darkblue'))]
+    ]
+
+    col_inmet = [
+        [sg.Text("Pasta Estações INMET (.csv):", size=(20,1)), 
+         sg.Input(key='-INMET_FOLDER-', size=(18,1)), 
+         sg.FolderBrowse("Procurar", target='-INMET_FOLDER-')],
+        [sg.Text("Nº de Estações p/ Média:", size=(20,1)), 
+         sg.Combo(['1', '2', '3'], default_value='3', key='-INMET_NUM_ESTACOES-', readonly=True, size=(5,1))],
+        [sg.Checkbox("Exigir cobertura Ano início-fim", key='-INMET_COBERTURA-', default=False,
+                     tooltip="Só estações com dados em todos os anos da simulação (Ano de início a Ano de fim)"),
+         sg.Text("mín. %:"),
+         sg.Combo(['0', '50', '80', '90', '95'], default_value='80', key='-INMET_COMPLETUDE-', readonly=True, size=(4,1),
+                  tooltip="Completude mínima de cada ano (% dos dias com precipitação e temperaturas)")],
+        [sg.Button("Processar Média Clima", key='-INMET_PROCESS-', size=(30, 1), button_color=('white', 'darkred'))],
+        [sg.Button("Criar Histórico.csv (Ano/Mês)", key='-INMET_WTH_CSV-', size=(30, 1), button_color=('white', '#800080'))],
+        [sg.Button("Criar Arquivo .WTH", key='-INMET_WTH_FILE-', size=(30, 1), button_color=('white', 'indigo'))]
+    ]
+
+    col_site_100_creator = [
+        [sg.Text("1. Arquivo de Solo (média):", size=(20,1)), 
+         sg.Input(key='-SITE_SOLO_FILE-', size=(18,1)), 
+         sg.FileBrowse("Procurar", target='-SITE_SOLO_FILE-', file_types=(("CSV Files", "*.csv"),))],
+        [sg.Text("2. Arquivo de Clima (média):", size=(20,1)), 
+         sg.Input(key='-SITE_CLIMA_FILE-', size=(18,1)), 
+         sg.FileBrowse("Procurar", target='-SITE_CLIMA_FILE-', file_types=(("CSV Files", "*.csv"),))],
+        [sg.Text("3. Template site.100:", size=(20,1)), 
+         sg.Input(key='-SITE_TEMPLATE_FILE-', size=(18,1)), 
+         sg.FileBrowse("Procurar", target='-SITE_TEMPLATE_FILE-', file_types=(("Template Files", "*.100"),))],
+        [sg.Button("Criar Arquivo site.100", key='-SITE_100_CREATE-', size=(30, 1), button_color=('white', 'darkgreen'))],
+        [sg.Button("Criar site.100 p/ Todos os Pontos", key='-SITE_100_LOTE-', size=(30, 1), button_color=('white', 'darkgreen'))]
+    ]
+
+    layout_col_1 = [
+        [sg.Image(filename='lapig_logo.png', size=(338, 111), key='-LOGO_LAPIG-'), sg.Text("Carbono", font=("Helvetica", 18, 'bold'))],
+        [sg.Frame("Coordenadas (Lat/Lon) - Ponto Único", col_coordenadas, key='-F_COORD-')],
+        [sg.Frame("Extrator de Uso do Solo (MapBiomas) - Ponto Único", col_mapbiomas, key='-F_MAPBIOMAS-')],
+        [sg.Frame("Extrator de Dados de Solo (Embrapa) - Ponto Único", col_solo, key='-F_SOLO-')],
+        [sg.Frame("Extrator de Clima (INMET) - Ponto Único", col_inmet, key='-F_INMET-')],
+        [sg.Frame("Criar arquivo SITE.100", col_site_100_creator, key='-F_SITE_CREATOR-')],
+    ]
+
+    col_lote = [
+        [sg.Text("csv Pontos (sitio,latitude,longitude)", size=(25,1)), 
+         sg.Input(key='-LOTE_CSV-', size=(10,1)), 
+         sg.FileBrowse("Procurar", target='-LOTE_CSV-', file_types=(("CSV Files", "*.csv"),))],
+        [sg.Text("Pasta LULC:", size=(12,1)), 
+         sg.Input(key='-LOTE_MB_FOLDER-', size=(16,1)), 
+         sg.FolderBrowse("Procurar", target='-LOTE_MB_FOLDER-')],
+        [sg.Text("Pasta SOLO:", size=(12,1)),
+         sg.Input(key='-LOTE_SOLO_FOLDER-', size=(16,1)), 
+         sg.FolderBrowse("Procurar", target='-LOTE_SOLO_FOLDER-')],
+        [sg.Text("Profundidade:", size=(12,1)),
+         sg.Combo(['0-20cm', '0-30cm', '0-20cm,0-30cm'], default_value='0-20cm', key='-LOTE_SOLO_PROF-', readonly=True, size=(13,1))],
+        [sg.Text("Pasta CLIMA:", size=(12,1)), 
+         sg.Input(key='-LOTE_INMET_FOLDER-', size=(16,1)), 
+         sg.FolderBrowse("Procurar", target='-LOTE_INMET_FOLDER-')],
+        [sg.Text("Nº Estações:", size=(12,1)), 
+         sg.Combo(['1', '2', '3'], default_value='3', key='-LOTE_INMET_NUM_ESTACOES-', readonly=True, size=(8,1))],
+        [sg.Text("Saída Clima:", size=(12,1)), 
+         sg.Combo(['média', 'anual', 'ambos'], default_value='ambos', key='-LOTE_INMET_MODE-', readonly=True, size=(10,1))],
+        [sg.Text("Pasta SAÍDA:", size=(12,1)),
+         sg.Input(key='-PASTA_SAIDA-', size=(16,1), tooltip="Vazio = ~/Downloads"),
+         sg.FolderBrowse("Procurar", target='-PASTA_SAIDA-')],
+        [sg.Checkbox("Manter cache de consultas entre sessões", key='-CACHE_PERSISTENTE-', default=os.path.exists(ARQUIVO_CACHE_SESSAO),
+                     tooltip=f"Extrações MapBiomas/solo/INMET repetidas vêm do cache ({ARQUIVO_CACHE_SESSAO})")],
+        [sg.Checkbox("Salvar métricas das ações interativas (JSONL)", key='-METRICAS_INTERATIVAS-', default=False,
+                     tooltip="Grava century_metricas_interativo.jsonl na Pasta SAÍDA a cada ação")],
+        [sg.Text("Template .100:", size=(12,1)),
+         sg.Input(key='-LOTE_TEMPLATE-', size=(16,1), tooltip="Opcional: gera o site.100 de cada ponto"),
+         sg.FileBrowse("Procurar", target='-LOTE_TEMPLATE-', file_types=(("Template Files", "*.100"),))],
+        [sg.Checkbox("Streaming (CSV grande), bloco:", key='-LOTE_STREAMING-', default=False),
+         sg.Input("5000", key='-LOTE_TAMANHO_BLOCO-', size=(7,1))],
+        [sg.Text("⚠️ Apenas pontos na mesma fazenda.", font=('Helvetica', 10, 'bold'), text_color='orange')],
+        [sg.Button("EXECUTAR LOTE", key='-LOTE_EXECUTE-', size=(30, 2), button_color=('white', 'darkorange'))],
+        [sg.Button("GERAR .SCH EM LOTE", key='-LOTE_SCH-', size=(30, 1), button_color=('white', '#8A2BE2'),
+                   tooltip="Um .SCH por ponto com os blocos 1 e 2 e os parâmetros LULC da aba de agendamento")],
+        [sg.Text("Grade (.json):", size=(12,1)),
+         sg.Input(key='-LOTE_GRADE-', size=(16,1), tooltip='Ex: {"clima": ["M", "S", "F", "C"], "ano_limite": [2010, 2015]}'),
+         sg.FileBrowse("Procurar", target='-LOTE_GRADE-', file_types=(("JSON Files", "*.json"),))],
+        [sg.Button("GERAR VARIANTES .SCH", key='-LOTE_SCH_VARREDURA-', size=(30, 1), button_color=('white', '#8A2BE2'),
+                   tooltip="Um .SCH por ponto e por combinação de parâmetros da grade, em subpastas por variante")]
+    ]
+
+    layout_col_2 = [
+        [sg.Frame("LOTE: Extração de Dados (LULC, Solo, Clima)", col_lote, key='-F_LOTE_PROCESS-')]
+    ]
+
+    col_bloco_manual_layout = [
+        [sg.Text("Block #:", size=(12,1)), sg.Input("3", size=(5,1), key='-B_NUM-')],
+        [sg.Text("Last Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_LAST_YEAR-')],
+        [sg.Text("Repeats #:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_REPEATS-')],
+        [sg.Text("Output Start Year:", size=(12,1)), sg.Input(size=(10,1), key='-B_OUT_YEAR-')],
+        [sg.Text("Output Month:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_MONTH-')],
+        [sg.Text("Output Interval:", size=(12,1)), sg.Input("1", size=(5,1), key='-B_OUT_INTERVAL-')],
+        [sg.Text("Weather:", size=(12,1)), 
+         sg.Combo(WEATHER_CHOICES, default_value=DEFAULT_WEATHER_M, key='-B_WEATHER_COMBO-', readonly=True, size=(30, 1))],
+        [sg.Button("Adicionar Cabeçalho de Bloco Manual")]
+    ]
+
+    col_evento_layout = [
+        [sg.Text("Tipo de Evento:", size=(15,1)), 
+         sg.Combo(ALL_EVENT_DESCRIPTIONS, key='-E_TIPO-', size=(20,1), readonly=True, enable_events=True)],
+        [sg.Text("Código Específico:", size=(15,1), key='-E_CODIGO_TXT-', visible=False), 
+         sg.Combo([], key='-E_CODIGO_COMBO-', size=(35,1), readonly=True, visible=False)],
+        [sg.Text("Ano (1, 2, ...):", size=(15,1)), sg.Input(size=(5,1), key='-E_BLOCK_NUM-')],
+        [sg.Text("Mês (1-12):", size=(15,1)), sg.Input(size=(5,1), key='-E_MES-')],
+        [sg.Button("Adicionar Evento Manual"), sg.Button("Fechar Bloco (-999)", key="Adicionar Terminador de Bloco (-999)", button_color=('white', 'firebrick'))],
+        [sg.Button("Gerar Arquivo .SCH", size=(15,2)), sg.Button("Sair", size=(10,2))]
+    ]
+
+    layout_col_3 = [
+        [sg.Frame("Parâmetros Globais", col_globais, key='-F_GLOBAIS-')],
+        [sg.Frame("Bloco 1: Padrão Savana", col_bloco_padrao, key='-F_PADRAO-')],
+        [sg.Frame("Bloco 2: Desmatamento + Pastagem Trad", col_bloco_desmatamento, key='-F_DESMATAMENTO-')],
+        [sg.Frame("Bloco X: Gerador Automático (MapBiomas)", col_mapbiomas_automatico, key='-F_LULC_AUTO-')],
+        [sg.Frame("Construtor de Bloco (Manual)", col_bloco_manual_layout, key='-F_MANUAL-')],
+        [sg.Frame("Construtor de Eventos (Manual)", col_evento_layout, key='-F_EVENTO-')]
+    ]
+
+    layout_col_4 = [
+        [sg.Column(coluna_timeline)]
+    ]
+
+    layout = [
+        [
+            sg.Column(layout_col_1, vertical_alignment='top'),
+            sg.VSeperator(),
+            sg.Column(layout_col_2, vertical_alignment='top'),
+            sg.VSeperator(),
+            sg.Column(layout_col_3, vertical_alignment='top'),
+            sg.VSeperator(),
+            sg.Column(layout_col_4, vertical_alignment='top')
+        ],
+        [
+            sg.Text("Nenhuma tarefa em andamento.", key='-TAREFA_STATUS-', size=(70, 1)),
+            sg.ProgressBar(100, orientation='h', size=(40, 15), key='-TAREFA_BARRA-'),
+            sg.Button("Cancelar Tarefa", key='-TAREFA_CANCELAR-', disabled=True, button_color=('white', 'firebrick'))
+        ]
+    ]
+
+    window = sg.Window("Construtor de Arquivos de Entrada CENTURY v28", layout, finalize=True)
+    timeline_data = LinhaDoTempo()
+    global_keys = ['-SITIO-', '-SITE_FILE-', '-ANO_INICIO-', '-ANO_FIM-', '-INIT_CROP-', '-INIT_TREE-']
+    need_preview_update = True
+    proximo_bloco_sugerido = None
+    # Tarefa longa em segundo plano (uma por vez) e os eventos que não podem rodar em paralelo com ela
+    tarefa_atual = None
+    prefetch = PrefetchCoordenadas()
+    manter_cache = os.path.exists(ARQUIVO_CACHE_SESSAO)
+    if manter_cache:
+        for cache, caminho in CACHES_PERSISTENTES:
+            cache.carregar(caminho)
+    EVENTOS_TAREFA_LONGA = ['-LOTE_EXECUTE-', '-INMET_PROCESS-', '-INMET_WTH_CSV-', '-INMET_WTH_FILE-', '-GENERATE_LULC_BLOCKS-',
+                            '-LOTE_SCH-', '-LOTE_SCH_VARREDURA-', '-MB_EXTRACT-', '-SOLO_EXTRACT-', '-SITE_100_CREATE-', '-SITE_100_LOTE-']
+
+    if not LIBS_INSTALADAS:
+        sg.popup_error("Erro de Dependência: 'rasterio' e/ou 'pandas' não encontrados.\n\nAs funcionalidades de extração de dados estão desabilitadas.\n\nPor favor, feche o app e instale com:\npip install rasterio pandas")
+        window['-MB_EXTRACT-'].update(disabled=True)
+        window['-MB_FOLDER-'].update(disabled=True)
+        window['-SOLO_EXTRACT-'].update(disabled=True)
+        window['-SOLO_FOLDER-'].update(disabled=True)
         window['-INMET_PROCESS-'].update(disabled=True)
         window['-INMET_FOLDER-'].update(disabled=True)
         window['-INMET_WTH_CSV-'].update(disabled=True)
         window['-INMET_WTH_FILE-'].update(disabled=True)
         window['-SITE_100_CREATE-'].update(disabled=True)
         window['-LOTE_EXECUTE-'].update(disabled=True)
+        window['-LOTE_CSV-'].update(disabled=True)
+        window['-LOTE_MB_FOLDER-'].update(disabled=True)
+        window['-LOTE_SOLO_FOLDER-'].update(disabled=True)
+        window['-LOTE_INMET_FOLDER-'].update(disabled=True)
         window['-GENERATE_LULC_BLOCKS-'].update(disabled=True)
         window['-MB_CSV_FILE-'].update(disabled=True)
-        
-while True:
-    event, values = window.read()
 
-    if need_preview_update:
-        update_full_preview(window, values, timeline_data)
-        need_preview_update = False
+    while True:
+        event, values = window.read()
+
+        if need_preview_update:
+            update_full_preview(window, values, timeline_data)
+            need_preview_update = False
+            # Sugere o próximo número de bloco livre quando a linha do tempo já tem blocos
+            proximo_bloco = timeline_data.proximo_bloco()
+            if proximo_bloco > 1 and proximo_bloco != proximo_bloco_sugerido:
+                window['-B_NUM-'].update(str(proximo_bloco))
+                window['-MB_START_BLOCK_NUM-'].update(str(proximo_bloco))
+                proximo_bloco_sugerido = proximo_bloco
+
+        if values:
+            manter_cache = values.get('-CACHE_PERSISTENTE-', manter_cache)
+
+        if event == sg.WIN_CLOSED or event == "Sair":
+            if tarefa_atual:
+                tarefa_atual['cancelar'].set()
+            prefetch.cancelar()
+            break
 
-    if event == sg.WIN_CLOSED or event == "Sair":
-        break
+        definir_pasta_saida(values.get('-PASTA_SAIDA-'))
+        definir_metricas_interativas(values.get('-METRICAS_INTERATIVAS-'))
+
+        if event in ('-MB_LAT-', '-MB_LON-'):
+            # Coordenadas mudaram: descarta o pré-carregamento anterior e agenda outro (com atraso) se forem válidas
+            if tarefa_atual:
+                prefetch.cancelar()
+            elif LIBS_INSTALADAS:
+                try:
+                    cobertura = cobertura_exigida(values)
+                except ValueError:
+                    cobertura = None
+                prefetch.agendar(values['-MB_LAT-'], values['-MB_LON-'], values['-MB_FOLDER-'], values['-SOLO_FOLDER-'], values['-SOLO_PROF-'],
+                                 values['-INMET_FOLDER-'], values['-INMET_NUM_ESTACOES-'], cobertura)
+
+        if event in EVENTOS_TAREFA_LONGA and tarefa_atual:
+            sg.popup_error(f"Aguarde a tarefa em andamento ('{tarefa_atual['nome']}') terminar ou cancele-a.")
+            continue
 
-    if event == '-P_LAST_YEAR-':
-        try:
-            last_year_str = values[event]
-            if last_year_str:
-                next_year = int(last_year_str) + 1
-                window['-D_OUT_YEAR-'].update(str(next_year)) # Linka Bloco 1 Last Year ao Bloco 2 Output Year
-                window['-B_OUT_YEAR-'].update(str(next_year))
-        except ValueError:
-            pass
-            
-    if event == '-D_LAST_YEAR-':
-        try:
-            last_year_str = values[event]
-            if last_year_str:
-                next_year = int(last_year_str) + 1
-                window['-B_OUT_YEAR-'].update(str(next_year)) # Linka Bloco 2 Last Year ao Bloco Manual Output Year
-        except ValueError:
-            pass
+        if event == '-TAREFA_PROGRESSO-' and tarefa_atual:
+            feitos, total, rotulo = values[event]
+            window['-TAREFA_BARRA-'].update(current_count=int(feitos), max=max(total, 1))
+            window['-TAREFA_STATUS-'].update(texto_progresso_tarefa(tarefa_atual, feitos, total, rotulo))
 
-    if event in global_keys:
-        need_preview_update = True
+        if event == '-TAREFA_CANCELAR-' and tarefa_atual:
+            tarefa_atual['cancelar'].set()
+            window['-TAREFA_CANCELAR-'].update(disabled=True)
+            window['-TAREFA_STATUS-'].update(f"{tarefa_atual['nome']}: cancelando no próximo ponto...")
 
-    if event == '-E_TIPO-':
-        # Ao selecionar uma DESCRIÇÃO, precisamos encontrar o CÓDIGO (ex: 'CROP')
-        descricao_selecionada = values['-E_TIPO-']
-        # Remove o código curto da descrição (ex: 'CROP: Seleciona cultura' -> 'CROP')
-        tipo_selecionado = EVENT_DESC_TO_CODE.get(descricao_selecionada) 
-        
-        if tipo_selecionado in CODIGOS_E_DESCRICOES:
-            codigos_dict = CODIGOS_E_DESCRICOES.get(tipo_selecionado, {})
-            DISPLAY_PARA_CODIGO.clear()
-            lista_display = []
-            for codigo, descricao in codigos_dict.items():
-                display_text = f"{codigo} - {descricao}"
-                lista_display.append(display_text)
-                DISPLAY_PARA_CODIGO[display_text] = codigo
-            
-            if lista_display:
-                window['-E_CODIGO_COMBO-'].update(values=lista_display, value=lista_display[0], visible=True)
+        if event == '-TAREFA_FIM-' and tarefa_atual:
+            tarefa, tarefa_atual = tarefa_atual, None
+            result = values[event]
+            situacao = "cancelada" if tarefa['cancelar'].is_set() else "concluída"
+            window['-TAREFA_STATUS-'].update(f"{tarefa['nome']}: {situacao} em {formatar_duracao(time.perf_counter() - tarefa['inicio'])}.")
+            window['-TAREFA_BARRA-'].update(current_count=0)
+            window['-TAREFA_CANCELAR-'].update(disabled=True)
+
+            if tarefa['nome'] == 'Lote':
+                log_message = result if isinstance(result, str) else result['message']
+                sg.popup_scrolled(log_message, title="Resultado do Processamento em Lote", size=(80, 20))
+
+            elif tarefa['nome'] == 'SCH Lote':
+                sg.popup_scrolled(result['message'], title="Resultado da Geração de .SCH em Lote", size=(80, 20))
+
+            elif tarefa['nome'] == 'SCH Varredura':
+                sg.popup_scrolled(result['message'], title="Resultado da Varredura de Cenários .SCH", size=(80, 20))
+
+            elif tarefa['nome'] == 'Clima Média':
+                sg.popup(result['message'], title="Resultado do Processamento INMET")
+
+            elif tarefa['nome'] in ('Clima .WTH', 'Clima CSV Anual'):
+                sg.popup(result['message'], title=f"Resultado da Geração de Arquivo {tarefa['tipo_arquivo']}")
+
+            elif tarefa['nome'] == 'Blocos LULC':
+                if result['status'] == 'erro':
+                    sg.popup_error(result['message'], title="Erro de Geração LULC")
+
+                elif result['status'] == 'aviso':
+                    sg.popup_ok(result['message'], title="Aviso de Geração LULC")
+
+                elif result['status'] == 'ok':
+                    # Adiciona os novos blocos ao final da lista
+                    new_blocks = result['blocks']
+                    timeline_data.estender(new_blocks)
+                    timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+                    need_preview_update = True
+                    sg.popup_ok(f"Sucesso! {len(new_blocks)//2} Bloco(s) de LULC gerado(s) e adicionado(s) à linha do tempo.", title="Geração LULC Concluída")
+
+        if event == '-P_LAST_YEAR-':
+            try:
+                last_year_str = values[event]
+                if last_year_str:
+                    next_year = int(last_year_str) + 1
+                    window['-D_OUT_YEAR-'].update(str(next_year)) # Linka Bloco 1 Last Year ao Bloco 2 Output Year
+                    window['-B_OUT_YEAR-'].update(str(next_year))
+            except ValueError:
+                pass
+
+        if event == '-D_LAST_YEAR-':
+            try:
+                last_year_str = values[event]
+                if last_year_str:
+                    next_year = int(last_year_str) + 1
+                    window['-B_OUT_YEAR-'].update(str(next_year)) # Linka Bloco 2 Last Year ao Bloco Manual Output Year
+            except ValueError:
+                pass
+
+        if event in global_keys:
+            need_preview_update = True
+
+        if event == '-E_TIPO-':
+            # Ao selecionar uma DESCRIÇÃO, precisamos encontrar o CÓDIGO (ex: 'CROP')
+            descricao_selecionada = values['-E_TIPO-']
+            # Remove o código curto da descrição (ex: 'CROP: Seleciona cultura' -> 'CROP')
+            tipo_selecionado = EVENT_DESC_TO_CODE.get(descricao_selecionada) 
+
+            if tipo_selecionado in CODIGOS_E_DESCRICOES:
+                codigos_dict = CODIGOS_E_DESCRICOES.get(tipo_selecionado, {})
+                DISPLAY_PARA_CODIGO.clear()
+                lista_display = []
+                for codigo, descricao in codigos_dict.items():
+                    display_text = f"{codigo} - {descricao}"
+                    lista_display.append(display_text)
+                    DISPLAY_PARA_CODIGO[display_text] = codigo
+
+                if lista_display:
+                    window['-E_CODIGO_COMBO-'].update(values=lista_display, value=lista_display[0], visible=True)
+                else:
+                    window['-E_CODIGO_COMBO-'].update(values=[], value='', visible=True)
+
+                window['-E_CODIGO_TXT-'].update(visible=True)
             else:
-                window['-E_CODIGO_COMBO-'].update(values=[], value='', visible=True)
+                window['-E_CODIGO_COMBO-'].update(values=[], visible=False)
+                window['-E_CODIGO_TXT-'].update(visible=False)
 
-            window['-E_CODIGO_TXT-'].update(visible=True)
-        else:
-            window['-E_CODIGO_COMBO-'].update(values=[], visible=False)
-            window['-E_CODIGO_TXT-'].update(visible=False)
-            
-    if event == '-MB_EXTRACT-':
-        folder = values['-MB_FOLDER-']
-        lat = values['-MB_LAT-']
-        lon = values['-MB_LON-']
-        nome_sitio = values['-SITIO-']
-        
-        if not all([folder, lat, lon]):
-            sg.popup_error("Por favor, preencha a Latitude, Longitude e selecione a Pasta de Rasters.")
-            continue
-        if not nome_sitio:
-             sg.popup_error("Por favor, preencha o 'Nome do Sítio' primeiro.", "Ele será usado no nome do arquivo CSV.")
-             continue
-        
-        sg.popup_no_buttons("Processando MapBiomas... Isso pode levar alguns segundos.", auto_close=True, auto_close_duration=1, non_blocking=True)
-        
-        result = extrair_dados_mapbiomas(folder, lat, lon, nome_sitio)
-
-        if result['status'] == 'ok':
-            df = result['data']
-            downloads_path = str(Path.home() / "Downloads")
-            nome_arquivo_csv = f"{nome_sitio}_mapbiomas_extracao.csv"
-            output_csv = os.path.join(downloads_path, nome_arquivo_csv)
-            df.to_csv(output_csv, index=False)
-            message = f"Sucesso! {len(df)} anos extraídos.\n\nArquivo salvo em:\n{output_csv}"
-            window['-MB_CSV_FILE-'].update(output_csv)
-        elif result['status'] == 'aviso':
-             message = result['message']
-        else:
-            message = result['message']
+        if event == '-MB_EXTRACT-':
+            folder = values['-MB_FOLDER-']
+            lat = values['-MB_LAT-']
+            lon = values['-MB_LON-']
+            nome_sitio = values['-SITIO-']
 
-        sg.popup(message, title="Resultado da Extração MapBiomas")
+            if not all([folder, lat, lon]):
+                sg.popup_error("Por favor, preencha a Latitude, Longitude e selecione a Pasta de Rasters.")
+                continue
+            if not nome_sitio:
+                 sg.popup_error("Por favor, preencha o 'Nome do Sítio' primeiro.", "Ele será usado no nome do arquivo CSV.")
+                 continue
+
+            sg.popup_no_buttons("Processando MapBiomas... Isso pode levar alguns segundos.", auto_close=True, auto_close_duration=1, non_blocking=True)
+
+            iniciar_metricas("interativo_mapbiomas")
+            with medir_etapa('lulc', nome_sitio):
+                result = prefetch.mapbiomas(folder, lat, lon, nome_sitio)
+
+            if result['status'] == 'ok':
+                df = result['data']
+                downloads_path = obter_pasta_saida()
+                nome_arquivo_csv = f"{nome_sitio}_mapbiomas_extracao.csv"
+                output_csv = os.path.join(downloads_path, nome_arquivo_csv)
+                salvar_csv(df, output_csv, ponto=nome_sitio, index=False)
+                message = f"Sucesso! {len(df)} anos extraídos.\n\nArquivo salvo em:\n{output_csv}"
+                if result.get('substituidos'):
+                    message += f"\n\nAviso - pixel vizinho usado ({texto_substituicoes(result['substituidos'])})"
+                window['-MB_CSV_FILE-'].update(output_csv)
+            elif result['status'] == 'aviso':
+                 message = result['message']
+            else:
+                message = result['message']
 
+            message += finalizar_metricas_interativas()
+            sg.popup(message, title="Resultado da Extração MapBiomas")
 
-    if event == '-SOLO_EXTRACT-':
-        folder = values['-SOLO_FOLDER-']
-        prof = values['-SOLO_PROF-']
-        lat = values['-MB_LAT-']
-        lon = values['-MB_LON-']
-        nome_sitio = values['-SITIO-']
 
-        if not all([folder, lat, lon]):
-            sg.popup_error("Por favor, preencha a Latitude, Longitude e selecione a Pasta Origem (Solo).")
-            continue
-        if not nome_sitio:
-             sg.popup_error("Por favor, preencha o 'Nome do Sítio' primeiro.", "Ele será usado no nome do arquivo CSV.")
-             continue
+        if event == '-SOLO_EXTRACT-':
+            folder = values['-SOLO_FOLDER-']
+            prof = values['-SOLO_PROF-']
+            lat = values['-MB_LAT-']
+            lon = values['-MB_LON-']
+            nome_sitio = values['-SITIO-']
 
-        sg.popup_no_buttons("Processando Solo... Isso pode levar alguns segundos.", auto_close=True, auto_close_duration=1, non_blocking=True)
-        
-        result = extrair_dados_solo(folder, prof, lat, lon, nome_sitio)
-        
-        if result['status'] == 'ok':
-            df = result['data']
-            downloads_path = str(Path.home() / "Downloads")
-            nome_arquivo_csv = f"{nome_sitio}_solo_extracao_{prof.replace('-', '')}.csv"
-            output_csv = os.path.join(downloads_path, nome_arquivo_csv)
-            df.to_csv(output_csv, index=False, float_format='%.6f')
-            message = f"Sucesso! Dados de solo extraídos.\n\nArquivo salvo em:\n{output_csv}"
-        else:
-            message = result['message']
+            if not all([folder, lat, lon]):
+                sg.popup_error("Por favor, preencha a Latitude, Longitude e selecione a Pasta Origem (Solo).")
+                continue
+            if not nome_sitio:
+                 sg.popup_error("Por favor, preencha o 'Nome do Sítio' primeiro.", "Ele será usado no nome do arquivo CSV.")
+                 continue
+
+            sg.popup_no_buttons("Processando Solo... Isso pode levar alguns segundos.", auto_close=True, auto_close_duration=1, non_blocking=True)
+
+            iniciar_metricas("interativo_solo")
+            with medir_etapa('solo', nome_sitio):
+                result = prefetch.solo(folder, prof, lat, lon, nome_sitio)
+
+            if result['status'] == 'ok':
+                df = result['data']
+                downloads_path = obter_pasta_saida()
+                nome_arquivo_csv = f"{nome_sitio}_solo_extracao_{rotulo_profundidades(prof)}.csv"
+                output_csv = os.path.join(downloads_path, nome_arquivo_csv)
+                salvar_csv(df, output_csv, ponto=nome_sitio, index=False, float_format='%.6f')
+                message = f"Sucesso! Dados de solo extraídos.\n\nArquivo salvo em:\n{output_csv}"
+                if result.get('substituidos'):
+                    message += f"\n\nAviso - pixel vizinho usado ({texto_substituicoes(result['substituidos'])})"
+            else:
+                message = result['message']
 
-        sg.popup(message, title="Resultado da Extração de Solo")
+            message += finalizar_metricas_interativas()
+            sg.popup(message, title="Resultado da Extração de Solo")
 
-    if event == '-INMET_PROCESS-':
-        folder = values['-INMET_FOLDER-']
-        lat = values['-MB_LAT-']
-        lon = values['-MB_LON-']
-        nome_sitio = values['-SITIO-']
-        num_estacoes = int(values['-INMET_NUM_ESTACOES-'])
+        if event == '-INMET_PROCESS-':
+            folder = values['-INMET_FOLDER-']
+            lat = values['-MB_LAT-']
+            lon = values['-MB_LON-']
+            nome_sitio = values['-SITIO-']
+            num_estacoes = int(values['-INMET_NUM_ESTACOES-'])
 
-        if not all([folder, lat, lon]):
-            sg.popup_error("Por favor, preencha a Latitude, Longitude e selecione a Pasta Estações INMET.")
-            continue
-        if not nome_sitio:
-             sg.popup_error("Por favor, preencha o 'Nome do Sítio' primeiro.", "Ele será usado no nome do arquivo CSV.")
-             continue
-        
-        resultado_busca = encontrar_estacoes_proximas(folder, lat, lon, num_estacoes, is_batch=False)
-        
-        if resultado_busca['status'] == 'erro':
-            sg.popup_error(resultado_busca['message'])
-            continue
+            if not all([folder, lat, lon]):
+                sg.popup_error("Por favor, preencha a Latitude, Longitude e selecione a Pasta Estações INMET.")
+                continue
+            if not nome_sitio:
+                 sg.popup_error("Por favor, preencha o 'Nome do Sítio' primeiro.", "Ele será usado no nome do arquivo CSV.")
+                 continue
+            try:
+                cobertura = cobertura_exigida(values)
+            except ValueError as e:
+                sg.popup_error(str(e))
+                continue
 
-        resposta = sg.popup_yes_no(resultado_busca['popup_message'], title="Estações Encontradas")
-        
-        if resposta == 'Yes':
-            window.disable()
-            sg.popup_quick_message("Processando Média Clima INMET... Por favor aguarde.", non_blocking=True, background_color='gray', text_color='white')
-            window.refresh()
-            
-            result = processar_medias_estacoes(resultado_busca['top_estacoes'], nome_sitio, is_batch=False)
-            
-            window.enable()
-            sg.popup(result['message'], title="Resultado do Processamento INMET")
-        else:
-            sg.popup("Processamento INMET cancelado pelo usuário.", title="Cancelado")
-
-    if event == '-INMET_WTH_CSV-' or event == '-INMET_WTH_FILE-':
-        folder = values['-INMET_FOLDER-']
-        lat = values['-MB_LAT-']
-        lon = values['-MB_LON-']
-        nome_sitio = values['-SITIO-']
-        num_estacoes = int(values['-INMET_NUM_ESTACOES-'])
-        is_wth_file = (event == '-INMET_WTH_FILE-')
-        file_type = ".WTH" if is_wth_file else "CSV Anual"
-        
-        if not all([folder, lat, lon, nome_sitio]):
-            sg.popup_error(f"Por favor, preencha todos os campos necessários para gerar o arquivo {file_type}.")
-            continue
-        
-        resultado_busca = encontrar_estacoes_proximas(folder, lat, lon, num_estacoes, is_batch=False)
-        
-        if resultado_busca['status'] == 'erro':
-            sg.popup_error(resultado_busca['message'])
-            continue
+            iniciar_metricas("interativo_inmet_busca")
+            with medir_etapa('busca_estacoes', nome_sitio):
+                resultado_busca = prefetch.estacoes(folder, lat, lon, num_estacoes, cobertura)
+            finalizar_metricas_interativas()
 
-        resposta = sg.popup_yes_no(resultado_busca['popup_message'], title=f"Estações Encontradas para {file_type}")
-        
-        if resposta == 'Yes':
-            window.disable()
-            sg.popup_quick_message(f"Processando Arquivo {file_type}... Por favor aguarde.", non_blocking=True, background_color='gray', text_color='white')
-            window.refresh()
-            
-            if is_wth_file:
-                result = gerar_arquivo_wth(resultado_busca['top_estacoes'], nome_sitio, is_batch=False)
+            if resultado_busca['status'] == 'erro':
+                sg.popup_error(resultado_busca['message'])
+                continue
+
+            resposta = sg.popup_yes_no(resultado_busca['popup_message'], title="Estações Encontradas")
+
+            if resposta == 'Yes':
+                prefetch.cancelar()
+                tarefa_atual = executar_tarefa_em_segundo_plano(window, 'Clima Média', clima_interativo, 'media', resultado_busca['top_estacoes'], nome_sitio, controle=False)
+                window['-TAREFA_STATUS-'].update("Clima Média: processando estações...")
             else:
-                result = gerar_csv_clima_anual(resultado_busca['top_estacoes'], nome_sitio, is_batch=False)
-            
-            window.enable()
-            sg.popup(result['message'], title=f"Resultado da Geração de Arquivo {file_type}")
-        else:
-            sg.popup(f"Geração de Arquivo {file_type} cancelada pelo usuário.", title="Cancelado")
+                sg.popup("Processamento INMET cancelado pelo usuário.", title="Cancelado")
+
+        if event == '-INMET_WTH_CSV-' or event == '-INMET_WTH_FILE-':
+            folder = values['-INMET_FOLDER-']
+            lat = values['-MB_LAT-']
+            lon = values['-MB_LON-']
+            nome_sitio = values['-SITIO-']
+            num_estacoes = int(values['-INMET_NUM_ESTACOES-'])
+            is_wth_file = (event == '-INMET_WTH_FILE-')
+            file_type = ".WTH" if is_wth_file else "CSV Anual"
+
+            if not all([folder, lat, lon, nome_sitio]):
+                sg.popup_error(f"Por favor, preencha todos os campos necessários para gerar o arquivo {file_type}.")
+                continue
+            try:
+                cobertura = cobertura_exigida(values)
+            except ValueError as e:
+                sg.popup_error(str(e))
+                continue
 
+            iniciar_metricas("interativo_inmet_busca")
+            with medir_etapa('busca_estacoes', nome_sitio):
+                resultado_busca = prefetch.estacoes(folder, lat, lon, num_estacoes, cobertura)
+            finalizar_metricas_interativas()
 
-    if event == '-SITE_100_CREATE-':
-        solo_file = values['-SITE_SOLO_FILE-']
-        clima_file = values['-SITE_CLIMA_FILE-']
-        template_file = values['-SITE_TEMPLATE_FILE-']
-        nome_sitio = values['-SITIO-']
-        lat = values['-MB_LAT-']
-        lon = values['-MB_LON-']
+            if resultado_busca['status'] == 'erro':
+                sg.popup_error(resultado_busca['message'])
+                continue
 
-        if not all([solo_file, clima_file, template_file, nome_sitio, lat, lon]):
-            sg.popup_error("Por favor, preencha todos os campos obrigatórios (Arquivos de Solo/Clima/Template, Nome do Sítio, Lat/Lon).")
-            continue
-        
-        sg.popup_no_buttons("Processando SITE.100...", auto_close=True, auto_close_duration=1, non_blocking=True)
-        message = gerar_site_100(solo_file, clima_file, template_file, nome_sitio, lat, lon)
-        sg.popup(message, title="Resultado da Geração de Site.100")
-
-    if event == '-LOTE_EXECUTE-':
-        csv_pontos_path = values['-LOTE_CSV-']
-        mb_folder = values['-LOTE_MB_FOLDER-']
-        solo_folder = values['-LOTE_SOLO_FOLDER-']
-        solo_prof = values['-LOTE_SOLO_PROF-']
-        inmet_folder = values['-LOTE_INMET_FOLDER-']
-        inmet_n_estacoes = int(values['-LOTE_INMET_NUM_ESTACOES-'])
-        inmet_mode = values['-LOTE_INMET_MODE-']
-
-        if not all([csv_pontos_path, mb_folder, solo_folder, inmet_folder]):
-            sg.popup_error("Preencha todos os caminhos de arquivo/pasta na seção 'LOTE' para executar.")
-            continue
-        
-        window.disable()
-        sg.popup_quick_message("EXECUTANDO LOTE... Isso pode levar vários minutos.", background_color='darkorange', text_color='white', non_blocking=True)
-        window.refresh()
-        
-        log_message = processar_lote_dados(csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder, inmet_n_estacoes, inmet_mode)
+            resposta = sg.popup_yes_no(resultado_busca['popup_message'], title=f"Estações Encontradas para {file_type}")
 
-        window.enable()
-        sg.popup_scrolled(log_message, title="Resultado do Processamento em Lote", size=(80, 20))
+            if resposta == 'Yes':
+                prefetch.cancelar()
+                tarefa_atual = executar_tarefa_em_segundo_plano(window, f"Clima {file_type}", clima_interativo, 'wth' if is_wth_file else 'anual',
+                                                                resultado_busca['top_estacoes'], nome_sitio, controle=False)
+                tarefa_atual['tipo_arquivo'] = file_type
+                window['-TAREFA_STATUS-'].update(f"Clima {file_type}: processando estações...")
+            else:
+                sg.popup(f"Geração de Arquivo {file_type} cancelada pelo usuário.", title="Cancelado")
 
-    if event == '-GENERATE_LULC_BLOCKS-':
-        mb_csv_file = values['-MB_CSV_FILE-']
-        start_block = values['-MB_START_BLOCK_NUM-']
-        year_limit = values['-MB_YEAR_LIMIT-']
-        
-        if not mb_csv_file or not os.path.exists(mb_csv_file):
-            sg.popup_error("Por favor, selecione um arquivo CSV de MapBiomas existente.")
-            continue
-            
-        window.disable()
-        sg.popup_quick_message("Gerando Blocos LULC. Aguarde...", non_blocking=True, background_color='#8A2BE2', text_color='white')
-        window.refresh()
-        
-        result = processar_mapbiomas_em_blocos(mb_csv_file, start_block, year_limit, timeline_data, values)
-        
-        window.enable()
 
-        if result['status'] == 'erro':
-            sg.popup_error(result['message'], title="Erro de Geração LULC")
-            
-        elif result['status'] == 'aviso':
-            sg.popup_ok(result['message'], title="Aviso de Geração LULC")
-            
-        elif result['status'] == 'ok':
-            # Adiciona os novos blocos ao final da lista
-            new_blocks = result['blocks']
-            timeline_data.extend(new_blocks)
-            window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
-            need_preview_update = True
-            sg.popup_ok(f"Sucesso! {len(new_blocks)//2} Bloco(s) de LULC gerado(s) e adicionado(s) à linha do tempo.", title="Geração LULC Concluída")
+        if event == '-SITE_100_CREATE-':
+            solo_file = values['-SITE_SOLO_FILE-']
+            clima_file = values['-SITE_CLIMA_FILE-']
+            template_file = values['-SITE_TEMPLATE_FILE-']
+            nome_sitio = values['-SITIO-']
+            lat = values['-MB_LAT-']
+            lon = values['-MB_LON-']
 
+            if not all([solo_file, clima_file, template_file, nome_sitio, lat, lon]):
+                sg.popup_error("Por favor, preencha todos os campos obrigatórios (Arquivos de Solo/Clima/Template, Nome do Sítio, Lat/Lon).")
+                continue
 
-    if event == "-ADD_BLOCO_CERRADO-":
-        last_year = values['-P_LAST_YEAR-']
-        out_year = values['-P_OUT_YEAR-']
-        weather_desc = values['-P_WEATHER_COMBO-']
-        
-        try:
-            last_year_int = int(last_year)
-            out_year_int = int(out_year)
-        except ValueError:
-            sg.popup_error("Por favor, insira anos válidos (números inteiros) para o Bloco Padrão.")
-            continue
-            
-        header_padrao = {
-            'tipo': 'HEADER', 'num': '1', 'last_year': last_year, 'repeats': '5',
-            'out_year': out_year, 'out_month': '1', 'out_interval': '1', 'weather': weather_desc,
-            'block_description': f"Padrão Savana ({out_year_int}-{last_year_int})"
-        }
-        bloco_completo = {
-            'tipo': 'BLOCO_COMPLETO',
-            'header': header_padrao,
-            'events': BLOCO_PADRAO_SAVANA_EVENTS
-        }
-        linha_display = f"BLOCO 1: Padrão Savana (Até {last_year}, Clima: {WEATHER_DESC_TO_CODE.get(weather_desc, 'M')})"
-        timeline_data.append((linha_display, bloco_completo))
-        
-        terminator_data = {'tipo': 'TERMINATOR'}
-        linha_display_terminator = "--- FIM DO BLOCO (-999 -999 X) ---"
-        timeline_data.append((linha_display_terminator, terminator_data))
-        
-        window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
-        need_preview_update = True
+            sg.popup_no_buttons("Processando SITE.100...", auto_close=True, auto_close_duration=1, non_blocking=True)
+            iniciar_metricas("interativo_site100")
+            with medir_etapa('site100', nome_sitio):
+                message = gerar_site_100(solo_file, clima_file, template_file, nome_sitio, lat, lon)
+            message += finalizar_metricas_interativas()
+            sg.popup(message, title="Resultado da Geração de Site.100")
+
+        if event == '-SITE_100_LOTE-':
+            # Um site.100 para cada ponto presente nos CSVs de solo/clima (aceita vários arquivos separados por ';'),
+            # usando as coordenadas lat/long gravadas na tabela de solo
+            solo_file = values['-SITE_SOLO_FILE-']
+            clima_file = values['-SITE_CLIMA_FILE-']
+            template_file = values['-SITE_TEMPLATE_FILE-']
+
+            if not all([solo_file, clima_file, template_file]):
+                sg.popup_error("Por favor, selecione os arquivos de Solo, Clima e o Template site.100.")
+                continue
 
-    if event == '-ADD_BLOCO_DESMATAMENTO-':
-        last_year = values['-D_LAST_YEAR-']
-        out_year = values['-D_OUT_YEAR-']
-        weather_desc = values['-D_WEATHER_COMBO-']
-        
-        try:
-            last_year_int = int(last_year)
-            out_year_int = int(out_year)
-        except ValueError:
-            sg.popup_error("Por favor, insira anos válidos (números inteiros) para o Bloco de Desmatamento.")
-            continue
-            
-        header_bloco2 = {
-            'tipo': 'HEADER', 'num': '2', 'last_year': last_year, 'repeats': '2',
-            'out_year': out_year, 'out_month': '1', 'out_interval': '1', 'weather': weather_desc,
-            'block_description': f"Desmatamento + Pastagem Tradicional ({out_year_int}-{last_year_int})"
-        }
-        bloco_completo = {
-            'tipo': 'BLOCO_COMPLETO',
-            'header': header_bloco2,
-            'events': BLOCO_DESMATAMENTO_PASTAGEM_EVENTS
-        }
-        linha_display = f"BLOCO 2: Desmatamento/Pastagem (Até {last_year}, Clima: {WEATHER_DESC_TO_CODE.get(weather_desc, 'F')})"
-        timeline_data.append((linha_display, bloco_completo))
-        
-        terminator_data = {'tipo': 'TERMINATOR'}
-        linha_display_terminator = "--- FIM DO BLOCO (-999 -999 X) ---"
-        timeline_data.append((linha_display_terminator, terminator_data))
-        
-        window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
-        need_preview_update = True
+            iniciar_metricas("interativo_site100_lote")
+            result = gerar_site_100_lote(solo_file, clima_file, template_file)
+            sg.popup(result['message'] + finalizar_metricas_interativas(), title="Resultado da Geração de Site.100")
+
+        if event == '-LOTE_EXECUTE-':
+            csv_pontos_path = values['-LOTE_CSV-']
+            mb_folder = values['-LOTE_MB_FOLDER-']
+            solo_folder = values['-LOTE_SOLO_FOLDER-']
+            solo_prof = values['-LOTE_SOLO_PROF-']
+            inmet_folder = values['-LOTE_INMET_FOLDER-']
+            inmet_n_estacoes = int(values['-LOTE_INMET_NUM_ESTACOES-'])
+            inmet_mode = values['-LOTE_INMET_MODE-']
+            tamanho_bloco = None
+
+            if not all([csv_pontos_path, mb_folder, solo_folder, inmet_folder]):
+                sg.popup_error("Preencha todos os caminhos de arquivo/pasta na seção 'LOTE' para executar.")
+                continue
 
-    if event == "Adicionar Cabeçalho de Bloco Manual":
-        weather_desc = values['-B_WEATHER_COMBO-']
+            if values['-LOTE_STREAMING-']:
+                try:
+                    tamanho_bloco = int(values['-LOTE_TAMANHO_BLOCO-'])
+                    if tamanho_bloco <= 0:
+                        raise ValueError
+                except ValueError:
+                    sg.popup_error("O tamanho do bloco (streaming) deve ser um número inteiro positivo.")
+                    continue
 
-        try:
-            int(values['-B_NUM-'])
-            last_year = values['-B_LAST_YEAR-']
-            out_year = values['-B_OUT_YEAR-']
-            int(values['-B_REPEATS-'])
-            int(out_year)
-            int(values['-B_OUT_MONTH-'])
-            int(values['-B_OUT_INTERVAL-'])
-        except ValueError:
-            sg.popup_error("Todos os campos do Bloco Manual (exceto Weather) devem ser números inteiros válidos.")
-            continue
-            
-        bloco = {
-            'tipo': 'HEADER',
-            'num': values['-B_NUM-'], 'last_year': last_year,
-            'repeats': values['-B_REPEATS-'], 'out_year': out_year,
-            'out_month': values['-B_OUT_MONTH-'], 'out_interval': values['-B_OUT_INTERVAL-'],
-            'weather': weather_desc,
-            'block_description': f"Manual ({out_year}-{last_year})"
-        }
-        linha_display = f"BLOCO {bloco['num']} (Manual): LastYear={bloco['last_year']}, Clima: {WEATHER_DESC_TO_CODE.get(weather_desc, 'M')}"
-        timeline_data.append((linha_display, bloco))
-        window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
-        need_preview_update = True
-
-    if event == "Adicionar Evento Manual":
-        descricao_selecionada = values['-E_TIPO-']
-        # Obtém o código curto (ex: 'CROP')
-        tipo_evento_completo = EVENT_DESC_TO_CODE.get(descricao_selecionada) 
-        if tipo_evento_completo:
-            tipo_evento = tipo_evento_completo.split(':')[0]
-        else:
-             tipo_evento = None
+            # Roda em segundo plano: a janela continua respondendo, com progresso e cancelamento entre pontos.
+            # O pré-carregamento em andamento é descartado para não disputar E/S nem entrar nas métricas da tarefa.
+            prefetch.cancelar()
+            tarefa_atual = executar_tarefa_em_segundo_plano(window, 'Lote', processar_lote_dados, csv_pontos_path, mb_folder, solo_folder, solo_prof, inmet_folder,
+                                                            inmet_n_estacoes, inmet_mode, tamanho_bloco=tamanho_bloco, template_site100=values['-LOTE_TEMPLATE-'] or None)
+            window['-TAREFA_CANCELAR-'].update(disabled=False)
+            window['-TAREFA_STATUS-'].update("Lote: iniciando...")
 
-        if not tipo_evento:
-            sg.popup_error("Selecione um 'Tipo de Evento/Opção' válido primeiro.")
-            continue
-            
-        try:
-            int(values['-E_MES-'])
-            int(values['-E_BLOCK_NUM-'])
-        except ValueError:
-            sg.popup_error("O Mês e o Ano de Repetição devem ser números inteiros válidos.")
-            continue
-            
-        codigo_real = None
-        
-        if tipo_evento in CODIGOS_E_DESCRICOES:
-            display_selecionado = values['-E_CODIGO_COMBO-']
-            codigo_real = DISPLAY_PARA_CODIGO.get(display_selecionado)
-            # PLTM não tem código associado, IRRI/EROD não precisam de código específico, então relaxa a checagem para eles
-            if tipo_evento not in ['IRRI', 'EROD', 'PLTM'] and not codigo_real:
-                sg.popup_error(f"Erro: Nenhum Código Específico selecionado para '{tipo_evento}'.")
+        if event == '-LOTE_SCH-':
+            csv_pontos_path = values['-LOTE_CSV-']
+            mb_folder = values['-LOTE_MB_FOLDER-']
+
+            if not all([csv_pontos_path, mb_folder]):
+                sg.popup_error("Selecione o CSV de pontos e a Pasta LULC na seção 'LOTE'.")
                 continue
-            linha_display = f"      EVENTO: {tipo_evento} -> ({codigo_real}), Mês={values['-E_MES-']}, RepetirAno={values['-E_BLOCK_NUM-']}"
-        else:
-            linha_display = f"      EVENTO: {tipo_evento}, Mês={values['-E_MES-']}, RepetirAno={values['-E_BLOCK_NUM-']}"
 
-        evento = {
-            'tipo': 'EVENT', 'event_type': tipo_evento, 'code': codigo_real, 
-            'month': values['-E_MES-'], 'block_num': values['-E_BLOCK_NUM-']
-        }
-        timeline_data.append((linha_display, evento))
-        window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
-        need_preview_update = True
-
-    if event == "Adicionar Terminador de Bloco (-999)":
-        terminator_data = {'tipo': 'TERMINATOR'}
-        linha_display = "--- FIM DO BLOCO (-999 -999 X) ---"
-        timeline_data.append((linha_display, terminator_data))
-        window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
-        need_preview_update = True
-
-    if event == "Carregar Item Selecionado":
-        try:
-            selected_display = values['-TIMELINE-'][0]
-            selected_data = None
-            for display, data in timeline_data:
-                if display == selected_display:
-                    selected_data = data
-                    break
-            
-            if selected_data:
-                tipo = selected_data.get('tipo')
-                if tipo == 'HEADER':
-                    weather_desc = selected_data.get('weather', DEFAULT_WEATHER_M)
-                    window['-B_NUM-'].update(selected_data.get('num', ''))
-                    window['-B_LAST_YEAR-'].update(selected_data.get('last_year', ''))
-                    window['-B_REPEATS-'].update(selected_data.get('repeats', ''))
-                    window['-B_OUT_YEAR-'].update(selected_data.get('out_year', ''))
-                    window['-B_OUT_MONTH-'].update(selected_data.get('out_month', ''))
-                    window['-B_OUT_INTERVAL-'].update(selected_data.get('out_interval', ''))
-                    window['-B_WEATHER_COMBO-'].update(value=weather_desc)
-                
-                elif tipo == 'EVENT':
-                    event_type = selected_data.get('event_type', '')
-                    # Mapeia o código de volta para a descrição completa para preencher o combo
-                    event_desc = TIPOS_DE_EVENTO_COM_CODIGO.get(event_type) or TIPOS_DE_EVENTO_SEM_CODIGO.get(event_type)
-                    
-                    window['-E_TIPO-'].update(event_desc)
-                    # Força a atualização dos combos de código específico
-                    window.write_event_value('-E_TIPO-', event_desc)
-                    
-                    window['-E_MES-'].update(selected_data.get('month', ''))
-                    window['-E_BLOCK_NUM-'].update(selected_data.get('block_num', ''))
-
-                    if selected_data.get('code'):
-                        code = selected_data.get('code')
-                        codigos_dict = CODIGOS_E_DESCRICOES.get(event_type, {})
-                        desc = codigos_dict.get(code, '')
-                        display_text = f"{code} - {desc}"
-                        
-                        window.refresh()
-                        window['-E_CODIGO_COMBO-'].update(value=display_text)
-                
-                elif tipo == 'BLOCO_COMPLETO' or tipo == 'TERMINATOR':
-                    sg.popup_ok("Não é possível editar este tipo de item.\nRemova e adicione novamente, se necessário.", title="Aviso")
-        
-        except IndexError:
-            pass
-        except Exception as e:
-            print(f"Erro ao carregar item: {e}")
+            prefetch.cancelar()
+            tarefa_atual = executar_tarefa_em_segundo_plano(window, 'SCH Lote', gerar_sch_lote, csv_pontos_path, mb_folder, dict(values), controle=False)
+            window['-TAREFA_STATUS-'].update("SCH Lote: gerando arquivos .SCH...")
 
+        if event == '-LOTE_SCH_VARREDURA-':
+            csv_pontos_path = values['-LOTE_CSV-']
+            mb_folder = values['-LOTE_MB_FOLDER-']
+            grade_path = values['-LOTE_GRADE-']
 
-    if event == "Remover Selecionado":
-        try:
-            item_selecionado_display = values['-TIMELINE-'][0]
-            for item in timeline_data:
-                if item[0] == item_selecionado_display:
-                    timeline_data.remove(item)
-                    break
-            window['-TIMELINE-'].update(values=[item[0] for item in timeline_data])
+            if not all([csv_pontos_path, mb_folder, grade_path]):
+                sg.popup_error("Selecione o CSV de pontos, a Pasta LULC e o arquivo de grade (.json) na seção 'LOTE'.")
+                continue
+
+            try:
+                with open(grade_path, 'r', encoding='utf-8') as f:
+                    grade = json.load(f)
+            except Exception as e:
+                sg.popup_error(f"Erro ao ler a grade de varredura: {e}")
+                continue
+
+            prefetch.cancelar()
+            tarefa_atual = executar_tarefa_em_segundo_plano(window, 'SCH Varredura', gerar_sch_varredura, csv_pontos_path, mb_folder, grade, dict(values), controle=False)
+            window['-TAREFA_STATUS-'].update("SCH Varredura: gerando variantes .SCH...")
+
+        if event == '-GENERATE_LULC_BLOCKS-':
+            mb_csv_file = values['-MB_CSV_FILE-']
+            start_block = values['-MB_START_BLOCK_NUM-']
+            year_limit = values['-MB_YEAR_LIMIT-']
+
+            if not mb_csv_file or not os.path.exists(mb_csv_file):
+                sg.popup_error("Por favor, selecione um arquivo CSV de MapBiomas existente.")
+                continue
+
+            # A thread só consulta o maior 'last_year' da linha do tempo; os blocos entram nela (no loop de eventos) ao fim da tarefa
+            prefetch.cancelar()
+            tarefa_atual = executar_tarefa_em_segundo_plano(window, 'Blocos LULC', processar_mapbiomas_em_blocos, mb_csv_file, start_block, year_limit,
+                                                            timeline_data, dict(values), controle=False)
+            window['-TAREFA_STATUS-'].update("Blocos LULC: gerando...")
+
+
+        if event == "-ADD_BLOCO_CERRADO-":
+            last_year = values['-P_LAST_YEAR-']
+            out_year = values['-P_OUT_YEAR-']
+            weather_desc = values['-P_WEATHER_COMBO-']
+
+            try:
+                int(last_year)
+                int(out_year)
+            except ValueError:
+                sg.popup_error("Por favor, insira anos válidos (números inteiros) para o Bloco Padrão.")
+                continue
+
+            timeline_data.estender(criar_bloco_padrao_savana(last_year, out_year, weather_desc))
+
+            timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
             need_preview_update = True
-        except Exception:
-            pass
 
-    if event == "Limpar Tudo":
-        timeline_data = []
-        window['-TIMELINE-'].update(values=timeline_data)
-        need_preview_update = True
+        if event == '-ADD_BLOCO_DESMATAMENTO-':
+            last_year = values['-D_LAST_YEAR-']
+            out_year = values['-D_OUT_YEAR-']
+            weather_desc = values['-D_WEATHER_COMBO-']
 
-    if event == "Gerar Arquivo .SCH":
-        try:
-            if not timeline_data:
-                sg.popup_error("Linha do tempo está vazia!", "Adicione Blocos e Eventos primeiro.")
+            try:
+                int(last_year)
+                int(out_year)
+            except ValueError:
+                sg.popup_error("Por favor, insira anos válidos (números inteiros) para o Bloco de Desmatamento.")
                 continue
-            
-            nome_sitio = values["-SITIO-"]
-            if not nome_sitio:
-                sg.popup_error("O campo 'Nome do Sítio' está vazio.", "Por favor, defina um nome para o sítio (ex: Lu_AFGO).")
+
+            timeline_data.estender(criar_bloco_desmatamento(last_year, out_year, weather_desc))
+
+            timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+            need_preview_update = True
+
+        if event == "Adicionar Cabeçalho de Bloco Manual":
+            weather_desc = values['-B_WEATHER_COMBO-']
+
+            try:
+                int(values['-B_NUM-'])
+                last_year = values['-B_LAST_YEAR-']
+                out_year = values['-B_OUT_YEAR-']
+                int(values['-B_REPEATS-'])
+                int(out_year)
+                int(values['-B_OUT_MONTH-'])
+                int(values['-B_OUT_INTERVAL-'])
+            except ValueError:
+                sg.popup_error("Todos os campos do Bloco Manual (exceto Weather) devem ser números inteiros válidos.")
                 continue
-                
-            nome_arquivo_saida = f"{nome_sitio}.SCH"
-            
-            conteudo_final = update_full_preview(window, values, timeline_data)
-            
-            if not conteudo_final:
-                sg.popup_error("Erro ao gerar conteúdo final.")
+
+            bloco = {
+                'tipo': 'HEADER',
+                'num': values['-B_NUM-'], 'last_year': last_year,
+                'repeats': values['-B_REPEATS-'], 'out_year': out_year,
+                'out_month': values['-B_OUT_MONTH-'], 'out_interval': values['-B_OUT_INTERVAL-'],
+                'weather': weather_desc,
+                'block_description': f"Manual ({out_year}-{last_year})"
+            }
+            linha_display = f"BLOCO {bloco['num']} (Manual): LastYear={bloco['last_year']}, Clima: {WEATHER_DESC_TO_CODE.get(weather_desc, 'M')}"
+            timeline_data.adicionar(linha_display, bloco)
+            timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+            need_preview_update = True
+
+        if event == "Adicionar Evento Manual":
+            descricao_selecionada = values['-E_TIPO-']
+            # Obtém o código curto (ex: 'CROP')
+            tipo_evento_completo = EVENT_DESC_TO_CODE.get(descricao_selecionada) 
+            if tipo_evento_completo:
+                tipo_evento = tipo_evento_completo.split(':')[0]
+            else:
+                 tipo_evento = None
+
+            if not tipo_evento:
+                sg.popup_error("Selecione um 'Tipo de Evento/Opção' válido primeiro.")
                 continue
 
-            downloads_path = str(Path.home() / "Downloads")
-            caminho_completo_saida = os.path.join(downloads_path, nome_arquivo_saida)
+            try:
+                int(values['-E_MES-'])
+                int(values['-E_BLOCK_NUM-'])
+            except ValueError:
+                sg.popup_error("O Mês e o Ano de Repetição devem ser números inteiros válidos.")
+                continue
 
-            with open(caminho_completo_saida, "w") as f:
-                f.write(conteudo_final)
+            codigo_real = None
 
-            sg.popup_ok(f"Arquivo '{nome_arquivo_saida}' gerado com sucesso!",
-                        f"Salvo na sua pasta de Downloads:\n{caminho_completo_saida}")
+            if tipo_evento in CODIGOS_E_DESCRICOES:
+                display_selecionado = values['-E_CODIGO_COMBO-']
+                codigo_real = DISPLAY_PARA_CODIGO.get(display_selecionado)
+                # PLTM não tem código associado, IRRI/EROD não precisam de código específico, então relaxa a checagem para eles
+                if tipo_evento not in ['IRRI', 'EROD', 'PLTM'] and not codigo_real:
+                    sg.popup_error(f"Erro: Nenhum Código Específico selecionado para '{tipo_evento}'.")
+                    continue
+                linha_display = f"      EVENTO: {tipo_evento} -> ({codigo_real}), Mês={values['-E_MES-']}, RepetirAno={values['-E_BLOCK_NUM-']}"
+            else:
+                linha_display = f"      EVENTO: {tipo_evento}, Mês={values['-E_MES-']}, RepetirAno={values['-E_BLOCK_NUM-']}"
+
+            evento = {
+                'tipo': 'EVENT', 'event_type': tipo_evento, 'code': codigo_real, 
+                'month': values['-E_MES-'], 'block_num': values['-E_BLOCK_NUM-']
+            }
+            timeline_data.adicionar(linha_display, evento)
+            timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+            need_preview_update = True
+
+        if event == "Adicionar Terminador de Bloco (-999)":
+            terminator_data = {'tipo': 'TERMINATOR'}
+            linha_display = "--- FIM DO BLOCO (-999 -999 X) ---"
+            timeline_data.adicionar(linha_display, terminator_data)
+            timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+            need_preview_update = True
+
+        if event == "Carregar Item Selecionado":
+            try:
+                # Seleção pela posição na Listbox: displays repetidos não são ambíguos
+                _, _, selected_data = timeline_data.item_no_indice(window['-TIMELINE-'].get_indexes()[0])
+
+                if selected_data:
+                    tipo = selected_data.get('tipo')
+                    if tipo == 'HEADER':
+                        weather_desc = selected_data.get('weather', DEFAULT_WEATHER_M)
+                        window['-B_NUM-'].update(selected_data.get('num', ''))
+                        window['-B_LAST_YEAR-'].update(selected_data.get('last_year', ''))
+                        window['-B_REPEATS-'].update(selected_data.get('repeats', ''))
+                        window['-B_OUT_YEAR-'].update(selected_data.get('out_year', ''))
+                        window['-B_OUT_MONTH-'].update(selected_data.get('out_month', ''))
+                        window['-B_OUT_INTERVAL-'].update(selected_data.get('out_interval', ''))
+                        window['-B_WEATHER_COMBO-'].update(value=weather_desc)
+
+                    elif tipo == 'EVENT':
+                        event_type = selected_data.get('event_type', '')
+                        # Mapeia o código de volta para a descrição completa para preencher o combo
+                        event_desc = TIPOS_DE_EVENTO_COM_CODIGO.get(event_type) or TIPOS_DE_EVENTO_SEM_CODIGO.get(event_type)
+
+                        window['-E_TIPO-'].update(event_desc)
+                        # Força a atualização dos combos de código específico
+                        window.write_event_value('-E_TIPO-', event_desc)
+
+                        window['-E_MES-'].update(selected_data.get('month', ''))
+                        window['-E_BLOCK_NUM-'].update(selected_data.get('block_num', ''))
+
+                        if selected_data.get('code'):
+                            code = selected_data.get('code')
+                            codigos_dict = CODIGOS_E_DESCRICOES.get(event_type, {})
+                            desc = codigos_dict.get(code, '')
+                            display_text = f"{code} - {desc}"
+
+                            window.refresh()
+                            window['-E_CODIGO_COMBO-'].update(value=display_text)
+
+                    elif tipo == 'BLOCO_COMPLETO' or tipo == 'TERMINATOR':
+                        sg.popup_ok("Não é possível editar este tipo de item.\nRemova e adicione novamente, se necessário.", title="Aviso")
+
+            except IndexError:
+                pass
+            except Exception as e:
+                print(f"Erro ao carregar item: {e}")
+
+
+        if event == "Remover Selecionado":
+            try:
+                timeline_data.remover_indice(window['-TIMELINE-'].get_indexes()[0])
+                timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+                need_preview_update = True
+            except Exception:
+                pass
+
+        if event == "Limpar Tudo":
+            timeline_data.limpar()
+            timeline_data.aplicar_na_listbox(window['-TIMELINE-'])
+            need_preview_update = True
+
+        if event == "Gerar Arquivo .SCH":
+            try:
+                if not timeline_data:
+                    sg.popup_error("Linha do tempo está vazia!", "Adicione Blocos e Eventos primeiro.")
+                    continue
+
+                nome_sitio = values["-SITIO-"]
+                if not nome_sitio:
+                    sg.popup_error("O campo 'Nome do Sítio' está vazio.", "Por favor, defina um nome para o sítio (ex: Lu_AFGO).")
+                    continue
+
+                nome_arquivo_saida = f"{nome_sitio}.SCH"
+
+                conteudo_final = update_full_preview(window, values, timeline_data)
+
+                if not conteudo_final:
+                    sg.popup_error("Erro ao gerar conteúdo final.")
+                    continue
+
+                downloads_path = obter_pasta_saida()
+                caminho_completo_saida = os.path.join(downloads_path, nome_arquivo_saida)
+
+                salvar_texto(caminho_completo_saida, conteudo_final)
+
+                sg.popup_ok(f"Arquivo '{nome_arquivo_saida}' gerado com sucesso!",
+                            f"Salvo na pasta de saída:\n{caminho_completo_saida}")
+
+            except Exception as e:
+                sg.popup_error("Ocorreu um erro ao gerar o arquivo:", str(e))
+
+    window.close()
+
+    try:
+        for cache, caminho in CACHES_PERSISTENTES:
+            if manter_cache:
+                cache.salvar(caminho)
+            elif os.path.exists(caminho):
+                os.remove(caminho)
+    except Exception as e:
+        print(f"Aviso: não foi possível gravar o cache de sessão: {e}")
 
-        except Exception as e:
-            sg.popup_error("Ocorreu um erro ao gerar o arquivo:", str(e))
 
-window.close()
\ No newline at end of file
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in MODOS_LINHA_COMANDO:
+        sys.exit(MODOS_LINHA_COMANDO[sys.argv[1]](sys.argv[2:]))
+    main()
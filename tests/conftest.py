@@ -0,0 +1,5 @@
+import os
+import sys
+
+# century_gui.py fica na raiz do repositório (os processos dos shards herdam este sys.path)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
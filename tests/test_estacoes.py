@@ -0,0 +1,51 @@
+import os
+
+import pandas as pd
+
+import century_gui
+
+
+def test_indice_cobertura_cobrindo():
+    estacoes = [
+        {'completude': {2000: 1.0, 2001: 1.0, 2002: 1.0, 2003: 1.0}},
+        {'completude': {2000: 1.0, 2001: 1.0, 2003: 1.0}},               # sem 2002
+        {'completude': {2000: 1.0, 2001: 0.5, 2002: 1.0, 2003: 1.0}},    # 2001 pela metade
+        {'completude': {2001: 1.0, 2002: 1.0, 2003: 1.0}},               # começa depois de 2000
+        {'completude': {}},
+    ]
+    indice = century_gui.IndiceCobertura(estacoes)
+    assert indice.cobrindo(2000, 2003) == [0, 2]
+    assert indice.cobrindo(2000, 2003, completude_minima=0.8) == [0]
+    assert indice.cobrindo(2001, 2003) == [0, 2, 3]
+    assert indice.cobrindo(2000, 2001) == [0, 1, 2]
+    assert indice.cobrindo(2003, 2004) == []
+
+
+def test_buscas_nao_abrem_arquivos_das_estacoes(tmp_path):
+    datas = pd.date_range('2000-01-01', '2005-12-31').strftime('%Y-%m-%d')
+    for k, inicio in enumerate([0, 0, 800]):
+        pd.DataFrame({'data': datas[inicio:], 'latitude': -15.0 - k, 'longitude': -49.0, 'precipitacao': 1.0,
+                      'temp_min': 18.0, 'temp_max': 30.0}).to_csv(tmp_path / f"e{k}.csv", index=False)
+    century_gui.CATALOGOS_ESTACOES.limpar()
+    century_gui.COBERTURAS_ESTACOES.limpar()
+    century_gui.iniciar_metricas('catalogo')
+    century_gui.catalogo_estacoes_memorizado(str(tmp_path))
+    assert century_gui.finalizar_metricas()['contadores']['estacoes_lidas'] == 3
+
+    century_gui.iniciar_metricas('buscas')
+    simples = century_gui.encontrar_estacoes_proximas(str(tmp_path), '-15', '-49', 2, silencioso=True)
+    periodo = century_gui.encontrar_estacoes_proximas(str(tmp_path), '-15', '-49', 3, is_batch=True, anos=(2000, 2001))
+    contadores = century_gui.finalizar_metricas()['contadores']
+    assert contadores['estacoes_lidas'] == 0 and contadores['cabecalhos_estacoes_lidos'] == 0
+    assert '(Histórico: 2000-01-01 a 2005-12-31)' in simples['popup_message']
+    assert [os.path.basename(e['filepath']) for e in periodo['top_estacoes']] == ['e0.csv', 'e1.csv']
+
+    # Coberturas gravadas e relidas (sessão seguinte): o catálogo refeito só lê os cabeçalhos
+    caminho = str(tmp_path / 'coberturas.json')
+    century_gui.COBERTURAS_ESTACOES.salvar(caminho)
+    century_gui.COBERTURAS_ESTACOES.limpar()
+    century_gui.CATALOGOS_ESTACOES.limpar()
+    assert century_gui.COBERTURAS_ESTACOES.carregar(caminho) == 3
+    century_gui.iniciar_metricas('catalogo')
+    century_gui.catalogo_estacoes_memorizado(str(tmp_path))
+    assert century_gui.finalizar_metricas()['contadores']['estacoes_lidas'] == 0
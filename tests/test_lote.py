@@ -0,0 +1,83 @@
+import filecmp
+import os
+
+import pandas as pd
+import pytest
+
+import century_gui
+
+
+@pytest.fixture(scope='module')
+def dados(tmp_path_factory):
+    # Rasters pequenos: o lote inteiro roda em poucos segundos
+    return century_gui.gerar_fixtures_sinteticas(str(tmp_path_factory.mktemp('dados')), n_pontos=12, n_estacoes=6, tamanho_raster=200)
+
+
+def arquivos_saida(pasta):
+    return sorted(f for f in os.listdir(pasta) if os.path.isfile(os.path.join(pasta, f)) and not f.startswith('lote_'))
+
+
+def iguais(pasta_a, pasta_b, arquivos):
+    return [f for f in arquivos if not filecmp.cmp(os.path.join(pasta_a, f), os.path.join(pasta_b, f), shallow=False)]
+
+
+def observador(pasta, dados, estabilidade=0):
+    return century_gui.ObservadorPasta(str(pasta), dados['mb'], dados['solo'], '0-20cm', dados['inmet'], 3, 'ambos',
+                                       template_site100=dados['template'], estabilidade=estabilidade)
+
+
+def test_observador_processa_so_pontos_novos(dados, tmp_path):
+    entrada = tmp_path / 'entrada'
+    entrada.mkdir()
+    pontos = pd.read_csv(dados['pontos'])
+    campo = entrada / 'campo.csv'
+    pontos.head(3).to_csv(campo, index=False)
+
+    assert observador(entrada, dados).ciclo() == {'campo.csv': 3}
+    pontos.head(5).to_csv(campo, index=False)
+    obs = observador(entrada, dados)
+    assert obs.ciclo() == {'campo.csv': 2}
+    assert obs.ciclo() == {}
+    # O estado em disco evita reprocessar depois de reiniciar
+    assert observador(entrada, dados).ciclo() == {}
+
+    referencia = tmp_path / 'referencia'
+    century_gui.processar_lote_dados(str(campo), dados['mb'], dados['solo'], '0-20cm', dados['inmet'], 3, 'ambos',
+                                     pasta_saida=str(referencia), template_site100=dados['template'])
+    saida = entrada / 'campo_saida'
+    arquivos = arquivos_saida(referencia)
+    assert arquivos_saida(saida) == arquivos
+    assert iguais(referencia, saida, arquivos) == []
+    log = (entrada / 'campo.log').read_text(encoding='utf-8')
+    assert log.count('=== ') == 2 and 'Ponto 5/5' in log
+
+
+def test_observador_espera_arquivo_estabilizar(dados, tmp_path):
+    pd.read_csv(dados['pontos']).head(2).to_csv(tmp_path / 'novo.csv', index=False)
+    assert observador(tmp_path, dados, estabilidade=60).ciclo() == {}
+    assert observador(tmp_path, dados).ciclo() == {'novo.csv': 2}
+
+
+def test_lote_sharded_igual_ao_no_unico(dados, tmp_path):
+    pontos = tmp_path / 'pontos.csv'
+    tabela = pd.read_csv(dados['pontos'])
+    # Nome repetido em shards diferentes: vale o ponto de maior índice, como no nó único
+    tabela.loc[9, 'sitio'] = tabela.loc[1, 'sitio']
+    tabela.to_csv(pontos, index=False)
+    argumentos = (str(pontos), dados['mb'], dados['solo'], '0-20cm', dados['inmet'], 2, 'ambos')
+
+    unico = tmp_path / 'unico'
+    log_unico = century_gui.processar_lote_dados(*argumentos, pasta_saida=str(unico), template_site100=dados['template'])
+    shards = tmp_path / 'shards'
+    resultado = century_gui.executar_lote_sharded_local(*argumentos, 3, pasta_saida=str(shards), template_site100=dados['template'])
+
+    assert resultado['status'] == 'ok', resultado['message']
+    arquivos = arquivos_saida(unico)
+    assert arquivos_saida(shards) == arquivos
+    assert iguais(unico, shards, arquivos) == []
+    linhas = lambda log: [l for l in log.split('\n') if l.startswith(' Ponto')]
+    assert linhas(resultado['message']) == linhas(log_unico)
+
+
+def test_mesclar_shards_sem_shards(tmp_path):
+    assert century_gui.mesclar_shards(str(tmp_path))['status'] == 'erro'
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+import century_gui
+
+
+@pytest.fixture(scope='module')
+def dados(tmp_path_factory):
+    return century_gui.gerar_fixtures_sinteticas(str(tmp_path_factory.mktemp('dados')), n_pontos=6, n_estacoes=1, tamanho_raster=200)
+
+
+@pytest.mark.parametrize('profundidade, camada', [
+    ('0-20cm', None),
+    ('0-20cm,0-30cm', None),
+    ('0-20cm,0-30cm', '0-20cm'),
+])
+def test_extrair_solo_pontos_igual_a_extracao_por_ponto(dados, profundidade, camada):
+    pontos = pd.read_csv(dados['pontos']).rename(columns={'sitio': 'ponto', 'latitude': 'lat', 'longitude': 'lon'})
+    # Um ponto fora da extensão dos rasters vira erro do ponto, sem afetar os demais
+    pontos.loc[len(pontos)] = ['FORA', -30.0, -60.0]
+    lote = century_gui.extrair_solo_pontos(dados['solo'], profundidade, pontos, camada=camada)
+    assert lote['status'] == 'ok'
+
+    for pos, p in pontos.iterrows():
+        unico = century_gui.extrair_dados_solo(dados['solo'], profundidade, str(p['lat']), str(p['lon']), p['ponto'], camada=camada)
+        if unico['status'] != 'ok':
+            assert pos in lote['erros']
+            continue
+        assert pos not in lote['erros']
+        esperado = unico['data'].reset_index(drop=True)
+        obtido = lote['data'].iloc[[pos]].reset_index(drop=True)[list(esperado.columns)]
+        pd.testing.assert_frame_equal(obtido, esperado, check_dtype=False)
+        assert sorted(lote['substituidos'].get(pos, [])) == sorted(unico['substituidos'])
+    assert list(lote['erros']) == [len(pontos) - 1]